@@ -2,44 +2,98 @@
 标注管理 API
 """
 from typing import List, Optional
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Header, Response
 from fastapi.responses import JSONResponse
 
-from app.models import AnnotationSaveRequest, Annotation, BoundingBox
-from app.services.annotation import annotation_service
+from app.models import (
+    AnnotationSaveRequest, Annotation, BoundingBox,
+    AnnotationPatchOperation, AnnotationPatchRequest, BatchAnnotationPatchRequest, PatchOp,
+    AnnotationStorageFormat, AnnotationPackRequest
+)
+from app.services.annotation import annotation_service, VersionConflictError
+from app.services.annotation_index import SORTABLE_COLUMNS, AnnotationFilter
+from app.services.executor import task_executor
 
 router = APIRouter()
 
 
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """解析 If-Match 请求头中的版本号（支持 "3"、W/"3"、3 与 *）"""
+    if if_match is None:
+        return None
+    value = if_match.strip()
+    if value == "*":
+        return None
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无效的 If-Match: {if_match}")
+
+
+def version_conflict(e: VersionConflictError) -> HTTPException:
+    """版本冲突转换为 409 响应"""
+    return HTTPException(status_code=409, detail={
+        "message": str(e),
+        "image_id": e.image_id,
+        "expected_version": e.expected,
+        "current_version": e.current
+    })
+
+
 @router.post("/save")
-async def save_annotations(request: AnnotationSaveRequest):
+async def save_annotations(
+    request: AnnotationSaveRequest,
+    if_match: Optional[str] = Header(None)
+):
     """
     保存标注数据
+
+    通过 If-Match 头或请求体中的 version 指定期望版本，版本不一致时返回 409。
     """
     try:
-        result = annotation_service.save_annotations(request)
+        result = await task_executor.run_in_thread(
+            annotation_service.save_annotations, request, parse_if_match(if_match)
+        )
         return result
+    except VersionConflictError as e:
+        raise version_conflict(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/cache/stats")
+async def get_annotation_cache_stats():
+    """
+    获取标注文档缓存统计
+    """
+    return annotation_service.cache.stats()
+
+
 @router.get("/{image_id}")
-async def get_annotations(image_id: str):
+async def get_annotations(image_id: str, response: Response):
     """
-    获取指定图像的标注数据
+    获取指定图像的标注数据（ETag 为当前版本）
     """
     data = annotation_service.get_annotations(image_id)
     if data is None:
         raise HTTPException(status_code=404, detail="标注数据不存在")
+    response.headers["ETag"] = f'"{data.get("version", 0)}"'
     return data
 
 
 @router.delete("/{image_id}")
-async def delete_annotations(image_id: str):
+async def delete_annotations(image_id: str, if_match: Optional[str] = Header(None)):
     """
     删除标注数据
     """
-    success = annotation_service.delete_annotations(image_id)
+    try:
+        success = await task_executor.run_in_thread(
+            annotation_service.delete_annotations, image_id, parse_if_match(if_match)
+        )
+    except VersionConflictError as e:
+        raise version_conflict(e)
     if not success:
         raise HTTPException(status_code=404, detail="标注数据不存在")
     return {"success": True, "message": "标注已删除"}
@@ -48,127 +102,218 @@ async def delete_annotations(image_id: str):
 @router.get("/")
 async def list_annotations(
     page: int = Query(1, ge=1),
-    page_size: int = Query(20, ge=1, le=100)
+    page_size: int = Query(20, ge=1, le=1000),
+    sort_by: str = Query("updated_at", description="排序字段 (updated_at/created_at/image_id/annotation_count)"),
+    order: str = Query("desc", description="排序方向 (asc/desc)"),
+    search: Optional[str] = Query(None, description="按图像ID前缀过滤"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，传入时忽略 page 与排序参数"),
+    class_id: Optional[List[int]] = Query(None, description="包含任一指定类别"),
+    min_count: Optional[int] = Query(None, ge=0, description="最少标注数"),
+    max_count: Optional[int] = Query(None, ge=0, description="最多标注数"),
+    source: Optional[str] = Query(None, description="标注来源 (manual: 含人工标注, auto: 含自动标注)"),
+    updated_since: Optional[str] = Query(None, description="只返回此时间之后更新的标注（ISO 格式）"),
+    with_total: bool = Query(True, description="是否统计总数")
 ):
     """
     列出所有标注
+
+    支持页码分页与游标分页：遍历大量标注时使用返回的 next_cursor 逐页读取。
     """
-    all_annotations = annotation_service.list_annotations()
+    if sort_by not in SORTABLE_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"不支持的排序字段: {sort_by}")
+    if source not in (None, "manual", "auto"):
+        raise HTTPException(status_code=400, detail=f"不支持的标注来源: {source}")
+    
+    filters = AnnotationFilter(
+        search=search,
+        class_ids=tuple(class_id or ()),
+        min_count=min_count,
+        max_count=max_count,
+        source=source,
+        updated_since=updated_since
+    )
     
     # 分页
     start = (page - 1) * page_size
-    end = start + page_size
-    paginated = all_annotations[start:end]
+    try:
+        paginated, next_cursor = annotation_service.list_annotations(
+            offset=start,
+            limit=page_size,
+            sort_by=sort_by,
+            descending=order.lower() != "asc",
+            filters=filters,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     return {
         "items": paginated,
-        "total": len(all_annotations),
+        "total": annotation_service.count_annotations(filters) if with_total else None,
         "page": page,
-        "page_size": page_size
+        "page_size": page_size,
+        "next_cursor": next_cursor
+    }
+
+
+@router.post("/index/rebuild")
+async def rebuild_annotation_index():
+    """
+    从标注文件重建索引
+    """
+    count = await task_executor.run_in_thread(annotation_service.rebuild_index)
+    return {"success": True, "indexed": count}
+
+
+@router.post("/storage/convert")
+async def convert_annotation_storage(
+    storage_format: AnnotationStorageFormat = Query(..., description="目标存储格式 (json/columnar)")
+):
+    """
+    将所有标注文档转换为指定存储格式（之后的写入也使用该格式）
+    """
+    result = await task_executor.run_in_thread(annotation_service.convert_storage, storage_format)
+    return {"success": True, **result}
+
+
+@router.post("/packs")
+async def pack_annotations(request: AnnotationPackRequest):
+    """
+    将标注打包为列式数据集，供统计与导出按内存映射读取
+    """
+    result = await task_executor.run_in_thread(annotation_service.pack_annotations, request.image_ids)
+    return {"success": True, **result}
+
+
+@router.get("/packs/{pack_id}/stats")
+async def get_pack_stats(pack_id: str):
+    """
+    统计打包数据集的类别分布与框尺寸
+    """
+    pack = annotation_service.open_pack(pack_id)
+    if pack is None:
+        raise HTTPException(status_code=404, detail="打包数据不存在")
+    return await task_executor.run_in_thread(pack.stats)
+
+
+@router.patch("/{image_id}")
+async def patch_annotations(
+    image_id: str,
+    request: AnnotationPatchRequest,
+    response: Response,
+    if_match: Optional[str] = Header(None)
+):
+    """
+    批量修改单张图像的标注（按顺序执行 add/update/delete 操作，全部成功才写入）
+    """
+    expected = parse_if_match(if_match)
+    result = await apply_patch(
+        image_id, request.operations, expected if expected is not None else request.version
+    )
+    response.headers["ETag"] = f'"{result["version"]}"'
+    return {"success": True, **result}
+
+
+@router.post("/patch")
+async def patch_annotations_batch(request: BatchAnnotationPatchRequest):
+    """
+    跨图像批量修改标注，任一操作失败或版本冲突则不写入任何图像
+    """
+    patches, versions = {}, {}
+    for patch in request.patches:
+        patches.setdefault(patch.image_id, []).extend(patch.operations)
+        if patch.version is not None:
+            versions[patch.image_id] = patch.version
+    try:
+        results = await task_executor.run_in_thread(annotation_service.patch_many, patches, versions)
+    except VersionConflictError as e:
+        raise version_conflict(e)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    patched = {result["image_id"] for result in results}
+    return {
+        "success": True,
+        "results": results,
+        "missing": [image_id for image_id in patches if image_id not in patched]
     }
 
 
+async def apply_patch(
+    image_id: str,
+    operations: List[AnnotationPatchOperation],
+    expected_version: Optional[int] = None
+) -> dict:
+    """应用单张图像的补丁，并将错误转换为 HTTP 异常"""
+    try:
+        result = await task_executor.run_in_thread(
+            annotation_service.patch_annotations, image_id, operations, expected_version
+        )
+    except VersionConflictError as e:
+        raise version_conflict(e)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="标注不存在")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="标注数据不存在")
+    return result
+
+
 @router.put("/{image_id}/annotation/{annotation_id}")
 async def update_annotation(
     image_id: str,
     annotation_id: int,
-    annotation: Annotation
+    annotation: Annotation,
+    if_match: Optional[str] = Header(None)
 ):
     """
     更新单个标注
     """
-    data = annotation_service.get_annotations(image_id)
-    if data is None:
-        raise HTTPException(status_code=404, detail="标注数据不存在")
-    
-    # 找到并更新指定标注
-    found = False
-    for i, ann in enumerate(data["annotations"]):
-        if ann["id"] == annotation_id:
-            data["annotations"][i] = annotation.dict()
-            found = True
-            break
-    
-    if not found:
-        raise HTTPException(status_code=404, detail="标注不存在")
-    
-    # 保存更新
-    from datetime import datetime
-    data["updated_at"] = datetime.now().isoformat()
-    
-    request = AnnotationSaveRequest(
-        image_id=data["image_id"],
-        image_path=data["image_path"],
-        image_width=data["image_width"],
-        image_height=data["image_height"],
-        annotations=[Annotation(**ann) for ann in data["annotations"]]
-    )
-    
-    annotation_service.save_annotations(request)
-    return {"success": True, "message": "标注已更新"}
+    result = await apply_patch(image_id, [AnnotationPatchOperation(
+        op=PatchOp.UPDATE, id=annotation_id, value=annotation.dict()
+    )], parse_if_match(if_match))
+    return {"success": True, "version": result["version"], "message": "标注已更新"}
 
 
 @router.delete("/{image_id}/annotation/{annotation_id}")
-async def delete_single_annotation(image_id: str, annotation_id: int):
+async def delete_single_annotation(
+    image_id: str,
+    annotation_id: int,
+    if_match: Optional[str] = Header(None)
+):
     """
     删除单个标注
     """
-    data = annotation_service.get_annotations(image_id)
-    if data is None:
-        raise HTTPException(status_code=404, detail="标注数据不存在")
-    
-    # 过滤掉要删除的标注
-    original_count = len(data["annotations"])
-    data["annotations"] = [
-        ann for ann in data["annotations"] if ann["id"] != annotation_id
-    ]
-    
-    if len(data["annotations"]) == original_count:
-        raise HTTPException(status_code=404, detail="标注不存在")
-    
-    # 保存更新
-    from datetime import datetime
-    data["updated_at"] = datetime.now().isoformat()
-    
-    request = AnnotationSaveRequest(
-        image_id=data["image_id"],
-        image_path=data["image_path"],
-        image_width=data["image_width"],
-        image_height=data["image_height"],
-        annotations=[Annotation(**ann) for ann in data["annotations"]]
+    result = await apply_patch(
+        image_id, [AnnotationPatchOperation(op=PatchOp.DELETE, id=annotation_id)],
+        parse_if_match(if_match)
     )
-    
-    annotation_service.save_annotations(request)
-    return {"success": True, "message": "标注已删除"}
+    return {"success": True, "version": result["version"], "message": "标注已删除"}
 
 
 @router.post("/{image_id}/annotation")
-async def add_annotation(image_id: str, annotation: Annotation):
+async def add_annotation(
+    image_id: str,
+    annotation: Annotation,
+    if_match: Optional[str] = Header(None)
+):
     """
     添加新标注
     """
-    data = annotation_service.get_annotations(image_id)
-    if data is None:
-        raise HTTPException(status_code=404, detail="标注数据不存在")
-    
-    # 生成新ID
-    max_id = max([ann["id"] for ann in data["annotations"]], default=0)
-    annotation.id = max_id + 1
-    annotation.is_manual = True
-    
-    data["annotations"].append(annotation.dict())
-    
-    # 保存更新
-    from datetime import datetime
-    data["updated_at"] = datetime.now().isoformat()
-    
-    request = AnnotationSaveRequest(
-        image_id=data["image_id"],
-        image_path=data["image_path"],
-        image_width=data["image_width"],
-        image_height=data["image_height"],
-        annotations=[Annotation(**ann) for ann in data["annotations"]]
+    value = annotation.dict(exclude={"id"})
+    value["is_manual"] = True
+    result = await apply_patch(
+        image_id, [AnnotationPatchOperation(op=PatchOp.ADD, value=value)], parse_if_match(if_match)
     )
     
-    annotation_service.save_annotations(request)
-    return {"success": True, "annotation": annotation, "message": "标注已添加"}
+    annotation.id = result["added_ids"][0]
+    annotation.is_manual = True
+    return {
+        "success": True,
+        "annotation": annotation,
+        "version": result["version"],
+        "message": "标注已添加"
+    }
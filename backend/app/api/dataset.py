@@ -5,12 +5,16 @@ import os
 import yaml
 import shutil
 from pathlib import Path
-from typing import List, Optional
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from typing import List, Optional, Tuple
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
 from fastapi.responses import JSONResponse
 
 from app.config import settings, YOLOV5_DIR, DATASET_DIR
-from app.models import DatasetInfo
+from app.models import DatasetInfo, DedupeRequest, ImageHashType, DatasetSplit
+from app.services.detection_jobs import to_static_url, is_within, resolve_dataset_dir
+from app.services.executor import task_executor
+from app.services.image_hash_index import image_hash_index, HASH_COLUMNS
+from app.services.quality import hash_content
 
 router = APIRouter()
 
@@ -249,15 +253,40 @@ async def upload_dataset_images(
         except Exception as e:
             failed.append({"filename": file.filename, "error": str(e)})
     
+    # 增量更新近重复索引，并报告与划分中已有图像近似的上传文件
+    near_duplicates = await task_executor.run_in_thread(
+        index_uploaded_images, images_dir, [images_dir / name for name in uploaded]
+    )
+    
     return {
         "success": True,
         "uploaded": len(uploaded),
         "failed": len(failed),
         "uploaded_files": uploaded,
-        "failed_files": failed
+        "failed_files": failed,
+        "near_duplicates": near_duplicates
     }
 
 
+def index_uploaded_images(images_dir: Path, paths: List[Path]) -> dict:
+    """将新上传的图像加入哈希索引，返回 文件名 -> 同一目录中的近重复图像"""
+    if not paths:
+        return {}
+    hashes = image_hash_index.add_files(paths)
+    near_duplicates = {}
+    for path, (phash, _) in hashes.items():
+        matches = [
+            {"name": Path(match["path"]).name, "distance": match["distance"]}
+            for match in image_hash_index.query(
+                phash, settings.DUPLICATE_HAMMING_RADIUS, "phash", images_dir
+            )
+            if match["path"] != path
+        ]
+        if matches:
+            near_duplicates[Path(path).name] = matches
+    return near_duplicates
+
+
 @router.delete("/{dataset_name}")
 async def delete_dataset(dataset_name: str):
     """
@@ -363,3 +392,155 @@ async def list_dataset_images(
         "page": page,
         "page_size": page_size
     }
+
+
+def dataset_split_dirs(dataset_name: str, split: DatasetSplit) -> Tuple[Path, Path]:
+    """
+    数据集划分的 (图像目录, 标签目录)，拒绝 CUSTOM_DATASET_DIR 之外的路径
+    """
+    try:
+        dataset_dir = resolve_dataset_dir(dataset_name)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    images_dir = (dataset_dir / "images" / split.value).resolve()
+    labels_dir = (dataset_dir / "labels" / split.value).resolve()
+    root = Path(settings.CUSTOM_DATASET_DIR)
+    if not (is_within(images_dir, root) and is_within(labels_dir, root)):
+        raise HTTPException(status_code=403, detail=f"不允许访问的数据集: {dataset_name}")
+    if not images_dir.is_dir():
+        raise HTTPException(status_code=404, detail="数据集划分不存在")
+    return images_dir, labels_dir
+
+
+def duplicate_clusters(directory: Path, radius: int, hash_type: ImageHashType) -> dict:
+    """增量同步目录的哈希后返回近重复簇"""
+    synced = image_hash_index.sync(directory)
+    clusters = image_hash_index.clusters(directory, radius, hash_type.value)
+    return {"synced": synced, "clusters": clusters}
+
+
+def present_clusters(clusters: List[dict]) -> List[dict]:
+    """将簇中的服务器路径转换为静态访问路径"""
+    return [
+        {
+            "keep": to_static_url(Path(cluster["keep"])),
+            "duplicates": [to_static_url(Path(p)) for p in cluster["duplicates"]],
+            "distances": cluster["distances"],
+            "size": cluster["size"],
+        }
+        for cluster in clusters
+    ]
+
+
+@router.get("/duplicates/uploads")
+async def find_upload_duplicates(
+    radius: Optional[int] = Query(None, ge=0, le=64, description="最大 Hamming 距离"),
+    hash_type: ImageHashType = Query(ImageHashType.PHASH, description="哈希类型")
+):
+    """
+    报告上传目录 (uploads/images) 中的近重复图像簇
+    """
+    radius = settings.DUPLICATE_HAMMING_RADIUS if radius is None else radius
+    found = await task_executor.run_in_thread(
+        duplicate_clusters, Path(settings.UPLOAD_DIR) / "images", radius, hash_type
+    )
+    clusters = present_clusters(found["clusters"])
+    return {"clusters": clusters, "total": len(clusters), "radius": radius, "synced": found["synced"]}
+
+
+@router.post("/duplicates/query")
+async def query_duplicates(
+    file: UploadFile = File(..., description="要查询的图像"),
+    radius: Optional[int] = Form(None, ge=0, le=64, description="最大 Hamming 距离"),
+    hash_type: ImageHashType = Form(ImageHashType.PHASH, description="哈希类型")
+):
+    """
+    在已索引的数据集与上传图像中查找与给定图像近似的图像
+    """
+    content = await file.read()
+    hashes = await task_executor.run_in_process(hash_content, content)
+    if hashes is None:
+        raise HTTPException(status_code=400, detail="无法解码图像")
+    radius = settings.DUPLICATE_HAMMING_RADIUS if radius is None else radius
+    matches = await task_executor.run_in_thread(
+        image_hash_index.query, hashes[HASH_COLUMNS[hash_type.value]], radius, hash_type.value
+    )
+    return {
+        "phash": f"{hashes[0]:016x}",
+        "dhash": f"{hashes[1]:016x}",
+        "matches": [{**m, "path": to_static_url(Path(m["path"]))} for m in matches],
+        "total": len(matches)
+    }
+
+
+@router.get("/duplicates/stats")
+async def get_duplicate_index_stats():
+    """获取近重复索引统计"""
+    return image_hash_index.stats()
+
+
+@router.get("/{dataset_name}/duplicates")
+async def find_dataset_duplicates(
+    dataset_name: str,
+    split: DatasetSplit = Query(DatasetSplit.TRAIN, description="数据集划分"),
+    radius: Optional[int] = Query(None, ge=0, le=64, description="最大 Hamming 距离"),
+    hash_type: ImageHashType = Query(ImageHashType.PHASH, description="哈希类型")
+):
+    """
+    报告数据集划分中的近重复图像簇（每簇保留分辨率最高的图像）
+    """
+    images_dir, _ = dataset_split_dirs(dataset_name, split)
+    radius = settings.DUPLICATE_HAMMING_RADIUS if radius is None else radius
+    found = await task_executor.run_in_thread(duplicate_clusters, images_dir, radius, hash_type)
+    clusters = present_clusters(found["clusters"])
+    return {
+        "clusters": clusters,
+        "total": len(clusters),
+        "duplicate_count": sum(len(c["duplicates"]) for c in clusters),
+        "radius": radius,
+        "synced": found["synced"]
+    }
+
+
+def remove_duplicates(images_dir: Path, labels_dir: Path, clusters: List[dict], radius: int) -> List[str]:
+    """
+    删除各簇中除保留图像外的图像及其标签，返回删除的图像路径
+
+    只删除与保留图像的距离不超过 radius 的成员。
+    """
+    removed = []
+    for cluster in clusters:
+        for path, distance in zip(map(Path, cluster["duplicates"]), cluster["distances"]):
+            if distance > radius:
+                continue
+            path.unlink(missing_ok=True)
+            (labels_dir / f"{path.stem}.txt").unlink(missing_ok=True)
+            removed.append(path)
+    image_hash_index.remove_files(removed)
+    return [str(p) for p in removed]
+
+
+@router.post("/{dataset_name}/dedupe")
+async def dedupe_dataset(dataset_name: str, request: DedupeRequest):
+    """
+    对数据集划分去重：每个近重复簇只保留分辨率最高的图像，
+    删除其余图像及对应的 YOLO 标签（dry_run 时只返回将被删除的文件）
+    """
+    images_dir, labels_dir = dataset_split_dirs(dataset_name, request.split)
+    radius = settings.DUPLICATE_HAMMING_RADIUS if request.radius is None else request.radius
+    found = await task_executor.run_in_thread(duplicate_clusters, images_dir, radius, request.hash_type)
+    
+    removed = []
+    if not request.dry_run:
+        removed = await task_executor.run_in_thread(
+            remove_duplicates, images_dir, labels_dir, found["clusters"], radius
+        )
+    
+    return {
+        "success": True,
+        "dry_run": request.dry_run,
+        "clusters": present_clusters(found["clusters"]),
+        "duplicate_count": sum(len(c["duplicates"]) for c in found["clusters"]),
+        "removed": [to_static_url(Path(p)) for p in removed],
+        "radius": radius
+    }
@@ -2,28 +2,129 @@
 目标检测 API
 """
 import os
+import json
 import uuid
 import shutil
+import asyncio
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Union, Dict, Any, AsyncIterator
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from app.config import settings
-from app.models import DetectionRequest, DetectionResult, get_class_info
-from app.services.detector import detector
+from app.models import (
+    DetectionRequest, DetectionResult, CompactDetectionResult, ResponseFormat, StreamFormat,
+    DetectionJobRequest, get_class_info
+)
+from app.services.detector import detector, decode_image
+from app.services.scheduler import inference_scheduler
+from app.services.executor import task_executor
+from app.services.detection_cache import detection_cache
+from app.services.detection_jobs import submit_detection_job
+from app.services.jobs import job_manager
 
 router = APIRouter()
 
 
-@router.post("/detect", response_model=DetectionResult)
+def save_upload(content: bytes, file_name: str) -> bool:
+    """
+    保存上传图像，文件名由内容哈希生成，相同内容只保存一份
+
+    Returns:
+        本次是否新写入了文件
+    """
+    save_path = Path(settings.UPLOAD_DIR) / "images" / file_name
+    if save_path.exists():
+        return False
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    # 先写临时文件再替换，避免并发上传同一图像时读到不完整文件
+    tmp_path = save_path.with_name(f".{uuid.uuid4().hex}.tmp")
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, save_path)
+    return True
+
+
+async def detect_content(
+    content: bytes,
+    file_ext: str,
+    conf_threshold: float = 0.25,
+    iou_threshold: float = 0.45,
+    img_size: int = 640,
+    weights: str = "yolov5s.pt",
+    classes: Optional[List[int]] = None,
+    compact: bool = False,
+    save_image: bool = True,
+    use_cache: bool = True
+) -> Union[DetectionResult, CompactDetectionResult]:
+    """
+    检测单张上传图像的字节内容
+
+    依次完成：内容哈希、缓存查询、按哈希去重落盘（与推理并行）、
+    内存解码一次后交给调度器合批推理。
+    """
+    content_hash = await task_executor.run_in_thread(detection_cache.hash_content, content)
+    file_name = f"{content_hash}{file_ext.lower()}"
+    save_path = Path(settings.UPLOAD_DIR) / "images" / file_name
+    save_task = None
+    
+    try:
+        # 原图按内容哈希去重落盘，与推理并行执行
+        if save_image:
+            save_task = asyncio.ensure_future(
+                task_executor.run_in_thread(save_upload, content, file_name)
+            )
+        
+        cache_key = detection_cache.make_key(
+            content_hash, weights, conf_threshold, iou_threshold, img_size, classes, compact
+        )
+        result = None
+        if use_cache:
+            result = await task_executor.run_in_thread(detection_cache.get, cache_key)
+        
+        if result is None:
+            # 上传内容只在内存中解码一次，尺寸与推理共用同一数组
+            image = await task_executor.run_in_thread(decode_image, content)
+            
+            # 执行检测（由调度器与其他并发请求合并为微批次）
+            result = await inference_scheduler.detect(
+                image_path=str(save_path),
+                image=image,
+                conf_threshold=conf_threshold,
+                iou_threshold=iou_threshold,
+                img_size=img_size,
+                weights=weights,
+                classes=classes,
+                compact=compact
+            )
+            await task_executor.run_in_thread(detection_cache.put, cache_key, result)
+        
+        if save_task is not None:
+            await save_task
+        
+        # 更新图像路径为相对路径（用于前端访问）
+        result.image_path = f"/uploads/images/{file_name}" if save_image else ""
+        return result
+    
+    except Exception:
+        # 只清理本次新写入的文件，已存在的同内容图像可能被其他结果引用
+        if save_task is not None:
+            created = await asyncio.gather(save_task, return_exceptions=True)
+            if created[0] is True:
+                save_path.unlink(missing_ok=True)
+        raise
+
+
+@router.post("/detect", response_model=Union[DetectionResult, CompactDetectionResult])
 async def detect_image(
     file: UploadFile = File(..., description="要检测的图像文件"),
     conf_threshold: float = Form(0.25, description="置信度阈值"),
     iou_threshold: float = Form(0.45, description="IOU阈值"),
     img_size: int = Form(640, description="推理图像尺寸"),
     weights: str = Form("yolov5s.pt", description="模型权重"),
-    classes: Optional[str] = Form(None, description="类别ID列表，逗号分隔")
+    classes: Optional[str] = Form(None, description="类别ID列表，逗号分隔"),
+    response_format: ResponseFormat = Form(ResponseFormat.OBJECTS, description="响应格式 (objects/columnar)"),
+    save_image: bool = Form(True, description="是否保存原始图像"),
+    use_cache: bool = Form(True, description="是否使用检测结果缓存")
 ):
     """
     对上传的图像进行目标检测
@@ -35,41 +136,27 @@ async def detect_image(
             detail=f"不支持的文件类型: {file.content_type}"
         )
     
-    # 保存上传文件
-    file_id = str(uuid.uuid4())
-    file_ext = Path(file.filename).suffix
-    save_path = Path(settings.UPLOAD_DIR) / "images" / f"{file_id}{file_ext}"
-    save_path.parent.mkdir(parents=True, exist_ok=True)
-    
     try:
-        with open(save_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
         # 解析类别列表
         class_list = None
         if classes:
             class_list = [int(c.strip()) for c in classes.split(",")]
         
-        # 执行检测
-        result = detector.detect(
-            image_path=str(save_path),
+        content = await file.read()
+        return await detect_content(
+            content,
+            Path(file.filename).suffix,
             conf_threshold=conf_threshold,
             iou_threshold=iou_threshold,
             img_size=img_size,
             weights=weights,
-            classes=class_list
+            classes=class_list,
+            compact=response_format == ResponseFormat.COLUMNAR,
+            save_image=save_image,
+            use_cache=use_cache
         )
         
-        # 更新图像路径为相对路径（用于前端访问）
-        result.image_path = f"/uploads/images/{file_id}{file_ext}"
-        
-        return result
-        
     except Exception as e:
-        # 清理文件
-        if save_path.exists():
-            save_path.unlink()
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -79,45 +166,163 @@ async def detect_images_batch(
     conf_threshold: float = Form(0.25),
     iou_threshold: float = Form(0.45),
     img_size: int = Form(640),
-    weights: str = Form("yolov5s.pt")
+    weights: str = Form("yolov5s.pt"),
+    response_format: ResponseFormat = Form(ResponseFormat.OBJECTS),
+    use_cache: bool = Form(True, description="是否使用检测结果缓存"),
+    stream: Optional[StreamFormat] = Form(None, description="流式输出格式 (ndjson/sse)，为空时一次性返回")
 ):
     """
     批量目标检测
     """
-    results = []
+    compact = response_format == ResponseFormat.COLUMNAR
+    
+    if stream is not None:
+        records = stream_batch_records(
+            files,
+            conf_threshold=conf_threshold,
+            iou_threshold=iou_threshold,
+            img_size=img_size,
+            weights=weights,
+            compact=compact,
+            use_cache=use_cache
+        )
+        if stream == StreamFormat.SSE:
+            return StreamingResponse(
+                (f"event: {r['event']}\ndata: {json.dumps(r, ensure_ascii=False)}\n\n" async for r in records),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        return StreamingResponse(
+            (json.dumps(r, ensure_ascii=False) + "\n" async for r in records),
+            media_type="application/x-ndjson",
+            headers={"X-Accel-Buffering": "no"}
+        )
     
-    for file in files:
+    results = {}
+    pending = []
+    
+    async def prepare(file: UploadFile):
+        """计算哈希，缓存未命中时解码图像，并按内容去重落盘"""
+        content = await file.read()
+        content_hash = await task_executor.run_in_thread(detection_cache.hash_content, content)
+        file_name = f"{content_hash}{Path(file.filename).suffix.lower()}"
+        cache_key = detection_cache.make_key(
+            content_hash, weights, conf_threshold, iou_threshold, img_size, None, compact
+        )
+        
+        cached = None
+        if use_cache:
+            cached = await task_executor.run_in_thread(detection_cache.get, cache_key)
+        
+        # 先解码再落盘，无法解码的文件不会被保存
+        image = None
+        if cached is None:
+            image = await task_executor.run_in_thread(decode_image, content)
+        await task_executor.run_in_thread(save_upload, content, file_name)
+        return file_name, cache_key, cached, image
+    
+    for index, file in enumerate(files):
         if file.content_type not in settings.ALLOWED_IMAGE_TYPES:
             continue
         
-        file_id = str(uuid.uuid4())
-        file_ext = Path(file.filename).suffix
-        save_path = Path(settings.UPLOAD_DIR) / "images" / f"{file_id}{file_ext}"
-        save_path.parent.mkdir(parents=True, exist_ok=True)
-        
         try:
-            with open(save_path, "wb") as f:
-                content = await file.read()
-                f.write(content)
-            
-            result = detector.detect(
-                image_path=str(save_path),
+            file_name, cache_key, cached, image = await prepare(file)
+            if cached is not None:
+                cached.image_path = f"/uploads/images/{file_name}"
+                results[index] = cached
+            else:
+                pending.append((index, file, file_name, cache_key, image))
+        except Exception as e:
+            results[index] = {
+                "error": str(e),
+                "filename": file.filename
+            }
+    
+    async def detect_pending(batch: List[tuple]):
+        """批量推理；整批失败时逐张重试，只有出错的图像返回错误"""
+        try:
+            batch_results = await task_executor.run_in_thread(
+                detector.detect_batch,
+                [str(Path(settings.UPLOAD_DIR) / "images" / name) for _, _, name, _, _ in batch],
                 conf_threshold=conf_threshold,
                 iou_threshold=iou_threshold,
                 img_size=img_size,
-                weights=weights
+                weights=weights,
+                compact=compact,
+                images=[image for _, _, _, _, image in batch]
             )
-            
-            result.image_path = f"/uploads/images/{file_id}{file_ext}"
-            results.append(result)
-            
         except Exception as e:
-            results.append({
-                "error": str(e),
-                "filename": file.filename
-            })
+            if len(batch) == 1:
+                index, file = batch[0][:2]
+                results[index] = {
+                    "error": str(e),
+                    "filename": file.filename
+                }
+                return
+            for item in batch:
+                await detect_pending([item])
+            return
+        
+        for (index, _, file_name, cache_key, _), result in zip(batch, batch_results):
+            result.image_path = f"/uploads/images/{file_name}"
+            await task_executor.run_in_thread(detection_cache.put, cache_key, result)
+            results[index] = result
+    
+    if pending:
+        # 仅对缓存未命中的图像按微批次执行批量推理
+        await detect_pending(pending)
     
-    return {"results": results, "total": len(results)}
+    # 按上传顺序返回
+    ordered = [results[index] for index in sorted(results)]
+    return {"results": ordered, "total": len(ordered)}
+
+
+async def stream_batch_records(
+    files: List[UploadFile],
+    window: int = None,
+    **params
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    逐张产出批量检测记录（谁先完成谁先输出）
+
+    同时在途的图像数受 window 限制，上传内容在处理时才读取，
+    服务端内存不随批次大小增长。并发的单图请求由调度器合并为微批次。
+    每条记录带 index（上传顺序），错误以 event=error 记录内联返回，
+    最后输出一条 event=done 的汇总记录。
+    """
+    window = window or settings.SCHEDULER_MAX_BATCH_SIZE
+    
+    async def process(index: int, file: UploadFile) -> Dict[str, Any]:
+        record = {"index": index, "filename": file.filename}
+        if file.content_type not in settings.ALLOWED_IMAGE_TYPES:
+            return {**record, "event": "error", "error": f"不支持的文件类型: {file.content_type}"}
+        try:
+            content = await file.read()
+            result = await detect_content(content, Path(file.filename).suffix, **params)
+            return {**record, "event": "result", "result": result.model_dump()}
+        except Exception as e:
+            return {**record, "event": "error", "error": str(e)}
+    
+    pending = iter(enumerate(files))
+    in_flight = set()
+    completed = failed = 0
+    
+    while True:
+        for index, file in pending:
+            in_flight.add(asyncio.ensure_future(process(index, file)))
+            if len(in_flight) >= window:
+                break
+        if not in_flight:
+            break
+        
+        done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            record = task.result()
+            completed += 1
+            failed += record["event"] == "error"
+            yield record
+    
+    yield {"event": "done", "total": completed, "failed": failed}
 
 
 @router.post("/detect/url")
@@ -142,9 +347,9 @@ async def detect_from_url(
     
     try:
         # 下载图像
-        urllib.request.urlretrieve(image_url, str(save_path))
+        await task_executor.run_in_thread(urllib.request.urlretrieve, image_url, str(save_path))
         
-        result = detector.detect(
+        result = await inference_scheduler.detect(
             image_path=str(save_path),
             conf_threshold=conf_threshold,
             iou_threshold=iou_threshold,
@@ -161,10 +366,54 @@ async def detect_from_url(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/jobs")
+async def create_detection_job(request: DetectionJobRequest):
+    """
+    创建批量检测任务（数据集划分或服务器目录）
+    """
+    if not request.dataset and not request.source_dir:
+        raise HTTPException(status_code=400, detail="需要指定 dataset 或 source_dir")
+    if request.dataset and request.split not in ["train", "val", "test"]:
+        raise HTTPException(status_code=400, detail="无效的数据集划分")
+    
+    try:
+        return submit_detection_job(request.model_dump())
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/jobs")
+async def list_detection_jobs():
+    """列出批量检测任务"""
+    jobs = job_manager.list("detection")
+    return {"jobs": jobs, "total": len(jobs)}
+
+
+@router.get("/jobs/{job_id}")
+async def get_detection_job(job_id: str):
+    """获取批量检测任务进度"""
+    job = job_manager.get(job_id)
+    if job is None or job["kind"] != "detection":
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@router.post("/jobs/{job_id}/stop")
+async def stop_detection_job(job_id: str):
+    """停止批量检测任务（已完成的批次保留在检查点中）"""
+    if not job_manager.stop(job_id):
+        raise HTTPException(status_code=400, detail="任务不存在或已结束")
+    return {"success": True, "message": "已请求停止任务"}
+
+
 @router.get("/weights")
 async def get_available_weights():
     """获取可用的模型权重列表"""
-    weights = detector.get_available_weights()
+    weights = await task_executor.run_in_thread(detector.get_available_weights)
     return {"weights": weights}
 
 
@@ -174,11 +423,31 @@ async def get_classes():
     return {"classes": get_class_info()}
 
 
+@router.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """获取推理调度统计"""
+    return inference_scheduler.stats()
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """获取检测结果缓存统计"""
+    return detection_cache.stats()
+
+
+@router.delete("/cache")
+async def clear_cache():
+    """清空检测结果缓存"""
+    count = await task_executor.run_in_thread(detection_cache.clear)
+    return {"success": True, "cleared_items": count}
+
+
 @router.get("/model/info")
 async def get_model_info(weights: str = Query("yolov5s.pt")):
     """获取模型信息"""
     try:
-        info = detector.get_model_info(weights)
+        # 首次访问会加载模型，放到线程池中执行
+        info = await task_executor.run_in_thread(detector.get_model_info, weights)
         return info
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
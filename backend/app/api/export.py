@@ -3,16 +3,21 @@
 """
 import os
 import uuid
-import zipfile
 import shutil
 from pathlib import Path
 from typing import List
-from fastapi import APIRouter, HTTPException, Query, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, Response
 
 from app.config import settings
 from app.models import ExportRequest, ExportFormat
 from app.services.annotation import annotation_service
+from app.services.executor import task_executor
+from app.services.export_jobs import (
+    write_export_zip, submit_export_job, export_artifact_path, cleanup_expired_exports
+)
+from app.services.jobs import job_manager
+from app.services.zip_stream import stream_zip
 
 router = APIRouter()
 
@@ -23,7 +28,8 @@ async def export_annotations(request: ExportRequest):
     导出标注数据
     """
     try:
-        result = annotation_service.export_annotations(
+        result = await task_executor.run_in_thread(
+            annotation_service.export_annotations,
             image_ids=request.image_ids,
             format=request.format
         )
@@ -33,57 +39,138 @@ async def export_annotations(request: ExportRequest):
 
 
 @router.post("/download")
-async def export_and_download(
-    request: ExportRequest,
-    background_tasks: BackgroundTasks
-):
+async def export_and_download(request: ExportRequest):
     """
-    导出标注并下载为ZIP文件
+    导出标注并以流式 ZIP 下载（不在磁盘上暂存）
     """
+    export_id = str(uuid.uuid4())[:8]
+    filename = f"annotations_{request.format.value}_{export_id}.zip"
+    return StreamingResponse(
+        stream_zip(lambda zf: write_export_zip(zf, request)),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@router.post("/jobs")
+async def create_export_job(request: ExportRequest):
+    """
+    创建后台导出任务，完成后通过 download_url 下载
+    """
+    await task_executor.run_in_thread(cleanup_expired_exports)
+    return submit_export_job(request)
+
+
+@router.get("/jobs")
+async def list_export_jobs():
+    """列出导出任务"""
+    jobs = job_manager.list("export")
+    return {"jobs": jobs, "total": len(jobs)}
+
+
+@router.get("/jobs/{job_id}")
+async def get_export_job(job_id: str):
+    """获取导出任务进度（已处理条目数与已写入字节数）"""
+    job = job_manager.get(job_id)
+    if job is None or job["kind"] != "export":
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@router.post("/jobs/{job_id}/stop")
+async def stop_export_job(job_id: str):
+    """停止导出任务（未完成的产物会被删除）"""
+    if not job_manager.stop(job_id):
+        raise HTTPException(status_code=400, detail="任务不存在或已结束")
+    return {"success": True, "message": "已请求停止任务"}
+
+
+def parse_range(range_header: str, size: int):
+    """
+    解析单个字节范围（bytes=start-end / bytes=start- / bytes=-suffix）
+    
+    Returns:
+        (start, end) 闭区间；无法满足时返回 None
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
     try:
-        # 创建临时导出目录
-        export_id = str(uuid.uuid4())[:8]
-        export_dir = Path(settings.EXPORT_DIR) / f"export_{export_id}"
-        export_dir.mkdir(parents=True, exist_ok=True)
-        
-        # 导出标注
-        result = annotation_service.export_annotations(
-            image_ids=request.image_ids,
-            format=request.format,
-            output_dir=str(export_dir)
-        )
-        
-        # 如果需要包含图像
-        if request.include_images:
-            images_dir = export_dir / "images"
-            images_dir.mkdir(exist_ok=True)
-            
-            for image_id in request.image_ids:
-                data = annotation_service.get_annotations(image_id)
-                if data and data.get("image_path"):
-                    src_path = Path(settings.UPLOAD_DIR).parent / data["image_path"].lstrip("/")
-                    if src_path.exists():
-                        shutil.copy(src_path, images_dir / src_path.name)
-        
-        # 创建 ZIP 文件
-        zip_path = Path(settings.EXPORT_DIR) / f"export_{export_id}.zip"
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file_path in export_dir.rglob("*"):
-                if file_path.is_file():
-                    arcname = file_path.relative_to(export_dir)
-                    zipf.write(file_path, arcname)
-        
-        # 清理临时目录
-        background_tasks.add_task(shutil.rmtree, export_dir)
-        
-        return FileResponse(
-            path=str(zip_path),
-            filename=f"annotations_{request.format.value}_{export_id}.zip",
-            media_type="application/zip"
+        if first == "":
+            length = int(last)
+            if length <= 0:
+                return None
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def iter_file_range(path: Path, start: int, length: int, block_size: int = 1024 * 1024):
+    """按块读取文件的指定范围"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+@router.get("/jobs/{job_id}/download")
+async def download_export_job(job_id: str, request: Request):
+    """
+    下载导出任务产物，支持 Range 请求以断点续传
+    """
+    job = job_manager.get(job_id)
+    if job is None or job["kind"] != "export":
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail="任务尚未完成")
+    path = export_artifact_path(job_id)
+    if not path.is_file():
+        raise HTTPException(status_code=410, detail="导出文件已过期清理")
+    
+    stat = path.stat()
+    size = stat.st_size
+    etag = f'"{int(stat.st_mtime)}-{size}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="{path.name}"',
+    }
+    
+    # If-Range 与当前文件不一致时返回完整内容
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        length = end - start + 1
+        return StreamingResponse(
+            iter_file_range(path, start, length),
+            status_code=206,
+            media_type="application/zip",
+            headers={
+                **headers,
+                "Content-Range": f"bytes {start}-{end}/{size}",
+                "Content-Length": str(length),
+            }
         )
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    return StreamingResponse(
+        iter_file_range(path, 0, size),
+        media_type="application/zip",
+        headers={**headers, "Content-Length": str(size)}
+    )
 
 
 @router.get("/formats")
@@ -101,20 +188,28 @@ async def get_export_formats():
     }
 
 
-@router.delete("/clean")
-async def clean_exports():
-    """
-    清理导出目录
-    """
+def clean_export_dir() -> int:
+    """清理导出目录，返回清理的条目数"""
     export_path = Path(settings.EXPORT_DIR)
     count = 0
     
     for item in export_path.iterdir():
         if item.is_file():
+            if item.name == ".gitkeep":
+                continue
             item.unlink()
             count += 1
         elif item.is_dir():
             shutil.rmtree(item)
             count += 1
     
+    return count
+
+
+@router.delete("/clean")
+async def clean_exports():
+    """
+    清理导出目录
+    """
+    count = await task_executor.run_in_thread(clean_export_dir)
     return {"success": True, "cleaned_items": count}
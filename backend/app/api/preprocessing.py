@@ -3,35 +3,38 @@
 """
 import os
 import uuid
-import cv2
-import numpy as np
+import asyncio
+from dataclasses import asdict
 from pathlib import Path
 from typing import List, Optional
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from PIL import Image, ImageEnhance, ImageFilter
 
 from app.config import settings
-from app.models import PreprocessingConfig
+from app.models import (
+    PreprocessingConfig, AnnotatedAugmentRequest, AnnotationSaveRequest, DatasetAugmentJobRequest,
+    QualityScanJobRequest
+)
+from app.services.annotation import annotation_service
+from app.services.executor import task_executor
+from app.services.augmentation import AugmentConfig, augment_file, augment_file_with_boxes
+from app.services.augment_jobs import submit_augment_job
+from app.services.export_jobs import resolve_image_path
+from app.services.jobs import job_manager
+from app.services.quality import analyze_content
+from app.services.quality_jobs import submit_quality_scan_job
 
 router = APIRouter()
 
 
-def cv2_imread(image_path: str, flags=cv2.IMREAD_COLOR):
+def check_image_quality_file(content: bytes) -> dict:
     """
-    读取图像，支持中文路径
+    计算图像模糊度并读取图像信息（在进程池中运行，直接从内存解码）
     """
-    # 使用 numpy 读取文件，避免中文路径问题
-    img_array = np.fromfile(image_path, dtype=np.uint8)
-    img = cv2.imdecode(img_array, flags)
-    return img
-
-
-def calculate_blur_score(image_path: str) -> float:
-    """计算图像模糊度分数（拉普拉斯方差）"""
-    img = cv2_imread(image_path, cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        return 0.0
-    return cv2.Laplacian(img, cv2.CV_64F).var()
+    metrics = analyze_content(content)
+    return {
+        "blur_score": metrics["blur_score"],
+        "image_info": {key: metrics[key] for key in ("width", "height", "format", "mode")}
+    }
 
 
 @router.post("/augment")
@@ -50,91 +53,108 @@ async def augment_image(
     """
     对图像进行数据增强
     """
-    # 保存原始文件
     file_id = str(uuid.uuid4())
     file_ext = Path(file.filename).suffix
     
-    original_path = Path(settings.UPLOAD_DIR) / "temp" / f"{file_id}_original{file_ext}"
     augmented_path = Path(settings.UPLOAD_DIR) / "augmented" / f"{file_id}_augmented{file_ext}"
-    
-    original_path.parent.mkdir(parents=True, exist_ok=True)
     augmented_path.parent.mkdir(parents=True, exist_ok=True)
     
+    config = AugmentConfig(
+        resize_width=resize_width,
+        resize_height=resize_height,
+        rotate=rotate,
+        flip_horizontal=flip_horizontal,
+        flip_vertical=flip_vertical,
+        brightness=brightness,
+        contrast=contrast,
+        saturation=saturation,
+        hue_shift=hue_shift
+    )
+    
     try:
-        # 保存上传文件
         content = await file.read()
-        with open(original_path, "wb") as f:
-            f.write(content)
-        
-        # 打开图像
-        img = Image.open(original_path)
-        
-        # 调整大小
-        if resize_width and resize_height:
-            img = img.resize((resize_width, resize_height), Image.Resampling.LANCZOS)
-        elif resize_width:
-            ratio = resize_width / img.width
-            img = img.resize((resize_width, int(img.height * ratio)), Image.Resampling.LANCZOS)
-        elif resize_height:
-            ratio = resize_height / img.height
-            img = img.resize((int(img.width * ratio), resize_height), Image.Resampling.LANCZOS)
-        
-        # 旋转
-        if rotate:
-            img = img.rotate(rotate, expand=True, fillcolor=(128, 128, 128))
-        
-        # 翻转
-        if flip_horizontal:
-            img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
-        if flip_vertical:
-            img = img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
-        
-        # 亮度调整
-        if brightness:
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(brightness)
-        
-        # 对比度调整
-        if contrast:
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(contrast)
-        
-        # 饱和度调整
-        if saturation:
-            enhancer = ImageEnhance.Color(img)
-            img = enhancer.enhance(saturation)
-        
-        # 色调偏移 (使用OpenCV)
-        if hue_shift:
-            img_array = np.array(img)
-            img_hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-            img_hsv[:, :, 0] = (img_hsv[:, :, 0].astype(int) + hue_shift) % 180
-            img_array = cv2.cvtColor(img_hsv, cv2.COLOR_HSV2RGB)
-            img = Image.fromarray(img_array)
-        
-        # 保存增强后的图像
-        img.save(augmented_path)
-        
-        # 清理原始临时文件
-        original_path.unlink()
+        sizes = await task_executor.run_in_process(
+            augment_file, content, str(augmented_path), asdict(config)
+        )
         
         return {
             "success": True,
-            "original_size": {"width": Image.open(original_path if original_path.exists() else augmented_path).width, 
-                            "height": Image.open(augmented_path).height},
-            "augmented_size": {"width": img.width, "height": img.height},
+            "original_size": sizes["original_size"],
+            "augmented_size": sizes["augmented_size"],
             "augmented_path": f"/uploads/augmented/{file_id}_augmented{file_ext}"
         }
         
     except Exception as e:
-        # 清理文件
-        if original_path.exists():
-            original_path.unlink()
-        if augmented_path.exists():
-            augmented_path.unlink()
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/augment-annotated")
+async def augment_annotated_image(request: AnnotatedAugmentRequest):
+    """
+    增强已标注的图像，标注框随几何变换同步变换，
+    增强后的图像与标注一起保存为新的图像（无需重新检测）
+    """
+    data = annotation_service.get_annotations(request.image_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="标注不存在")
+    src_path = resolve_image_path(data["image_path"]) if data.get("image_path") else None
+    if src_path is None or not src_path.is_file():
+        raise HTTPException(status_code=404, detail="原始图像不存在")
+    
+    try:
+        config = asdict(AugmentConfig.from_dict(request.config.model_dump(exclude_none=True)))
+    except (TypeError, ValueError, KeyError, IndexError) as e:
+        raise HTTPException(status_code=400, detail=f"无效的增强配置: {e}")
+    
+    file_id = str(uuid.uuid4())
+    file_name = f"{file_id}{src_path.suffix}"
+    save_path = Path(settings.UPLOAD_DIR) / "images" / file_name
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    
+    annotations = data["annotations"]
+    boxes = [
+        (b["x"], b["y"], b["width"], b["height"])
+        for b in (ann["bbox"] for ann in annotations)
+    ]
+    try:
+        result = await task_executor.run_in_process(
+            augment_file_with_boxes, str(src_path), str(save_path), config, boxes, request.min_visibility
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    kept = [
+        {**ann, "bbox": dict(zip(("x", "y", "width", "height"), box))}
+        for ann, box, keep in zip(annotations, result["boxes"], result["keep"])
+        if keep
+    ]
+    size = result["augmented_size"]
+    saved = await task_executor.run_in_thread(
+        annotation_service.save_annotations,
+        AnnotationSaveRequest(
+            image_id=file_id,
+            image_path=f"/uploads/images/{file_name}",
+            image_width=size["width"],
+            image_height=size["height"],
+            annotations=kept
+        )
+    )
+    
+    return {
+        "success": True,
+        "source_image_id": request.image_id,
+        "image_id": file_id,
+        "image_path": f"/uploads/images/{file_name}",
+        "original_size": result["original_size"],
+        "augmented_size": size,
+        "annotation_count": len(kept),
+        "dropped_count": len(annotations) - len(kept),
+        "version": saved["version"]
+    }
+
+
 @router.post("/batch-augment")
 async def batch_augment(
     files: List[UploadFile] = File(..., description="要增强的图像列表"),
@@ -150,51 +170,103 @@ async def batch_augment(
     except:
         raise HTTPException(status_code=400, detail="无效的操作配置JSON")
     
-    results = []
+    try:
+        augment_config = asdict(AugmentConfig.from_dict(config))
+    except (TypeError, ValueError, KeyError, IndexError) as e:
+        raise HTTPException(status_code=400, detail=f"无效的操作配置: {e}")
+    
     augmented_dir = Path(settings.UPLOAD_DIR) / "augmented"
     augmented_dir.mkdir(parents=True, exist_ok=True)
     
-    for file in files:
+    async def process(file: UploadFile) -> dict:
         try:
             file_id = str(uuid.uuid4())
             file_ext = Path(file.filename).suffix
             
             content = await file.read()
-            img = Image.open(content)
-            
-            # 应用配置的增强操作
-            if config.get("resize"):
-                img = img.resize(tuple(config["resize"]), Image.Resampling.LANCZOS)
-            
-            if config.get("rotate"):
-                img = img.rotate(config["rotate"], expand=True)
-            
-            if config.get("flip_horizontal"):
-                img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
-            
-            if config.get("brightness"):
-                img = ImageEnhance.Brightness(img).enhance(config["brightness"])
-            
-            if config.get("contrast"):
-                img = ImageEnhance.Contrast(img).enhance(config["contrast"])
-            
             save_path = augmented_dir / f"{file_id}{file_ext}"
-            img.save(save_path)
+            await task_executor.run_in_process(augment_file, content, str(save_path), augment_config)
             
-            results.append({
+            return {
                 "original_name": file.filename,
                 "augmented_path": f"/uploads/augmented/{file_id}{file_ext}",
                 "success": True
-            })
+            }
             
         except Exception as e:
-            results.append({
+            return {
                 "original_name": file.filename,
                 "error": str(e),
                 "success": False
-            })
+            }
+    
+    # 各文件在进程池中并行处理
+    results = await asyncio.gather(*[process(file) for file in files])
     
-    return {"results": results, "total": len(results)}
+    return {"results": list(results), "total": len(results)}
+
+
+# 预处理相关的后台任务类型
+PREPROCESSING_JOB_KINDS = ("augment", "quality_scan")
+
+
+@router.post("/jobs/augment")
+async def create_augment_job(request: DatasetAugmentJobRequest):
+    """
+    创建离线数据集增强任务：为划分中的每张图像生成 variants 个增强变体
+    （图像与 YOLO 标签一起写回同一划分）
+    """
+    if request.split not in ["train", "val", "test"]:
+        raise HTTPException(status_code=400, detail="无效的数据集划分")
+    
+    try:
+        return submit_augment_job(request.model_dump())
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+
+
+@router.post("/jobs/quality-scan")
+async def create_quality_scan_job(request: QualityScanJobRequest):
+    """
+    创建数据集质量扫描任务（模糊度、曝光、分辨率与 dHash），
+    未变化的图像使用缓存的分数
+    """
+    if request.split not in ["train", "val", "test"]:
+        raise HTTPException(status_code=400, detail="无效的数据集划分")
+    
+    try:
+        return submit_quality_scan_job(request.model_dump())
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+
+
+@router.get("/jobs")
+async def list_preprocessing_jobs():
+    """列出预处理后台任务"""
+    jobs = [job for kind in PREPROCESSING_JOB_KINDS for job in job_manager.list(kind)]
+    return {"jobs": jobs, "total": len(jobs)}
+
+
+@router.get("/jobs/{job_id}")
+async def get_preprocessing_job(job_id: str):
+    """获取预处理任务进度"""
+    job = job_manager.get(job_id)
+    if job is None or job["kind"] not in PREPROCESSING_JOB_KINDS:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@router.post("/jobs/{job_id}/stop")
+async def stop_preprocessing_job(job_id: str):
+    """停止预处理任务（已写出的结果保留）"""
+    job = job_manager.get(job_id)
+    if job is None or job["kind"] not in PREPROCESSING_JOB_KINDS or not job_manager.stop(job_id):
+        raise HTTPException(status_code=400, detail="任务不存在或已结束")
+    return {"success": True, "message": "已请求停止任务"}
 
 
 @router.post("/quality-check")
@@ -205,42 +277,23 @@ async def check_image_quality(
     """
     检查图像质量（模糊度检测）
     """
-    file_id = str(uuid.uuid4())
-    file_ext = Path(file.filename).suffix
-    temp_path = Path(settings.UPLOAD_DIR) / "temp" / f"{file_id}{file_ext}"
-    temp_path.parent.mkdir(parents=True, exist_ok=True)
-    
     try:
         content = await file.read()
-        with open(temp_path, "wb") as f:
-            f.write(content)
+        checked = await task_executor.run_in_process(check_image_quality_file, content)
         
-        blur_score = calculate_blur_score(str(temp_path))
+        blur_score = checked["blur_score"]
         is_blurry = blur_score < blur_threshold
         
-        # 获取图像信息
-        img = Image.open(temp_path)
-        
-        result = {
+        return {
             "filename": file.filename,
             "blur_score": round(blur_score, 2),
             "blur_threshold": blur_threshold,
             "is_blurry": is_blurry,
             "quality": "低" if is_blurry else "正常",
-            "image_info": {
-                "width": img.width,
-                "height": img.height,
-                "format": img.format,
-                "mode": img.mode
-            }
+            "image_info": checked["image_info"]
         }
         
-        temp_path.unlink()
-        return result
-        
     except Exception as e:
-        if temp_path.exists():
-            temp_path.unlink()
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -252,39 +305,28 @@ async def batch_quality_check(
     """
     批量图像质量检查
     """
-    results = []
-    temp_dir = Path(settings.UPLOAD_DIR) / "temp"
-    temp_dir.mkdir(parents=True, exist_ok=True)
-    
-    for file in files:
-        file_id = str(uuid.uuid4())
-        file_ext = Path(file.filename).suffix
-        temp_path = temp_dir / f"{file_id}{file_ext}"
-        
+    async def process(file: UploadFile) -> dict:
         try:
             content = await file.read()
-            with open(temp_path, "wb") as f:
-                f.write(content)
+            checked = await task_executor.run_in_process(check_image_quality_file, content)
             
-            blur_score = calculate_blur_score(str(temp_path))
+            blur_score = checked["blur_score"]
             is_blurry = blur_score < blur_threshold
             
-            results.append({
+            return {
                 "filename": file.filename,
                 "blur_score": round(blur_score, 2),
                 "is_blurry": is_blurry,
                 "quality": "低" if is_blurry else "正常"
-            })
-            
-            temp_path.unlink()
+            }
             
         except Exception as e:
-            results.append({
+            return {
                 "filename": file.filename,
                 "error": str(e)
-            })
-            if temp_path.exists():
-                temp_path.unlink()
+            }
+    
+    results = list(await asyncio.gather(*[process(file) for file in files]))
     
     # 统计
     blurry_count = sum(1 for r in results if r.get("is_blurry", False))
@@ -34,6 +34,38 @@ class Settings:
     CONF_THRESHOLD: float = 0.25
     IOU_THRESHOLD: float = 0.45
     IMG_SIZE: int = 640
+    DETECT_MAX_BATCH_SIZE: int = 16  # 批量检测单次前向推理的最大图像数
+    SCHEDULER_MAX_BATCH_SIZE: int = 16  # 动态微批次的最大请求数
+    SCHEDULER_MAX_WAIT_MS: float = 8.0  # 凑批的最长等待时间(ms)
+    MODEL_CACHE_MAX_MODELS: int = 3  # 同时驻留的最大模型数 (0 表示不限)
+    MODEL_CACHE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024  # 模型参数总字节上限 (0 表示不限)
+    MODEL_WARMUP_IMG_SIZE: int = 640  # 加载后预热推理的输入尺寸 (0 表示不预热)
+    
+    # 检测结果缓存配置
+    DETECTION_CACHE_MAX_ENTRIES: int = 1024  # 内存中缓存的最大结果数
+    DETECTION_CACHE_TTL: float = 3600  # 缓存有效期(秒)，0 表示不过期
+    DETECTION_CACHE_DISK: bool = False  # 是否启用磁盘缓存层
+    DETECTION_CACHE_DIR: str = str(BASE_DIR / "cache" / "detections")  # 磁盘缓存目录（不在静态文件目录中）
+    
+    # 标注存储配置
+    ANNOTATION_STORAGE_FORMAT: str = "json"  # 标注文档的初始存储格式 (json/columnar)，转换后以转换结果为准
+    ANNOTATION_PACK_DIR: str = str(BASE_DIR / "annotation_packs")  # 标注打包数据集目录（不在静态文件目录中）
+    
+    # 标注文档缓存配置
+    ANNOTATION_CACHE_MAX_ENTRIES: int = 2048  # 内存中缓存的最大文档数
+    ANNOTATION_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # 缓存文档的最大总大小(按 JSON 字节数计)
+    
+    # 近重复图像检测配置
+    IMAGE_HASH_INDEX_PATH: str = str(BASE_DIR / "cache" / "image_hashes.npz")  # 感知哈希索引文件（不在静态文件目录中）
+    DUPLICATE_HAMMING_RADIUS: int = 6  # 默认视为近重复的最大 Hamming 距离 (64 位哈希)
+    
+    # 执行池配置
+    THREAD_POOL_WORKERS: int = 8  # 文件 I/O 与推理线程数
+    PROCESS_POOL_WORKERS: int = max(1, (os.cpu_count() or 2) - 1)  # 图像处理进程数
+    
+    # 后台任务配置
+    JOB_STATE_DIR: str = str(BASE_DIR / "jobs")  # 需要跨重启保留的任务记录目录（如导出任务）
+    JOB_RETENTION_TTL: float = 24 * 3600  # 已结束任务在内存中的保留时间(秒)，0 表示不清理
     
     # 数据集配置
     COCO_DIR: str = str(DATASET_DIR / "coco")
@@ -42,6 +74,8 @@ class Settings:
     
     # 标注导出配置
     EXPORT_DIR: str = str(BASE_DIR / "exports")
+    EXPORT_RETENTION_TTL: float = 24 * 3600  # 导出产物保留时间(秒)，0 表示不自动清理
+    EXPORT_CLEANUP_INTERVAL: float = 600  # 过期导出清理间隔(秒)
     
     # 训练配置
     TRAIN_OUTPUT_DIR: str = str(YOLOV5_DIR / "runs" / "train")
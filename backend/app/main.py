@@ -15,6 +15,8 @@ from fastapi.staticfiles import StaticFiles
 
 from app.config import settings
 from app.api import detection, annotation, training, dataset, export, preprocessing
+from app.services.executor import task_executor
+from app.services.export_jobs import export_janitor
 
 # 创建 FastAPI 应用
 app = FastAPI(
@@ -56,6 +58,17 @@ app.include_router(dataset.router, prefix="/api/dataset", tags=["数据集管理
 app.include_router(export.router, prefix="/api/export", tags=["导出功能"])
 app.include_router(preprocessing.router, prefix="/api/preprocessing", tags=["数据预处理"])
 
+@app.on_event("startup")
+async def start_export_janitor():
+    """启动过期导出产物清理"""
+    export_janitor.start()
+
+@app.on_event("shutdown")
+async def shutdown_executor():
+    """关闭线程池与进程池"""
+    export_janitor.stop()
+    task_executor.shutdown()
+
 @app.get("/", tags=["系统"])
 async def root():
     """系统根路径"""
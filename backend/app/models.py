@@ -43,6 +43,48 @@ class DetectionResult(BaseModel):
     inference_time: float = Field(..., description="推理时间(ms)")
 
 
+class CompactDetectionResult(BaseModel):
+    """列式检测结果响应（并行数组，不构造逐目标对象）"""
+    image_id: str = Field(..., description="图像ID")
+    image_path: str = Field(..., description="图像路径")
+    image_width: int = Field(..., description="图像宽度")
+    image_height: int = Field(..., description="图像高度")
+    boxes: List[List[float]] = Field(default=[], description="边界框列表 [x, y, width, height]")
+    scores: List[float] = Field(default=[], description="置信度列表")
+    class_ids: List[int] = Field(default=[], description="类别ID列表")
+    class_names: Dict[int, str] = Field(default={}, description="结果中出现的类别ID到名称的映射")
+    inference_time: float = Field(..., description="推理时间(ms)")
+
+
+class ResponseFormat(str, Enum):
+    """检测结果响应格式"""
+    OBJECTS = "objects"
+    COLUMNAR = "columnar"
+
+
+class StreamFormat(str, Enum):
+    """批量检测流式输出格式"""
+    NDJSON = "ndjson"
+    SSE = "sse"
+
+
+class DetectionJobRequest(BaseModel):
+    """批量检测任务请求"""
+    dataset: Optional[str] = Field(None, description="自定义数据集名称")
+    split: str = Field("train", description="数据集划分 (train/val/test)")
+    source_dir: Optional[str] = Field(None, description="服务器图像目录（未指定数据集时使用）")
+    conf_threshold: float = Field(0.25, ge=0, le=1, description="置信度阈值")
+    iou_threshold: float = Field(0.45, ge=0, le=1, description="IOU阈值")
+    img_size: int = Field(640, description="推理图像尺寸")
+    weights: str = Field("yolov5s.pt", description="模型权重文件")
+    classes: Optional[List[int]] = Field(None, description="要检测的类别ID列表")
+    batch_size: Optional[int] = Field(None, ge=1, description="推理批次大小")
+    workers: int = Field(4, ge=1, description="解码与写出线程数")
+    save_annotations: bool = Field(True, description="是否同时保存标注JSON")
+    overwrite: bool = Field(False, description="是否覆盖已有标签文件")
+    resume: bool = Field(True, description="是否从检查点继续")
+
+
 class Annotation(BaseModel):
     """标注数据模型"""
     id: int = Field(..., description="标注ID")
@@ -60,6 +102,48 @@ class AnnotationSaveRequest(BaseModel):
     image_width: int = Field(..., description="图像宽度")
     image_height: int = Field(..., description="图像高度")
     annotations: List[Annotation] = Field(..., description="标注列表")
+    version: Optional[int] = Field(None, description="期望的当前版本，不一致时拒绝保存")
+
+
+class PatchOp(str, Enum):
+    """标注补丁操作类型"""
+    ADD = "add"
+    UPDATE = "update"
+    DELETE = "delete"
+
+
+class AnnotationPatchOperation(BaseModel):
+    """单个标注补丁操作"""
+    op: PatchOp = Field(..., description="操作类型")
+    id: Optional[int] = Field(None, description="标注ID（update/delete 必填，add 可选）")
+    value: Optional[Dict[str, Any]] = Field(None, description="add 时为完整标注，update 时为要修改的字段")
+
+
+class AnnotationPatchRequest(BaseModel):
+    """单张图像的标注补丁请求"""
+    operations: List[AnnotationPatchOperation] = Field(..., description="按顺序执行的操作列表")
+    version: Optional[int] = Field(None, description="期望的当前版本，不一致时拒绝修改")
+
+
+class ImageAnnotationPatch(AnnotationPatchRequest):
+    """批量补丁中的单张图像"""
+    image_id: str = Field(..., description="图像ID")
+
+
+class BatchAnnotationPatchRequest(BaseModel):
+    """跨图像的批量标注补丁请求"""
+    patches: List[ImageAnnotationPatch] = Field(..., description="各图像的补丁")
+
+
+class AnnotationStorageFormat(str, Enum):
+    """标注文档存储格式"""
+    JSON = "json"
+    COLUMNAR = "columnar"
+
+
+class AnnotationPackRequest(BaseModel):
+    """标注打包请求"""
+    image_ids: Optional[List[str]] = Field(None, description="要打包的图像ID，为空时打包全部")
 
 
 class ExportFormat(str, Enum):
@@ -128,6 +212,71 @@ class PreprocessingConfig(BaseModel):
     blur_threshold: Optional[float] = Field(None, description="模糊检测阈值")
 
 
+class AnnotatedAugmentRequest(BaseModel):
+    """已标注图像的增强请求"""
+    image_id: str = Field(..., description="源图像ID")
+    config: PreprocessingConfig = Field(..., description="增强配置")
+    min_visibility: float = Field(0.3, ge=0, le=1, description="变换后标注框保留的最小可见比例")
+
+
+class AugmentPolicy(BaseModel):
+    """随机增强策略（每个变体独立采样）"""
+    flip_horizontal: float = Field(0.5, ge=0, le=1, description="水平翻转概率")
+    flip_vertical: float = Field(0.0, ge=0, le=1, description="垂直翻转概率")
+    rotate: float = Field(0.0, ge=0, le=180, description="最大旋转角度，在 ±rotate 内均匀采样")
+    crop_scale: float = Field(1.0, gt=0, le=1, description="随机裁剪的最小边长比例，1 表示不裁剪")
+    brightness: float = Field(0.2, ge=0, le=1, description="亮度系数在 1±brightness 内采样")
+    contrast: float = Field(0.2, ge=0, le=1, description="对比度系数在 1±contrast 内采样")
+    saturation: float = Field(0.2, ge=0, le=1, description="饱和度系数在 1±saturation 内采样")
+    hue: int = Field(0, ge=0, le=90, description="最大色调偏移 (OpenCV 色调范围 0-179)")
+
+
+class DatasetAugmentJobRequest(BaseModel):
+    """离线数据集增强任务请求"""
+    dataset: str = Field(..., description="自定义数据集名称")
+    split: str = Field("train", description="数据集划分 (train/val/test)")
+    variants: int = Field(1, ge=1, le=50, description="每张图像生成的增强变体数")
+    seed: int = Field(0, ge=0, description="随机种子，相同种子与策略生成相同结果")
+    policy: AugmentPolicy = Field(default_factory=AugmentPolicy, description="增强策略")
+    min_visibility: float = Field(0.3, ge=0, le=1, description="变换后标注框保留的最小可见比例")
+    overwrite: bool = Field(False, description="是否覆盖已生成的变体")
+
+
+class QualityScanJobRequest(BaseModel):
+    """数据集质量扫描任务请求"""
+    dataset: str = Field(..., description="自定义数据集名称")
+    split: str = Field("train", description="数据集划分 (train/val/test)")
+    blur_threshold: float = Field(100.0, ge=0, description="模糊度阈值")
+    dark_threshold: float = Field(40.0, ge=0, le=255, description="平均亮度低于该值视为欠曝")
+    bright_threshold: float = Field(215.0, ge=0, le=255, description="平均亮度高于该值视为过曝")
+    min_resolution: int = Field(320, ge=0, description="短边低于该值视为分辨率过低")
+    reduced_decode: bool = Field(False, description="以 1/2 尺寸解码以加快扫描（模糊度按缩小后的图像计算）")
+    duplicate_radius: Optional[int] = Field(
+        None, ge=0, le=64, description="dHash 的 Hamming 距离不超过该值视为近重复，为空时使用默认值"
+    )
+
+
+class DatasetSplit(str, Enum):
+    """数据集划分"""
+    TRAIN = "train"
+    VAL = "val"
+    TEST = "test"
+
+
+class ImageHashType(str, Enum):
+    """感知哈希类型"""
+    PHASH = "phash"
+    DHASH = "dhash"
+
+
+class DedupeRequest(BaseModel):
+    """数据集划分去重请求"""
+    split: DatasetSplit = Field(DatasetSplit.TRAIN, description="数据集划分")
+    radius: Optional[int] = Field(None, ge=0, le=64, description="最大 Hamming 距离，为空时使用默认值")
+    hash_type: ImageHashType = Field(ImageHashType.PHASH, description="哈希类型")
+    dry_run: bool = Field(True, description="只返回将被删除的文件，不实际删除")
+
+
 class DatasetInfo(BaseModel):
     """数据集信息"""
     name: str = Field(..., description="数据集名称")
@@ -3,3 +3,7 @@
 """
 from app.services.detector import detector, YOLOv5Detector
 from app.services.annotation import annotation_service, AnnotationService
+from app.services.scheduler import inference_scheduler, InferenceScheduler
+from app.services.executor import task_executor, TaskExecutor
+from app.services.detection_cache import detection_cache, DetectionCache
+from app.services.jobs import job_manager, JobManager
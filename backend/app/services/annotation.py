@@ -3,15 +3,85 @@
 """
 import json
 import os
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Tuple
 from datetime import datetime
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
 
 from app.config import settings
-from app.models import Annotation, AnnotationSaveRequest, ExportFormat, BoundingBox
+from app.models import (
+    Annotation, AnnotationSaveRequest, ExportFormat, BoundingBox,
+    AnnotationPatchOperation, PatchOp, AnnotationStorageFormat
+)
+from app.services.annotation_columnar import dumps_npz, loads_npz, pack_documents, PackedAnnotations
+from app.services.annotation_cache import AnnotationCache
+from app.services.annotation_index import AnnotationIndex, AnnotationFilter
+from app.services.exporters import CocoWriter, COCO_INSTANCES_PATH, voc_xml, yolo_text
+
+
+class VersionConflictError(Exception):
+    """标注版本与客户端期望的版本不一致"""
+    
+    def __init__(self, image_id: str, expected: int, current: int):
+        super().__init__(f"标注已被修改: {image_id} (期望版本 {expected}, 当前版本 {current})")
+        self.image_id = image_id
+        self.expected = expected
+        self.current = current
+
+
+class KeyedLock:
+    """按键加锁，不同键之间互不阻塞，无人持有的锁会被回收"""
+    
+    def __init__(self):
+        self._locks: Dict[str, List] = {}
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def hold(self, keys: Iterable[str]):
+        """按排序后的顺序获取多个键的锁，避免死锁"""
+        keys = sorted(set(keys))
+        locks, acquired = [], []
+        with self._lock:
+            for key in keys:
+                entry = self._locks.setdefault(key, [threading.Lock(), 0])
+                entry[1] += 1
+                locks.append(entry[0])
+        try:
+            for lock in locks:
+                lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            with self._lock:
+                for key in keys:
+                    entry = self._locks[key]
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self._locks[key]
+
+
+# 并行导出时每个任务处理的图像数
+EXPORT_CHUNK_SIZE = 256
+
+# 各导出格式的标注子目录
+EXPORT_SUBDIRS = {
+    ExportFormat.YOLO: "labels",
+    ExportFormat.VOC: "Annotations",
+}
+
+# 各存储格式的文件后缀
+STORAGE_SUFFIXES = {
+    AnnotationStorageFormat.JSON: ".json",
+    AnnotationStorageFormat.COLUMNAR: ".npz",
+}
+
+# 记录当前存储格式的文件（位于标注目录中），转换存储格式后重启仍然有效
+STORAGE_FORMAT_FILE = ".storage_format"
 
 
 class AnnotationService:
@@ -20,71 +90,401 @@ class AnnotationService:
     def __init__(self):
         self.annotations_dir = Path(settings.UPLOAD_DIR) / "annotations"
         self.annotations_dir.mkdir(parents=True, exist_ok=True)
+        self.packs_dir = Path(settings.ANNOTATION_PACK_DIR)
+        self.storage_format = self._load_storage_format()
+        self.index = AnnotationIndex()
+        self._locks = KeyedLock()
+        self._format_lock = threading.Lock()
+        self.cache = AnnotationCache()
+        
+        # 首次启用索引或表结构升级时从已有标注文件构建
+        if (self.index.needs_rebuild or self.index.count() == 0) \
+                and any(self._document_files()):
+            self.rebuild_index()
     
-    def save_annotations(self, request: AnnotationSaveRequest) -> Dict[str, Any]:
-        """保存标注数据"""
-        annotation_file = self.annotations_dir / f"{request.image_id}.json"
-        
-        data = {
-            "image_id": request.image_id,
-            "image_path": request.image_path,
-            "image_width": request.image_width,
-            "image_height": request.image_height,
-            "annotations": [ann.dict() for ann in request.annotations],
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
-        }
-        
-        with open(annotation_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def save_annotations(
+        self,
+        request: AnnotationSaveRequest,
+        expected_version: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        保存标注数据
+        
+        Raises:
+            VersionConflictError: 指定了期望版本且与当前版本不一致
+        """
+        if expected_version is None:
+            expected_version = request.version
+        
+        with self._locks.hold([request.image_id]):
+            # 持有图像锁时读取存储格式，转换存储格式时会在该锁下处理这张图像
+            storage_format = self.storage_format
+            annotation_file = self._document_path(request.image_id, storage_format)
+            # 版本以文档为准（与 patch_many 一致），索引只用于列表查询
+            current = self._load_document(request.image_id)
+            created_at = current.get("created_at") if current else None
+            version = current.get("version", 0) if current else 0
+            self._check_version(request.image_id, expected_version, version)
+            
+            now = datetime.now().isoformat()
+            data = {
+                "image_id": request.image_id,
+                "image_path": request.image_path,
+                "image_width": request.image_width,
+                "image_height": request.image_height,
+                "annotations": [ann.dict() for ann in request.annotations],
+                # 覆盖保存时保留原创建时间
+                "created_at": created_at or now,
+                "updated_at": now,
+                "version": version + 1
+            }
+            
+            nbytes = self._write_document(data, storage_format)
+            self.index.upsert(data)
+            self.cache.refresh(request.image_id, data, nbytes)
         
         return {
             "success": True,
             "image_id": request.image_id,
             "annotation_count": len(request.annotations),
-            "file_path": str(annotation_file)
+            "file_path": str(annotation_file),
+            "version": data["version"]
         }
     
-    def get_annotations(self, image_id: str) -> Optional[Dict[str, Any]]:
-        """获取标注数据"""
-        annotation_file = self.annotations_dir / f"{image_id}.json"
-        
-        if not annotation_file.exists():
-            return None
+    @staticmethod
+    def _check_version(image_id: str, expected: Optional[int], current: int):
+        if expected is not None and expected != current:
+            raise VersionConflictError(image_id, expected, current)
+    
+    def _document_path(self, image_id: str, storage_format: AnnotationStorageFormat) -> Path:
+        return self.annotations_dir / f"{image_id}{STORAGE_SUFFIXES[storage_format]}"
+    
+    def _document_files(self) -> Iterator[Path]:
+        """列出所有格式的标注文件"""
+        for suffix in STORAGE_SUFFIXES.values():
+            yield from self.annotations_dir.glob(f"*{suffix}")
+    
+    def _write_document(self, data: Dict[str, Any], storage_format: AnnotationStorageFormat) -> int:
+        """
+        写出标注文档（先写临时文件再替换，中途失败不会留下不完整的文件）
+        
+        Returns:
+            写出的字节数，用于缓存容量统计
+        """
+        annotation_file = self._document_path(data["image_id"], storage_format)
+        tmp_file = annotation_file.with_name(f".{annotation_file.name}.{uuid.uuid4().hex}.tmp")
+        if storage_format == AnnotationStorageFormat.COLUMNAR:
+            content = dumps_npz(data)
+        else:
+            content = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_file, annotation_file)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+        
+        # 删除其他格式的旧文件，保证每张图像只有一份文档
+        for other in AnnotationStorageFormat:
+            if other != storage_format:
+                self._document_path(data["image_id"], other).unlink(missing_ok=True)
+        return len(content)
+    
+    def patch_annotations(
+        self,
+        image_id: str,
+        operations: List[AnnotationPatchOperation],
+        expected_version: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        按顺序对一张图像应用增/改/删操作
+        
+        Returns:
+            操作结果；标注数据不存在时返回 None
+        
+        Raises:
+            LookupError: 标注ID不存在
+            ValueError: 操作参数无效
+            VersionConflictError: 版本不一致
+        """
+        results = self.patch_many({image_id: operations}, {image_id: expected_version})
+        return results[0] if results else None
+    
+    def patch_many(
+        self,
+        patches: Dict[str, List[AnnotationPatchOperation]],
+        expected_versions: Optional[Dict[str, Optional[int]]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        对多张图像应用补丁
+        
+        持有所有相关图像的锁，先在内存中校验版本并应用全部操作，
+        任一失败则不写出任何文件；全部成功后逐个写出文档，并在一个事务中更新索引。
+        不存在的图像会被跳过。
+        """
+        expected_versions = expected_versions or {}
+        with self._locks.hold(patches):
+            now = datetime.now().isoformat()
+            documents = []
+            results = []
+            for image_id, operations in patches.items():
+                cached = self._load_document(image_id)
+                if cached is None:
+                    continue
+                # 操作只替换标注列表中的元素，浅拷贝即可避免修改缓存中的文档
+                data = {**cached, "annotations": list(cached["annotations"])}
+                version = data.get("version", 0)
+                self._check_version(image_id, expected_versions.get(image_id), version)
+                result = self._apply_operations(data, operations)
+                data["updated_at"] = now
+                data["version"] = version + 1
+                documents.append(data)
+                results.append({"image_id": image_id, "version": version + 1, **result})
+            
+            storage_format = self.storage_format
+            sizes = [self._write_document(data, storage_format) for data in documents]
+            self.index.upsert_many(documents)
+            for data, nbytes in zip(documents, sizes):
+                self.cache.refresh(data["image_id"], data, nbytes)
         
-        with open(annotation_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return results
     
-    def delete_annotations(self, image_id: str) -> bool:
-        """删除标注数据"""
-        annotation_file = self.annotations_dir / f"{image_id}.json"
+    @staticmethod
+    def _apply_operations(
+        data: Dict[str, Any],
+        operations: List[AnnotationPatchOperation]
+    ) -> Dict[str, Any]:
+        """在标注文档上原地应用操作，只校验被修改的标注"""
+        annotations = data["annotations"]
+        positions = {ann["id"]: i for i, ann in enumerate(annotations)}
+        max_id = max(positions, default=0)
+        deleted = set()
+        added_ids, updated, removed = [], 0, 0
+        
+        for operation in operations:
+            if operation.op == PatchOp.ADD:
+                if operation.value is None:
+                    raise ValueError("add 操作缺少 value")
+                ann_id = operation.id
+                if ann_id is None or ann_id in positions:
+                    ann_id = max_id + 1
+                value = {"is_manual": True, **operation.value, "id": ann_id}
+                positions[ann_id] = len(annotations)
+                annotations.append(Annotation.model_validate(value).model_dump())
+                max_id = max(max_id, ann_id)
+                added_ids.append(ann_id)
+                continue
+            
+            if operation.id is None:
+                raise ValueError(f"{operation.op.value} 操作缺少 id")
+            position = positions.get(operation.id)
+            if position is None:
+                raise LookupError(f"标注不存在: {operation.id}")
+            
+            if operation.op == PatchOp.UPDATE:
+                if not operation.value:
+                    raise ValueError("update 操作缺少 value")
+                merged = {**annotations[position], **operation.value, "id": operation.id}
+                annotations[position] = Annotation.model_validate(merged).model_dump()
+                updated += 1
+            else:
+                deleted.add(position)
+                del positions[operation.id]
+                removed += 1
+        
+        if deleted:
+            data["annotations"] = [
+                ann for i, ann in enumerate(annotations) if i not in deleted
+            ]
         
-        if annotation_file.exists():
-            annotation_file.unlink()
+        return {
+            "annotation_count": len(data["annotations"]),
+            "added_ids": added_ids,
+            "updated": updated,
+            "deleted": removed,
+        }
+    
+    def get_annotations(self, image_id: str, cache: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        获取标注数据
+        
+        返回的文档可能与缓存共享，调用方不得修改。
+        
+        Args:
+            image_id: 图像ID
+            cache: 未命中时是否写入缓存（批量导出等一次性读取应关闭）
+        """
+        document = self.cache.get(image_id)
+        if document is not None:
+            return document
+        if not cache:
+            return self._read_document(image_id)[0]
+        
+        # 持有该图像的锁读取并回填，避免与并发写入交错而缓存旧版本
+        with self._locks.hold([image_id]):
+            return self._load_document(image_id)
+    
+    def _load_document(self, image_id: str) -> Optional[Dict[str, Any]]:
+        """从缓存或文件读取文档并回填缓存（需持有该图像的锁）"""
+        document = self.cache.get(image_id)
+        if document is not None:
+            return document
+        document, nbytes = self._read_document(image_id)
+        if document is not None:
+            self.cache.put(image_id, document, nbytes)
+        return document
+    
+    def _read_document(self, image_id: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        """读取标注文件（优先当前存储格式），返回 (文档, 文件字节数)"""
+        formats = [self.storage_format] + [f for f in AnnotationStorageFormat if f != self.storage_format]
+        for storage_format in formats:
+            try:
+                with open(self._document_path(image_id, storage_format), 'rb') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                continue
+            if storage_format == AnnotationStorageFormat.COLUMNAR:
+                return loads_npz(content), len(content)
+            return json.loads(content), len(content)
+        return None, 0
+    
+    def delete_annotations(self, image_id: str, expected_version: Optional[int] = None) -> bool:
+        """
+        删除标注数据
+        
+        Raises:
+            VersionConflictError: 指定了期望版本且与当前版本不一致
+        """
+        with self._locks.hold([image_id]):
+            files = [
+                path for path in (self._document_path(image_id, f) for f in AnnotationStorageFormat)
+                if path.exists()
+            ]
+            if not files:
+                return False
+            if expected_version is not None:
+                current = self._load_document(image_id)
+                self._check_version(image_id, expected_version, current.get("version", 0) if current else 0)
+            for path in files:
+                path.unlink()
+            self.index.delete(image_id)
+            self.cache.invalidate(image_id)
             return True
-        return False
-    
-    def list_annotations(self) -> List[Dict[str, Any]]:
-        """列出所有标注"""
-        annotations = []
-        for file in self.annotations_dir.glob("*.json"):
-            with open(file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                annotations.append({
-                    "image_id": data["image_id"],
-                    "image_path": data["image_path"],
-                    "annotation_count": len(data["annotations"]),
-                    "updated_at": data.get("updated_at")
+    
+    def list_annotations(
+        self,
+        offset: int = 0,
+        limit: int = 20,
+        sort_by: str = "updated_at",
+        descending: bool = True,
+        filters: Optional[AnnotationFilter] = None,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """按索引分页列出标注，返回 (记录, 下一页游标)"""
+        return self.index.list(offset, limit, sort_by, descending, filters, cursor)
+    
+    def count_annotations(self, filters: Optional[AnnotationFilter] = None) -> int:
+        """统计满足条件的已标注图像数"""
+        return self.index.count(filters)
+    
+    def rebuild_index(self) -> int:
+        """从标注文件重建索引"""
+        return self.index.rebuild(self._iter_documents())
+    
+    def _iter_documents(self) -> Iterator[Dict[str, Any]]:
+        """遍历标注目录中的所有文档（跳过无法解析的文件）"""
+        seen = set()
+        for file in self._document_files():
+            image_id = file.stem
+            if image_id in seen:
+                continue
+            seen.add(image_id)
+            try:
+                document, _ = self._read_document(image_id)
+            except (OSError, ValueError, KeyError):
+                continue
+            if document is not None:
+                yield document
+    
+    def _load_storage_format(self) -> AnnotationStorageFormat:
+        """读取已保存的存储格式，未保存时使用配置中的初始格式"""
+        try:
+            return AnnotationStorageFormat(
+                (self.annotations_dir / STORAGE_FORMAT_FILE).read_text(encoding="utf-8").strip()
+            )
+        except (OSError, ValueError):
+            return AnnotationStorageFormat(settings.ANNOTATION_STORAGE_FORMAT)
+    
+    def _save_storage_format(self, storage_format: AnnotationStorageFormat):
+        """原子写出当前存储格式"""
+        path = self.annotations_dir / STORAGE_FORMAT_FILE
+        tmp_file = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            tmp_file.write_text(storage_format.value, encoding="utf-8")
+            os.replace(tmp_file, path)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+    
+    def convert_storage(self, storage_format: AnnotationStorageFormat) -> Dict[str, Any]:
+        """
+        将所有标注文档转换为指定存储格式，之后的写入也使用该格式
+        
+        先保存并切换格式，再逐个在图像锁下转换：切换前已开始的写入持有图像锁，
+        会在转换该图像之前完成。转换过程中新建的旧格式文档由后续轮次扫描处理。
+        读取时按文件后缀识别格式，转换过程中新旧格式的文档都能正常读取。
+        """
+        with self._format_lock:
+            self._save_storage_format(storage_format)
+            self.storage_format = storage_format
+            target_suffix = STORAGE_SUFFIXES[storage_format]
+            converted = 0
+            while True:
+                image_ids = sorted({
+                    file.stem for file in self._document_files() if file.suffix != target_suffix
                 })
-        return annotations
+                if not image_ids:
+                    break
+                for image_id in image_ids:
+                    with self._locks.hold([image_id]):
+                        document, _ = self._read_document(image_id)
+                        if document is None:
+                            continue
+                        self._write_document(document, storage_format)
+                        converted += 1
+        return {"storage_format": storage_format.value, "converted": converted}
+    
+    def pack_annotations(self, image_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """将标注打包为可内存映射的数据集，返回打包信息"""
+        pack_id = str(uuid.uuid4())[:8]
+        image_ids = image_ids if image_ids is not None else self.index.image_ids()
+        documents = (
+            document for document in (self.get_annotations(image_id, cache=False) for image_id in image_ids)
+            if document is not None
+        )
+        info = pack_documents(documents, self.packs_dir / pack_id)
+        return {"pack_id": pack_id, **info}
+    
+    def open_pack(self, pack_id: str) -> Optional[PackedAnnotations]:
+        """打开已打包的数据集（内存映射）"""
+        pack_dir = self.packs_dir / pack_id
+        if pack_id != Path(pack_id).name or not (pack_dir / "meta.json").exists():
+            return None
+        return PackedAnnotations(pack_dir)
     
     def export_annotations(
         self,
         image_ids: List[str],
         format: ExportFormat,
-        output_dir: str = None
+        output_dir: str = None,
+        progress: Optional[Callable[[int], None]] = None
     ) -> Dict[str, Any]:
-        """导出标注数据"""
+        """
+        导出标注数据
+        
+        按块在线程池中并行转换与写出，progress(n) 在每块完成后以该块的图像数回调。
+        """
         if output_dir is None:
             export_id = str(uuid.uuid4())[:8]
             output_dir = Path(settings.EXPORT_DIR) / f"export_{export_id}"
@@ -93,23 +493,37 @@ class AnnotationService:
         
         output_dir.mkdir(parents=True, exist_ok=True)
         
+        if format == ExportFormat.COCO:
+            return self._export_coco_dataset(image_ids, output_dir, progress)
+        
+        (output_dir / EXPORT_SUBDIRS.get(format, "")).mkdir(parents=True, exist_ok=True)
+        
+        def export_chunk(chunk: List[str]) -> List[str]:
+            files = []
+            for image_id in chunk:
+                annotation_data = self.get_annotations(image_id, cache=False)
+                if annotation_data is None:
+                    continue
+                arcname, content = self.render_document(annotation_data, format)
+                file_path = output_dir / arcname
+                with open(file_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                files.append(str(file_path))
+            if progress is not None:
+                progress(len(chunk))
+            return files
+        
+        chunks = [
+            image_ids[i:i + EXPORT_CHUNK_SIZE] for i in range(0, len(image_ids), EXPORT_CHUNK_SIZE)
+        ]
         exported_files = []
-        
-        for image_id in image_ids:
-            annotation_data = self.get_annotations(image_id)
-            if annotation_data is None:
-                continue
-            
-            if format == ExportFormat.YOLO:
-                file_path = self._export_yolo(annotation_data, output_dir)
-            elif format == ExportFormat.COCO:
-                file_path = self._export_coco(annotation_data, output_dir)
-            elif format == ExportFormat.VOC:
-                file_path = self._export_voc(annotation_data, output_dir)
-            else:  # JSON
-                file_path = self._export_json(annotation_data, output_dir)
-            
-            exported_files.append(file_path)
+        if len(chunks) <= 1:
+            for chunk in chunks:
+                exported_files.extend(export_chunk(chunk))
+        else:
+            with ThreadPoolExecutor(max_workers=settings.THREAD_POOL_WORKERS) as pool:
+                for files in pool.map(export_chunk, chunks):
+                    exported_files.extend(files)
         
         return {
             "success": True,
@@ -119,129 +533,47 @@ class AnnotationService:
             "files": exported_files
         }
     
-    def _export_yolo(self, data: Dict, output_dir: Path) -> str:
-        """导出为 YOLO 格式"""
-        # YOLO格式: class_id x_center y_center width height (归一化)
+    @staticmethod
+    def render_document(data: Dict[str, Any], format: ExportFormat) -> Tuple[str, str]:
+        """
+        将单张图像的标注转换为导出格式（COCO 除外）
+        
+        Returns:
+            (导出目录内的相对路径, 文件内容)
+        """
         image_id = data["image_id"]
-        img_w = data["image_width"]
-        img_h = data["image_height"]
-        
-        labels_dir = output_dir / "labels"
-        labels_dir.mkdir(exist_ok=True)
-        
-        file_path = labels_dir / f"{image_id}.txt"
-        
-        lines = []
-        for ann in data["annotations"]:
-            bbox = ann["bbox"]
-            # 转换为 YOLO 格式 (归一化的中心点坐标和宽高)
-            x_center = (bbox["x"] + bbox["width"] / 2) / img_w
-            y_center = (bbox["y"] + bbox["height"] / 2) / img_h
-            w = bbox["width"] / img_w
-            h = bbox["height"] / img_h
-            
-            lines.append(f"{ann['class_id']} {x_center:.6f} {y_center:.6f} {w:.6f} {h:.6f}")
-        
-        with open(file_path, 'w') as f:
-            f.write('\n'.join(lines))
-        
-        return str(file_path)
+        if format == ExportFormat.YOLO:
+            return f"{EXPORT_SUBDIRS[format]}/{image_id}.txt", yolo_text(data)
+        if format == ExportFormat.VOC:
+            return f"{EXPORT_SUBDIRS[format]}/{image_id}.xml", voc_xml(data)
+        return f"{image_id}.json", json.dumps(data, ensure_ascii=False, indent=2)
     
-    def _export_coco(self, data: Dict, output_dir: Path) -> str:
-        """导出为 COCO 格式"""
-        image_id = data["image_id"]
+    def _export_coco_dataset(
+        self,
+        image_ids: List[str],
+        output_dir: Path,
+        progress: Optional[Callable[[int], None]] = None
+    ) -> Dict[str, Any]:
+        """导出为单个 COCO instances.json（全局图像/标注 ID，合并类别表）"""
+        file_path = output_dir / COCO_INSTANCES_PATH
+        with CocoWriter(file_path) as writer:
+            for i, image_id in enumerate(image_ids, 1):
+                annotation_data = self.get_annotations(image_id, cache=False)
+                if annotation_data is not None:
+                    writer.add(annotation_data)
+                if progress is not None and i % EXPORT_CHUNK_SIZE == 0:
+                    progress(EXPORT_CHUNK_SIZE)
+        if progress is not None and len(image_ids) % EXPORT_CHUNK_SIZE:
+            progress(len(image_ids) % EXPORT_CHUNK_SIZE)
         
-        coco_data = {
-            "images": [{
-                "id": 1,
-                "file_name": Path(data["image_path"]).name,
-                "width": data["image_width"],
-                "height": data["image_height"]
-            }],
-            "annotations": [],
-            "categories": []
+        return {
+            "success": True,
+            "format": ExportFormat.COCO.value,
+            "output_dir": str(output_dir),
+            "exported_count": writer.image_count,
+            "annotation_count": writer.annotation_count,
+            "files": [str(file_path)]
         }
-        
-        categories_set = set()
-        for idx, ann in enumerate(data["annotations"]):
-            bbox = ann["bbox"]
-            coco_data["annotations"].append({
-                "id": idx + 1,
-                "image_id": 1,
-                "category_id": ann["class_id"],
-                "bbox": [bbox["x"], bbox["y"], bbox["width"], bbox["height"]],
-                "area": bbox["width"] * bbox["height"],
-                "iscrowd": 0
-            })
-            categories_set.add((ann["class_id"], ann["class_name"]))
-        
-        coco_data["categories"] = [
-            {"id": cid, "name": name}
-            for cid, name in sorted(categories_set)
-        ]
-        
-        file_path = output_dir / f"{image_id}_coco.json"
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(coco_data, f, ensure_ascii=False, indent=2)
-        
-        return str(file_path)
-    
-    def _export_voc(self, data: Dict, output_dir: Path) -> str:
-        """导出为 Pascal VOC XML 格式"""
-        image_id = data["image_id"]
-        image_path = Path(data["image_path"])
-        
-        annotations_dir = output_dir / "Annotations"
-        annotations_dir.mkdir(exist_ok=True)
-        
-        # 创建 XML 结构
-        root = ET.Element("annotation")
-        
-        ET.SubElement(root, "folder").text = str(image_path.parent.name)
-        ET.SubElement(root, "filename").text = image_path.name
-        
-        source = ET.SubElement(root, "source")
-        ET.SubElement(source, "database").text = "Custom"
-        
-        size = ET.SubElement(root, "size")
-        ET.SubElement(size, "width").text = str(data["image_width"])
-        ET.SubElement(size, "height").text = str(data["image_height"])
-        ET.SubElement(size, "depth").text = "3"
-        
-        ET.SubElement(root, "segmented").text = "0"
-        
-        for ann in data["annotations"]:
-            obj = ET.SubElement(root, "object")
-            ET.SubElement(obj, "name").text = ann["class_name"]
-            ET.SubElement(obj, "pose").text = "Unspecified"
-            ET.SubElement(obj, "truncated").text = "0"
-            ET.SubElement(obj, "difficult").text = "0"
-            
-            bbox = ann["bbox"]
-            bndbox = ET.SubElement(obj, "bndbox")
-            ET.SubElement(bndbox, "xmin").text = str(int(bbox["x"]))
-            ET.SubElement(bndbox, "ymin").text = str(int(bbox["y"]))
-            ET.SubElement(bndbox, "xmax").text = str(int(bbox["x"] + bbox["width"]))
-            ET.SubElement(bndbox, "ymax").text = str(int(bbox["y"] + bbox["height"]))
-        
-        # 格式化 XML
-        xml_str = minidom.parseString(ET.tostring(root)).toprettyxml(indent="  ")
-        
-        file_path = annotations_dir / f"{image_id}.xml"
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(xml_str)
-        
-        return str(file_path)
-    
-    def _export_json(self, data: Dict, output_dir: Path) -> str:
-        """导出为 JSON 格式"""
-        image_id = data["image_id"]
-        file_path = output_dir / f"{image_id}.json"
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        
-        return str(file_path)
 
 
 # 全局标注服务实例
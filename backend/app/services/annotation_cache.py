@@ -0,0 +1,87 @@
+"""
+标注文档缓存
+
+按 image_id 缓存解析后的标注文档，条目数与总字节数（按 JSON 文本长度计）双重限制，
+按 LRU 淘汰，减少编辑过程中反复读取与解析同一文件。
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+
+
+class AnnotationCache:
+    """标注文档 LRU 缓存（线程安全）"""
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None):
+        self.max_entries = max_entries if max_entries is not None else settings.ANNOTATION_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes if max_bytes is not None else settings.ANNOTATION_CACHE_MAX_BYTES
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, image_id: str) -> Optional[Dict[str, Any]]:
+        """查询缓存（返回共享对象，调用方不得修改）"""
+        with self._lock:
+            item = self._entries.get(image_id)
+            if item is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(image_id)
+            self._stats["hits"] += 1
+            return item[0]
+
+    def put(self, image_id: str, document: Dict[str, Any], nbytes: int):
+        """写入缓存，超出限制时淘汰最久未使用的文档"""
+        if self.max_entries <= 0 or nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(image_id)
+            self._entries[image_id] = (document, nbytes)
+            self._bytes += nbytes
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, size) = self._entries.popitem(last=False)
+                self._bytes -= size
+                self._stats["evictions"] += 1
+
+    def refresh(self, image_id: str, document: Dict[str, Any], nbytes: int):
+        """文档更新后仅替换已缓存的条目，批量写入不会挤占热点文档"""
+        with self._lock:
+            if image_id not in self._entries:
+                return
+        self.put(image_id, document, nbytes)
+
+    def invalidate(self, image_id: str):
+        """使单个文档失效"""
+        with self._lock:
+            if self._remove(image_id):
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        with self._lock:
+            requests = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / requests, 4) if requests else 0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remove(self, image_id: str) -> bool:
+        """移除条目（需持有锁）"""
+        item = self._entries.pop(image_id, None)
+        if item is None:
+            return False
+        self._bytes -= item[1]
+        return True
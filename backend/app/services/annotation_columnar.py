@@ -0,0 +1,220 @@
+"""
+列式标注格式
+
+将标注文档中的标注列表转换为 NumPy 结构化数组（每个字段一列），
+单张图像以 .npz 存储，整个数据集可打包为可内存映射的 .npy 文件，
+统计与导出时无需逐个解析 JSON。
+"""
+import io
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+ANNOTATION_DTYPE = np.dtype([
+    ("id", "<i4"),
+    ("class_id", "<i4"),
+    ("name_idx", "<i4"),      # 类别名称在 class_names 中的下标
+    ("x", "<f8"),
+    ("y", "<f8"),
+    ("width", "<f8"),
+    ("height", "<f8"),
+    ("confidence", "<f8"),    # 无置信度时为 NaN
+    ("is_manual", "?"),
+])
+
+# 文档中除标注列表外需要保留的字段
+_META_FIELDS = ("image_id", "image_path", "image_width", "image_height", "created_at", "updated_at", "version")
+
+
+def to_columnar(
+    document: Dict[str, Any],
+    name_table: Optional[Dict[str, int]] = None
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    将标注文档转换为 (结构化数组, 元数据)
+
+    Args:
+        document: JSON 形式的标注文档
+        name_table: 类别名称到下标的映射，打包多张图像时共享，新名称会追加到其中
+    """
+    annotations = document.get("annotations", [])
+    names = name_table if name_table is not None else {}
+    array = np.empty(len(annotations), dtype=ANNOTATION_DTYPE)
+    if annotations:
+        bboxes = [ann["bbox"] for ann in annotations]
+        array["id"] = [ann["id"] for ann in annotations]
+        array["class_id"] = [ann["class_id"] for ann in annotations]
+        array["name_idx"] = [names.setdefault(ann["class_name"], len(names)) for ann in annotations]
+        array["x"] = [b["x"] for b in bboxes]
+        array["y"] = [b["y"] for b in bboxes]
+        array["width"] = [b["width"] for b in bboxes]
+        array["height"] = [b["height"] for b in bboxes]
+        array["confidence"] = [
+            np.nan if ann.get("confidence") is None else ann["confidence"] for ann in annotations
+        ]
+        array["is_manual"] = [bool(ann.get("is_manual")) for ann in annotations]
+
+    meta = {field: document.get(field) for field in _META_FIELDS if field in document}
+    if name_table is None:
+        meta["class_names"] = list(names)
+    return array, meta
+
+
+def from_columnar(array: np.ndarray, meta: Dict[str, Any], class_names: List[str] = None) -> Dict[str, Any]:
+    """将结构化数组与元数据还原为 JSON 形式的标注文档"""
+    names = class_names if class_names is not None else meta.get("class_names", [])
+    confidence = array["confidence"]
+    annotations = [
+        {
+            "id": ann_id,
+            "class_id": class_id,
+            "class_name": names[name_idx],
+            "bbox": {"x": x, "y": y, "width": w, "height": h},
+            "is_manual": is_manual,
+            "confidence": None if conf != conf else conf,
+        }
+        for ann_id, class_id, name_idx, x, y, w, h, conf, is_manual in zip(
+            array["id"].tolist(), array["class_id"].tolist(), array["name_idx"].tolist(),
+            array["x"].tolist(), array["y"].tolist(), array["width"].tolist(), array["height"].tolist(),
+            confidence.tolist(), array["is_manual"].tolist()
+        )
+    ]
+    document = {field: value for field, value in meta.items() if field != "class_names"}
+    document["annotations"] = annotations
+    return document
+
+
+def dumps_npz(document: Dict[str, Any]) -> bytes:
+    """将标注文档序列化为 .npz 字节"""
+    array, meta = to_columnar(document)
+    buffer = io.BytesIO()
+    np.savez(
+        buffer,
+        annotations=array,
+        meta=np.frombuffer(json.dumps(meta, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+    )
+    return buffer.getvalue()
+
+
+def loads_npz(source) -> Dict[str, Any]:
+    """从 .npz 文件或字节读取标注文档"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with np.load(source, allow_pickle=False) as data:
+        meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+        return from_columnar(data["annotations"], meta)
+
+
+class PackedAnnotations:
+    """
+    打包的数据集标注
+
+    目录结构：
+        annotations.npy  所有图像的标注（结构化数组，按图像连续存放）
+        offsets.npy      每张图像在 annotations 中的起始位置（长度为图像数 + 1）
+        images.npy       每张图像的宽高
+        meta.json        image_id / image_path 列表与类别名称
+    """
+
+    def __init__(self, pack_dir: Path):
+        self.pack_dir = Path(pack_dir)
+        # 只读内存映射，按需分页读取
+        self.annotations = np.load(self.pack_dir / "annotations.npy", mmap_mode="r")
+        self.offsets = np.load(self.pack_dir / "offsets.npy", mmap_mode="r")
+        self.sizes = np.load(self.pack_dir / "images.npy", mmap_mode="r")
+        with open(self.pack_dir / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.images: List[Dict[str, Any]] = meta["images"]
+        self.class_names: List[str] = meta["class_names"]
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def document(self, i: int) -> Dict[str, Any]:
+        """还原第 i 张图像的标注文档"""
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        meta = {
+            **self.images[i],
+            "image_width": int(self.sizes[i, 0]),
+            "image_height": int(self.sizes[i, 1]),
+        }
+        return from_columnar(np.asarray(self.annotations[start:end]), meta, self.class_names)
+
+    def stats(self) -> Dict[str, Any]:
+        """按列向量化统计类别分布、每图标注数与框尺寸"""
+        ann = self.annotations
+        counts = np.diff(np.asarray(self.offsets))
+        result: Dict[str, Any] = {
+            "images": len(self),
+            "annotations": int(len(ann)),
+            "per_image": {
+                "mean": float(counts.mean()) if len(counts) else 0.0,
+                "max": int(counts.max()) if len(counts) else 0,
+                "empty": int((counts == 0).sum()),
+            },
+            "classes": [],
+        }
+        if len(ann) == 0:
+            return result
+
+        name_idx = np.asarray(ann["name_idx"])
+        class_ids = np.asarray(ann["class_id"])
+        histogram = np.bincount(name_idx, minlength=len(self.class_names))
+        for idx in np.flatnonzero(histogram):
+            result["classes"].append({
+                "class_id": int(class_ids[np.argmax(name_idx == idx)]),
+                "class_name": self.class_names[idx],
+                "count": int(histogram[idx]),
+            })
+
+        # 框尺寸按所在图像归一化
+        sizes = np.repeat(np.asarray(self.sizes, dtype=np.float64), counts, axis=0)
+        sizes[sizes == 0] = 1
+        rel_w = np.asarray(ann["width"]) / sizes[:, 0]
+        rel_h = np.asarray(ann["height"]) / sizes[:, 1]
+        result["boxes"] = {
+            "mean_width": float(rel_w.mean()),
+            "mean_height": float(rel_h.mean()),
+            "median_area": float(np.median(rel_w * rel_h)),
+            "manual_ratio": float(np.asarray(ann["is_manual"]).mean()),
+        }
+        return result
+
+
+def pack_documents(documents: Iterable[Dict[str, Any]], pack_dir: Path) -> Dict[str, Any]:
+    """将多张图像的标注文档打包为可内存映射的数据集"""
+    pack_dir = Path(pack_dir)
+    pack_dir.mkdir(parents=True, exist_ok=True)
+
+    name_table: Dict[str, int] = {}
+    arrays, images, sizes, offsets = [], [], [], [0]
+    for document in documents:
+        array, meta = to_columnar(document, name_table)
+        arrays.append(array)
+        images.append({"image_id": meta.get("image_id"), "image_path": meta.get("image_path")})
+        sizes.append((meta.get("image_width") or 0, meta.get("image_height") or 0))
+        offsets.append(offsets[-1] + len(array))
+
+    # 直接写入内存映射文件，避免再拼接一份完整副本
+    total = offsets[-1]
+    packed = np.lib.format.open_memmap(
+        pack_dir / "annotations.npy", mode="w+", dtype=ANNOTATION_DTYPE, shape=(total,)
+    )
+    for start, array in zip(offsets, arrays):
+        packed[start:start + len(array)] = array
+    packed.flush()
+    del packed
+
+    np.save(pack_dir / "offsets.npy", np.asarray(offsets, dtype=np.int64))
+    np.save(pack_dir / "images.npy", np.asarray(sizes, dtype=np.int32).reshape(-1, 2))
+    meta_path = pack_dir / "meta.json"
+    tmp_path = pack_dir / f".meta.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"images": images, "class_names": list(name_table)}, f, ensure_ascii=False)
+    os.replace(tmp_path, meta_path)
+
+    return {"images": len(images), "annotations": int(total), "class_names": list(name_table)}
@@ -0,0 +1,300 @@
+"""
+标注索引
+
+在 SQLite 中维护每张图像的标注元数据（数量、更新时间等），
+列表、计数与分页查询只访问索引，不再逐个解析标注 JSON 文件。
+"""
+import base64
+import json
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.config import settings
+
+SORTABLE_COLUMNS = {"updated_at", "created_at", "image_id", "annotation_count"}
+
+# 表结构变更时递增，旧版本索引会被重建
+_SCHEMA_VERSION = 3
+
+# 索引自己的元数据表（记录表结构版本；数据库文件与其他组件共用，不使用 PRAGMA user_version）
+_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotation_index_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotation_index (
+    image_id TEXT PRIMARY KEY,
+    image_path TEXT NOT NULL,
+    image_width INTEGER NOT NULL,
+    image_height INTEGER NOT NULL,
+    annotation_count INTEGER NOT NULL DEFAULT 0,
+    manual_count INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT '',
+    updated_at TEXT NOT NULL DEFAULT '',
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS annotation_classes (
+    image_id TEXT NOT NULL,
+    class_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (class_id, image_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_annotation_updated ON annotation_index (updated_at, image_id);
+CREATE INDEX IF NOT EXISTS idx_annotation_created ON annotation_index (created_at, image_id);
+CREATE INDEX IF NOT EXISTS idx_annotation_count ON annotation_index (annotation_count, image_id);
+CREATE INDEX IF NOT EXISTS idx_annotation_classes_image ON annotation_classes (image_id);
+"""
+
+_DROP = """
+DROP TABLE IF EXISTS annotation_index;
+DROP TABLE IF EXISTS annotation_classes;
+"""
+
+
+def sqlite_path_from_url(url: str) -> str:
+    """从 sqlite[+driver]:///path 形式的数据库 URL 中取出文件路径"""
+    if not url.startswith("sqlite") or ":///" not in url:
+        raise ValueError(f"仅支持 SQLite 数据库: {url}")
+    return url.split(":///", 1)[1]
+
+
+def encode_cursor(sort_by: str, descending: bool, value: Any, image_id: str) -> str:
+    """将最后一条记录的排序键编码为游标"""
+    raw = json.dumps([sort_by, descending, value, image_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, bool, Any, str]:
+    """解析游标，格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_by, descending, value, image_id = json.loads(raw)
+    except Exception:
+        raise ValueError("无效的游标")
+    if sort_by not in SORTABLE_COLUMNS:
+        raise ValueError("无效的游标")
+    return sort_by, bool(descending), value, image_id
+
+
+@dataclass(frozen=True)
+class AnnotationFilter:
+    """标注列表的服务端过滤条件"""
+    search: Optional[str] = None           # image_id 前缀
+    class_ids: Tuple[int, ...] = ()        # 包含任一类别
+    min_count: Optional[int] = None        # 最少标注数
+    max_count: Optional[int] = None        # 最多标注数
+    source: Optional[str] = None           # manual: 含人工标注, auto: 含自动标注
+    updated_since: Optional[str] = None    # 更新时间下限（ISO 格式）
+
+    def where(self) -> Tuple[List[str], List[Any]]:
+        """生成 SQL 条件与参数"""
+        clauses, params = [], []
+        if self.search:
+            clauses.append("image_id LIKE ? ESCAPE '\\'")
+            params.append(
+                self.search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            )
+        if self.class_ids:
+            placeholders = ",".join("?" * len(self.class_ids))
+            clauses.append(
+                f"image_id IN (SELECT image_id FROM annotation_classes WHERE class_id IN ({placeholders}))"
+            )
+            params.extend(self.class_ids)
+        if self.min_count is not None:
+            clauses.append("annotation_count >= ?")
+            params.append(self.min_count)
+        if self.max_count is not None:
+            clauses.append("annotation_count <= ?")
+            params.append(self.max_count)
+        if self.source == "manual":
+            clauses.append("manual_count > 0")
+        elif self.source == "auto":
+            clauses.append("manual_count < annotation_count")
+        elif self.source is not None:
+            raise ValueError(f"不支持的标注来源: {self.source}")
+        if self.updated_since:
+            clauses.append("updated_at >= ?")
+            params.append(self.updated_since)
+        return clauses, params
+
+
+class AnnotationIndex:
+    """标注元数据索引（每线程一个连接）"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or sqlite_path_from_url(settings.DATABASE_URL)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        # 表结构升级后需要调用方从标注文件重建
+        self.needs_rebuild = False
+        with self._conn() as conn:
+            conn.executescript(_META_SCHEMA)
+            row = conn.execute(
+                "SELECT value FROM annotation_index_meta WHERE key = 'schema_version'"
+            ).fetchone()
+            if row is None or row[0] != str(_SCHEMA_VERSION):
+                conn.executescript(_DROP)
+                conn.execute(
+                    "INSERT OR REPLACE INTO annotation_index_meta (key, value) VALUES ('schema_version', ?)",
+                    (str(_SCHEMA_VERSION),)
+                )
+                self.needs_rebuild = True
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(data: Dict[str, Any]) -> Dict[str, Any]:
+        """由标注文档生成索引行"""
+        annotations = data.get("annotations", [])
+        return {
+            "image_id": data["image_id"],
+            "image_path": data.get("image_path", ""),
+            "image_width": data.get("image_width", 0),
+            "image_height": data.get("image_height", 0),
+            "annotation_count": len(annotations),
+            "manual_count": sum(1 for ann in annotations if ann.get("is_manual")),
+            "created_at": data.get("created_at") or "",
+            "updated_at": data.get("updated_at") or "",
+            "version": data.get("version", 0),
+        }
+
+    @staticmethod
+    def _class_rows(data: Dict[str, Any]) -> List[Tuple[str, int, int]]:
+        """统计标注文档中各类别的数量"""
+        counts: Dict[int, int] = {}
+        for ann in data.get("annotations", []):
+            counts[ann["class_id"]] = counts.get(ann["class_id"], 0) + 1
+        return [(data["image_id"], class_id, n) for class_id, n in counts.items()]
+
+    def upsert(self, data: Dict[str, Any]):
+        """写入或更新一张图像的索引"""
+        self.upsert_many([data])
+
+    def upsert_many(self, documents: Iterable[Dict[str, Any]]):
+        """批量写入索引（单个事务）"""
+        documents = list(documents)
+        rows = [self._row(data) for data in documents]
+        with self._conn() as conn:
+            conn.executemany(
+                "DELETE FROM annotation_classes WHERE image_id = ?",
+                [(row["image_id"],) for row in rows]
+            )
+            conn.executemany(
+                "INSERT INTO annotation_classes (image_id, class_id, count) VALUES (?, ?, ?)",
+                [item for data in documents for item in self._class_rows(data)]
+            )
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO annotation_index (
+                    image_id, image_path, image_width, image_height,
+                    annotation_count, manual_count, created_at, updated_at, version
+                ) VALUES (
+                    :image_id, :image_path, :image_width, :image_height,
+                    :annotation_count, :manual_count, :created_at, :updated_at, :version
+                )
+                """,
+                rows
+            )
+
+    def delete(self, image_id: str):
+        """删除一张图像的索引"""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM annotation_index WHERE image_id = ?", (image_id,))
+            conn.execute("DELETE FROM annotation_classes WHERE image_id = ?", (image_id,))
+
+    def clear(self):
+        """清空索引"""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM annotation_index")
+            conn.execute("DELETE FROM annotation_classes")
+
+    def count(self, filters: Optional[AnnotationFilter] = None) -> int:
+        """统计满足条件的标注图像数"""
+        clauses, params = (filters or AnnotationFilter()).where()
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        row = self._conn().execute(
+            f"SELECT COUNT(*) FROM annotation_index {where}", params
+        ).fetchone()
+        return row[0]
+
+    def list(
+        self,
+        offset: int = 0,
+        limit: int = 20,
+        sort_by: str = "updated_at",
+        descending: bool = True,
+        filters: Optional[AnnotationFilter] = None,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        按索引排序分页列出标注
+
+        传入 cursor 时使用键集分页（忽略 offset，排序方式取自游标），
+        每页只需沿索引从上一页末尾继续扫描。
+
+        Returns:
+            (当前页记录, 下一页游标；没有更多数据时为 None)
+        """
+        clauses, params = (filters or AnnotationFilter()).where()
+        if cursor:
+            sort_by, descending, value, image_id = decode_cursor(cursor)
+            op = "<" if descending else ">"
+            clauses.append(f"({sort_by} {op} ? OR ({sort_by} = ? AND image_id {op} ?))")
+            params.extend([value, value, image_id])
+            offset = 0
+        if sort_by not in SORTABLE_COLUMNS:
+            raise ValueError(f"不支持的排序字段: {sort_by}")
+
+        direction = "DESC" if descending else "ASC"
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        # 多取一条用于判断是否还有下一页
+        rows = self._conn().execute(
+            f"""
+            SELECT image_id, image_path, annotation_count, manual_count, created_at, updated_at, version
+            FROM annotation_index {where}
+            ORDER BY {sort_by} {direction}, image_id {direction}
+            LIMIT ? OFFSET ?
+            """,
+            [*params, limit + 1, offset]
+        ).fetchall()
+
+        items = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit and items:
+            last = items[-1]
+            next_cursor = encode_cursor(sort_by, descending, last[sort_by], last["image_id"])
+        return items, next_cursor
+
+    def image_ids(self) -> List[str]:
+        """按 image_id 排序列出所有已索引图像"""
+        rows = self._conn().execute("SELECT image_id FROM annotation_index ORDER BY image_id").fetchall()
+        return [row[0] for row in rows]
+
+    def rebuild(self, documents: Iterable[Dict[str, Any]], chunk_size: int = 1000) -> int:
+        """由标注文档重建索引，返回索引的文档数"""
+        self.clear()
+        count = 0
+        chunk = []
+        for data in documents:
+            chunk.append(data)
+            if len(chunk) >= chunk_size:
+                self.upsert_many(chunk)
+                count += len(chunk)
+                chunk = []
+        self.upsert_many(chunk)
+        return count + len(chunk)
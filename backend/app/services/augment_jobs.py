@@ -0,0 +1,128 @@
+"""
+离线数据集增强任务
+
+遍历自定义数据集某个划分的图像与 YOLO 标签，按带种子的随机策略
+为每张图像生成多个增强变体，作为新的图像/标签对写回同一划分。
+图像在进程池中并行处理，每张图像只解码一次。
+"""
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from app.config import settings
+from app.services.augmentation import augment_dataset_image
+from app.services.detection_jobs import DATASET_SPLITS, list_images, resolve_dataset_dir
+from app.services.executor import task_executor
+from app.services.jobs import job_manager
+
+# 增强变体的文件名后缀（stem_aug<序号>），这些图像不会再作为增强来源
+VARIANT_PATTERN = re.compile(r"_aug\d+$")
+
+# 任务记录中最多保留的失败明细数
+MAX_REPORTED_ERRORS = 100
+
+
+def resolve_split(dataset: str, split: str) -> Tuple[Path, Path]:
+    """
+    返回数据集划分的 (图像目录, 标签目录)
+
+    Raises:
+        ValueError: 无效的数据集划分
+        PermissionError: 数据集名称指向 CUSTOM_DATASET_DIR 之外
+    """
+    if split not in DATASET_SPLITS:
+        raise ValueError(f"无效的数据集划分: {split}")
+    dataset_dir = resolve_dataset_dir(dataset)
+    images_dir = dataset_dir / "images" / split
+    if not images_dir.is_dir():
+        raise FileNotFoundError(f"数据集划分不存在: {dataset}/{split}")
+    return images_dir, dataset_dir / "labels" / split
+
+
+def plan_outputs(
+    name: str,
+    images_dir: Path,
+    labels_dir: Path,
+    variants: int,
+    overwrite: bool
+) -> List[Tuple[int, str, str]]:
+    """一张源图像待生成的 (变体序号, 图像路径, 标签路径)，已存在的变体除非覆盖否则跳过"""
+    stem, suffix = Path(name).stem, Path(name).suffix
+    outputs = []
+    for index in range(variants):
+        image_out = images_dir / f"{stem}_aug{index}{suffix}"
+        label_out = labels_dir / f"{stem}_aug{index}.txt"
+        if overwrite or not (image_out.exists() and label_out.exists()):
+            outputs.append((index, str(image_out), str(label_out)))
+    return outputs
+
+
+def run_augment_job(job: Dict[str, Any], stop_event: threading.Event) -> Dict[str, Any]:
+    """
+    执行数据集增强任务
+
+    每张源图像作为一个进程池任务提交，同时在途的任务数有上限，
+    停止时不再提交新任务，已提交的任务完成后返回。
+    """
+    params = job["params"]
+    images_dir, labels_dir = resolve_split(params["dataset"], params["split"])
+    labels_dir.mkdir(parents=True, exist_ok=True)
+
+    sources = [name for name in list_images(images_dir) if not VARIANT_PATTERN.search(Path(name).stem)]
+    job["total"] = len(sources)
+
+    pool = task_executor.process_pool
+    max_pending = settings.PROCESS_POOL_WORKERS * 4
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            name = pending.pop(future)
+            try:
+                job["variants_written"] += future.result()
+                job_manager.advance(job, processed=1)
+            except Exception as e:
+                if len(job["errors"]) < MAX_REPORTED_ERRORS:
+                    job["errors"].append({"file": name, "error": str(e)})
+                job_manager.advance(job, failed=1)
+
+    for name in sources:
+        if stop_event.is_set():
+            break
+        outputs = plan_outputs(name, images_dir, labels_dir, params["variants"], params.get("overwrite"))
+        if not outputs:
+            job_manager.advance(job, skipped=1)
+            continue
+        future = pool.submit(
+            augment_dataset_image,
+            str(images_dir / name),
+            str(labels_dir / f"{Path(name).stem}.txt"),
+            outputs,
+            params["policy"],
+            params["seed"],
+            params["min_visibility"],
+        )
+        pending[future] = name
+        if len(pending) >= max_pending:
+            collect(wait(pending, return_when=FIRST_COMPLETED).done)
+
+    collect(wait(pending).done)
+
+    return {
+        "images_dir": str(images_dir),
+        "labels_dir": str(labels_dir),
+        "variants_written": job["variants_written"],
+    }
+
+
+def submit_augment_job(params: Dict[str, Any]) -> Dict[str, Any]:
+    """创建并启动数据集增强任务"""
+    # 提前校验来源，参数错误时直接返回给调用方
+    resolve_split(params["dataset"], params["split"])
+    job = job_manager.create("augment", params)
+    job["variants_written"] = 0
+    job["errors"] = []
+    job_manager.start(job, run_augment_job)
+    return job_manager.get(job["job_id"])
@@ -0,0 +1,412 @@
+"""
+图像增强流水线
+
+把请求的增强操作编译为尽量少的像素遍历：
+裁剪、缩放、旋转与翻转合成一个仿射矩阵，只做一次 warpAffine，
+同一矩阵也用于变换标注框；
+亮度与对比度合成一张查找表，饱和度与色调在一次 HSV 往返中完成。
+"""
+import math
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from app.services.exporters import format_yolo_lines
+
+
+@dataclass(frozen=True)
+class AugmentConfig:
+    """增强参数"""
+    crop: Optional[Tuple[int, int, int, int]] = None  # 裁剪区域 (x, y, width, height)，先于其他变换
+    resize_width: Optional[int] = None
+    resize_height: Optional[int] = None
+    rotate: Optional[float] = None          # 逆时针角度，画布扩展到完整容纳旋转后的图像
+    flip_horizontal: bool = False
+    flip_vertical: bool = False
+    brightness: Optional[float] = None      # 亮度系数 (1.0 不变)
+    contrast: Optional[float] = None        # 对比度系数 (1.0 不变)
+    saturation: Optional[float] = None      # 饱和度系数 (1.0 不变)
+    hue_shift: Optional[int] = None         # 色调偏移 (OpenCV 色调范围 0-179)
+    fill: Tuple[int, int, int] = (128, 128, 128)  # 旋转后空白区域的填充色 (RGB)
+
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any], fill: Tuple[int, int, int] = (0, 0, 0)) -> "AugmentConfig":
+        """由批量增强的配置字典创建（resize 为 [width, height]）"""
+        resize = config.get("resize") or (None, None)
+        crop = config.get("crop")
+        if isinstance(crop, dict):
+            crop = (crop["x"], crop["y"], crop["width"], crop["height"])
+        return cls(
+            crop=tuple(int(v) for v in crop) if crop else None,
+            resize_width=config.get("resize_width", resize[0]),
+            resize_height=config.get("resize_height", resize[1]),
+            rotate=config.get("rotate"),
+            flip_horizontal=bool(config.get("flip_horizontal")),
+            flip_vertical=bool(config.get("flip_vertical")),
+            brightness=config.get("brightness"),
+            contrast=config.get("contrast"),
+            saturation=config.get("saturation"),
+            hue_shift=config.get("hue_shift", config.get("hue")),
+            fill=tuple(config.get("fill", fill)),
+        )
+
+
+class AugmentPipeline:
+    """按配置编译的增强流水线（可对多张图像复用）"""
+
+    def __init__(self, config: AugmentConfig):
+        self.config = config
+
+    def crop_box(self, width: int, height: int) -> Tuple[int, int, int, int]:
+        """限制在图像范围内的裁剪区域 (x, y, width, height)"""
+        if not self.config.crop:
+            return 0, 0, width, height
+        x, y, w, h = self.config.crop
+        x0, y0 = min(max(x, 0), width), min(max(y, 0), height)
+        x1, y1 = min(x + w, width), min(y + h, height)
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError("裁剪区域超出图像范围")
+        return x0, y0, x1 - x0, y1 - y0
+
+    def target_size(self, width: int, height: int) -> Tuple[int, int]:
+        """缩放后的尺寸（只指定一边时按比例缩放）"""
+        c = self.config
+        if c.resize_width and c.resize_height:
+            return c.resize_width, c.resize_height
+        if c.resize_width:
+            return c.resize_width, int(height * c.resize_width / width)
+        if c.resize_height:
+            return int(width * c.resize_height / height), c.resize_height
+        return width, height
+
+    def geometry(self, width: int, height: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        合成裁剪 → 缩放 → 旋转 → 翻转的仿射矩阵
+
+        Returns:
+            (3x3 矩阵, 输出尺寸 (width, height))，坐标以像素中心为准
+        """
+        c = self.config
+        cx, cy, cw, ch = self.crop_box(width, height)
+        w1, h1 = self.target_size(cw, ch)
+        sx, sy = w1 / cw, h1 / ch
+        matrix = np.array([
+            [sx, 0, 0.5 * sx - 0.5 - sx * cx],
+            [0, sy, 0.5 * sy - 0.5 - sy * cy],
+            [0, 0, 1],
+        ], dtype=np.float64)
+        out_w, out_h = w1, h1
+
+        if c.rotate:
+            # 画布尺寸与 PIL rotate(expand=True) 一致：旋转后四角坐标的取整外包
+            theta = math.radians(c.rotate)
+            cos, sin = round(math.cos(theta), 15), round(math.sin(theta), 15)
+            xs, ys = [], []
+            for x, y in ((0, 0), (w1, 0), (w1, h1), (0, h1)):
+                dx, dy = x - w1 / 2, y - h1 / 2
+                xs.append(w1 / 2 + cos * dx + sin * dy)
+                ys.append(h1 / 2 - sin * dx + cos * dy)
+            out_w = math.ceil(max(xs)) - math.floor(min(xs))
+            out_h = math.ceil(max(ys)) - math.floor(min(ys))
+            rotation = np.vstack([
+                cv2.getRotationMatrix2D(((w1 - 1) / 2, (h1 - 1) / 2), c.rotate, 1.0),
+                [0, 0, 1],
+            ])
+            rotation[0, 2] += (out_w - w1) / 2
+            rotation[1, 2] += (out_h - h1) / 2
+            matrix = rotation @ matrix
+
+        if c.flip_horizontal or c.flip_vertical:
+            flip = np.eye(3)
+            if c.flip_horizontal:
+                flip[0, 0], flip[0, 2] = -1, out_w - 1
+            if c.flip_vertical:
+                flip[1, 1], flip[1, 2] = -1, out_h - 1
+            matrix = flip @ matrix
+
+        return matrix, (out_w, out_h)
+
+    def apply(self, img: np.ndarray) -> np.ndarray:
+        """对 BGR / BGRA / 灰度图像执行增强"""
+        img, _ = self.apply_geometry(img)
+        return self.apply_color(img)
+
+    def apply_geometry(self, img: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        执行几何变换
+
+        Returns:
+            (变换后的图像, 3x3 仿射矩阵)
+        """
+        c = self.config
+        h, w = img.shape[:2]
+        matrix, (out_w, out_h) = self.geometry(w, h)
+        if np.allclose(matrix, np.eye(3)) and (out_w, out_h) == (w, h):
+            return img, matrix
+
+        if not c.rotate:
+            # 无旋转时裁剪用切片，缩放用 resize（缩小时面积插值避免混叠），翻转用内存拷贝
+            cx, cy, cw, ch = self.crop_box(w, h)
+            if (cw, ch) != (w, h):
+                img = img[cy:cy + ch, cx:cx + cw]
+                h, w = ch, cw
+            if (out_w, out_h) != (w, h):
+                interpolation = cv2.INTER_AREA if out_w * out_h < w * h else cv2.INTER_CUBIC
+                img = cv2.resize(img, (out_w, out_h), interpolation=interpolation)
+            if c.flip_horizontal or c.flip_vertical:
+                code = -1 if c.flip_horizontal and c.flip_vertical else (1 if c.flip_horizontal else 0)
+                img = cv2.flip(img, code)
+            return img, matrix
+
+        fill = tuple(reversed(c.fill))
+        if img.ndim == 2:
+            fill = int(round(0.299 * c.fill[0] + 0.587 * c.fill[1] + 0.114 * c.fill[2]))
+        elif img.shape[2] == 4:
+            fill = fill + (255,)
+        img = cv2.warpAffine(
+            img, matrix[:2], (out_w, out_h),
+            flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=fill
+        )
+        return img, matrix
+
+    def apply_color(self, img: np.ndarray) -> np.ndarray:
+        """执行颜色变换（亮度/对比度一张查找表，饱和度/色调一次 HSV 往返）"""
+        c = self.config
+        alpha = None
+        if img.ndim == 3 and img.shape[2] == 4:
+            img, alpha = img[:, :, :3], img[:, :, 3]
+
+        if c.brightness is not None or c.contrast is not None:
+            img = cv2.LUT(img, self._tone_lut(img))
+
+        if img.ndim == 3 and (c.saturation is not None or c.hue_shift):
+            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            values = np.arange(256, dtype=np.float64)
+            hue_lut = ((values + (c.hue_shift or 0)) % 180).astype(np.uint8)
+            sat_lut = np.clip(values * (c.saturation if c.saturation is not None else 1.0), 0, 255).astype(np.uint8)
+            identity = np.arange(256, dtype=np.uint8)
+            lut = np.dstack([hue_lut, sat_lut, identity]).reshape(1, 256, 3)
+            img = cv2.cvtColor(cv2.LUT(hsv, lut), cv2.COLOR_HSV2BGR)
+
+        if alpha is not None:
+            img = np.dstack([img, alpha])
+        return img
+
+    def _tone_lut(self, img: np.ndarray) -> np.ndarray:
+        """亮度后接对比度（以亮度调整后的灰度均值为中心）的查找表"""
+        c = self.config
+        values = np.arange(256, dtype=np.float64)
+        lut = np.clip(np.round(values * c.brightness), 0, 255) if c.brightness is not None else values
+        if c.contrast is not None:
+            # 灰度直方图经亮度表映射后求均值，无需生成中间图像
+            gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+            mean = float(hist @ lut / max(hist.sum(), 1))
+            lut = np.clip(np.round(mean + c.contrast * (lut - mean)), 0, 255)
+        return lut.astype(np.uint8)
+
+
+def transform_boxes(
+    boxes: Sequence[Sequence[float]],
+    matrix: np.ndarray,
+    size: Tuple[int, int],
+    min_visibility: float = 0.0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    用几何变换矩阵变换 xywh 标注框
+
+    变换四个角点后取外接框并裁剪到输出图像范围内。
+
+    Args:
+        boxes: (n, 4) 像素坐标 x, y, w, h
+        matrix: AugmentPipeline.geometry 返回的 3x3 矩阵（像素中心坐标）
+        size: 输出图像尺寸 (width, height)
+        min_visibility: 裁剪后保留面积占变换后面积的最小比例
+
+    Returns:
+        (变换后的 (n, 4) 框, 是否保留的布尔掩码)
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    corners = np.stack([
+        np.column_stack((x1, y1)), np.column_stack((x2, y1)),
+        np.column_stack((x2, y2)), np.column_stack((x1, y2)),
+    ], axis=1)
+
+    # 框坐标以像素边界为准，与像素中心坐标相差半个像素
+    points = (corners - 0.5) @ matrix[:2, :2].T + matrix[:2, 2] + 0.5
+    lower, upper = points.min(axis=1), points.max(axis=1)
+    full_area = np.prod(upper - lower, axis=1)
+
+    bounds = np.array(size, dtype=np.float64)
+    lower, upper = np.clip(lower, 0, bounds), np.clip(upper, 0, bounds)
+    extent = upper - lower
+    keep = (extent >= 1).all(axis=1) & (np.prod(extent, axis=1) >= min_visibility * full_area)
+    return np.column_stack((lower, extent)), keep
+
+
+def decode(content: bytes) -> np.ndarray:
+    """解码图像字节（保留透明通道，非 8 位图像转换为 8 位 BGR）"""
+    buffer = np.frombuffer(content, dtype=np.uint8)
+    img = cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+    if img is not None and img.dtype != np.uint8:
+        img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("无法解码图像")
+    return img
+
+
+def encode_to_file(img: np.ndarray, save_path: Path):
+    """按扩展名编码并写出图像（支持中文路径）"""
+    save_path = Path(save_path)
+    ok, encoded = cv2.imencode(save_path.suffix or ".png", img)
+    if not ok:
+        raise ValueError(f"不支持的图像格式: {save_path.suffix}")
+    encoded.tofile(str(save_path))
+
+
+def augment_file(content: bytes, save_path: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    解码、增强并保存单张图像（在进程池中运行）
+
+    Args:
+        config: AugmentConfig 的字段字典
+    """
+    img = decode(content)
+    augmented = AugmentPipeline(AugmentConfig(**config)).apply(img)
+    _save(augmented, save_path)
+    return _sizes(img, augmented)
+
+
+def augment_file_with_boxes(
+    image_path: str,
+    save_path: str,
+    config: Dict[str, Any],
+    boxes: Sequence[Sequence[float]],
+    min_visibility: float = 0.0
+) -> Dict[str, Any]:
+    """
+    增强磁盘上的图像并同步变换其标注框（在进程池中运行）
+
+    Returns:
+        尺寸信息，以及变换后的 boxes 与保留掩码 keep（与输入框一一对应）
+    """
+    img = decode(np.fromfile(image_path, dtype=np.uint8))
+    pipeline = AugmentPipeline(AugmentConfig(**config))
+    augmented, matrix = pipeline.apply_geometry(img)
+    augmented = pipeline.apply_color(augmented)
+    _save(augmented, save_path)
+
+    size = (augmented.shape[1], augmented.shape[0])
+    new_boxes, keep = transform_boxes(boxes, matrix, size, min_visibility)
+    result = _sizes(img, augmented)
+    result["boxes"] = np.round(new_boxes, 2).tolist()
+    result["keep"] = keep.tolist()
+    return result
+
+
+def _save(img: np.ndarray, save_path: str):
+    try:
+        encode_to_file(img, Path(save_path))
+    except Exception:
+        Path(save_path).unlink(missing_ok=True)
+        raise
+
+
+def _sizes(original: np.ndarray, augmented: np.ndarray) -> Dict[str, Any]:
+    return {
+        "original_size": {"width": original.shape[1], "height": original.shape[0]},
+        "augmented_size": {"width": augmented.shape[1], "height": augmented.shape[0]},
+    }
+
+
+def sample_config(policy: Dict[str, Any], rng: np.random.Generator, width: int, height: int) -> AugmentConfig:
+    """按随机增强策略（AugmentPolicy 字段）为一张图像采样增强参数"""
+    def factor(spread: float) -> Optional[float]:
+        return float(rng.uniform(1 - spread, 1 + spread)) if spread else None
+
+    crop = None
+    crop_scale = policy.get("crop_scale", 1.0)
+    if crop_scale < 1:
+        scale = rng.uniform(crop_scale, 1)
+        cw, ch = max(int(width * scale), 1), max(int(height * scale), 1)
+        crop = (int(rng.integers(0, width - cw + 1)), int(rng.integers(0, height - ch + 1)), cw, ch)
+    rotate = policy.get("rotate", 0)
+    hue = policy.get("hue", 0)
+    return AugmentConfig(
+        crop=crop,
+        rotate=float(rng.uniform(-rotate, rotate)) if rotate else None,
+        flip_horizontal=bool(rng.random() < policy.get("flip_horizontal", 0)),
+        flip_vertical=bool(rng.random() < policy.get("flip_vertical", 0)),
+        brightness=factor(policy.get("brightness", 0)),
+        contrast=factor(policy.get("contrast", 0)),
+        saturation=factor(policy.get("saturation", 0)),
+        hue_shift=int(rng.integers(-hue, hue + 1)) if hue else None,
+        fill=(114, 114, 114),
+    )
+
+
+def read_yolo_labels(label_path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读取 YOLO 标签文件
+
+    Returns:
+        (类别ID (n,), 归一化 xc yc w h (n, 4))；文件不存在时为空
+    """
+    rows = []
+    if label_path.is_file():
+        for line in label_path.read_text(encoding="utf-8").splitlines():
+            fields = line.split()
+            if len(fields) >= 5:
+                rows.append([float(v) for v in fields[:5]])
+    table = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    return table[:, 0].astype(np.int64), table[:, 1:]
+
+
+def augment_dataset_image(
+    image_path: str,
+    label_path: str,
+    outputs: Sequence[Tuple[int, str, str]],
+    policy: Dict[str, Any],
+    seed: int,
+    min_visibility: float = 0.0
+) -> int:
+    """
+    为数据集中的一张图像生成多个增强变体及其 YOLO 标签（在进程池中运行）
+
+    图像只解码一次；每个变体的随机数由 (seed, 文件名, 变体序号) 决定，
+    结果与处理顺序和进程数无关。
+
+    Args:
+        outputs: 待生成变体的 (变体序号, 图像输出路径, 标签输出路径)
+    Returns:
+        写出的变体数
+    """
+    image_path, label_path = Path(image_path), Path(label_path)
+    img = decode(np.fromfile(str(image_path), dtype=np.uint8))
+    height, width = img.shape[:2]
+
+    class_ids, normalized = read_yolo_labels(label_path)
+    xywh = normalized * [width, height, width, height]
+    boxes = np.column_stack((xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, 2:]))
+
+    name_key = zlib.crc32(image_path.name.encode("utf-8"))
+    for index, image_out, label_out in outputs:
+        rng = np.random.default_rng([seed, name_key, index])
+        pipeline = AugmentPipeline(sample_config(policy, rng, width, height))
+        augmented, matrix = pipeline.apply_geometry(img)
+        augmented = pipeline.apply_color(augmented)
+
+        out_h, out_w = augmented.shape[:2]
+        new_boxes, keep = transform_boxes(boxes, matrix, (out_w, out_h), min_visibility)
+        _save(augmented, image_out)
+        Path(label_out).write_text(
+            format_yolo_lines(class_ids[keep].tolist(), new_boxes[keep], out_w, out_h),
+            encoding="utf-8"
+        )
+    return len(outputs)
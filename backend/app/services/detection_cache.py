@@ -0,0 +1,174 @@
+"""
+检测结果缓存
+
+以图像内容哈希与推理参数为键缓存检测结果，
+内存层按 LRU/TTL 淘汰，可选的磁盘层在进程重启后仍然有效。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from app.config import settings
+from app.models import DetectionResult, CompactDetectionResult
+
+CachedResult = Union[DetectionResult, CompactDetectionResult]
+
+
+class DetectionCache:
+    """内容寻址的检测结果缓存（线程安全）"""
+
+    def __init__(
+        self,
+        max_entries: int = None,
+        ttl: float = None,
+        disk_dir: Optional[str] = None
+    ):
+        self.max_entries = max_entries if max_entries is not None else settings.DETECTION_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else settings.DETECTION_CACHE_TTL
+        if disk_dir is None and settings.DETECTION_CACHE_DISK:
+            disk_dir = settings.DETECTION_CACHE_DIR
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+        self._entries: "OrderedDict[str, Tuple[float, CachedResult]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def hash_content(content: bytes) -> str:
+        """计算图像内容哈希"""
+        return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+    @staticmethod
+    def make_key(
+        content_hash: str,
+        weights: str,
+        conf_threshold: float,
+        iou_threshold: float,
+        img_size: int,
+        classes: Optional[List[int]] = None,
+        compact: bool = False
+    ) -> str:
+        """由内容哈希与推理参数生成缓存键"""
+        parts = [
+            content_hash,
+            weights or settings.DEFAULT_WEIGHTS,
+            f"{conf_threshold:g}",
+            f"{iou_threshold:g}",
+            str(img_size),
+            ",".join(str(c) for c in sorted(set(classes))) if classes else "*",
+            "columnar" if compact else "objects",
+        ]
+        return hashlib.blake2b("|".join(parts).encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        """
+        查询缓存，命中时返回带新 image_id 的副本
+
+        磁盘层命中会回填内存层。
+        """
+        now = time.time()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                created_at, result = item
+                if self.ttl <= 0 or now - created_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return self._copy(result)
+                del self._entries[key]
+
+        result = self._disk_get(key, now)
+        with self._lock:
+            if result is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._insert(key, result, now)
+        return self._copy(result)
+
+    def put(self, key: str, result: CachedResult):
+        """写入缓存"""
+        result = result.model_copy(deep=True)
+        with self._lock:
+            self._insert(key, result, time.time())
+        self._disk_put(key, result)
+
+    def clear(self) -> int:
+        """清空缓存，返回清理的条目数"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+        if self.disk_dir is not None:
+            for file in self.disk_dir.glob("*.json"):
+                file.unlink(missing_ok=True)
+                count += 1
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        with self._lock:
+            requests = self._stats["hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = self._stats["hits"] + self._stats["disk_hits"]
+            return {
+                **self._stats,
+                "hit_rate": round(hits / requests, 4) if requests else 0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "disk_enabled": self.disk_dir is not None,
+            }
+
+    def _insert(self, key: str, result: CachedResult, created_at: float):
+        """插入内存层并按 LRU 淘汰（需持有锁）"""
+        self._entries[key] = (created_at, result)
+        self._entries.move_to_end(key)
+        while self.max_entries > 0 and len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    @staticmethod
+    def _copy(result: CachedResult) -> CachedResult:
+        """返回可安全修改的副本，每次命中分配新的 image_id"""
+        return result.model_copy(update={"image_id": str(uuid.uuid4())}, deep=True)
+
+    def _disk_get(self, key: str, now: float) -> Optional[CachedResult]:
+        if self.disk_dir is None:
+            return None
+        path = self.disk_dir / f"{key}.json"
+        try:
+            if self.ttl > 0 and now - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        model = CompactDetectionResult if data.get("format") == "columnar" else DetectionResult
+        return model.model_validate(data["result"])
+
+    def _disk_put(self, key: str, result: CachedResult):
+        if self.disk_dir is None:
+            return
+        data = {
+            "format": "columnar" if isinstance(result, CompactDetectionResult) else "objects",
+            "result": result.model_dump(),
+        }
+        # 先写临时文件再替换，避免读到写了一半的缓存
+        path = self.disk_dir / f"{key}.json"
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+# 全局检测缓存实例
+detection_cache = DetectionCache()
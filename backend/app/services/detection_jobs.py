@@ -0,0 +1,279 @@
+"""
+批量检测任务
+
+对自定义数据集划分或服务器目录中的全部图像执行检测（预标注），
+边处理边写出 YOLO 标签与标注 JSON，并记录可续跑的检查点。
+"""
+import hashlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings, DATASET_DIR
+from app.models import Annotation, AnnotationSaveRequest, BoundingBox, CompactDetectionResult
+from app.services.annotation import annotation_service
+from app.services.detector import detector, load_image, InferenceConfig
+from app.services.exporters import format_yolo_lines
+from app.services.jobs import job_manager
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+# 自定义数据集的划分
+DATASET_SPLITS = ("train", "val", "test")
+
+
+def to_static_url(path: Path) -> str:
+    """将服务器路径转换为静态文件访问路径"""
+    path = path.resolve()
+    for root, prefix in [
+        (Path(settings.CUSTOM_DATASET_DIR), "/custom_datasets"),
+        (DATASET_DIR, "/datasets"),
+        (Path(settings.UPLOAD_DIR), "/uploads"),
+    ]:
+        try:
+            return f"{prefix}/{path.relative_to(root.resolve()).as_posix()}"
+        except ValueError:
+            continue
+    return str(path)
+
+
+def is_within(path: Path, root: Path) -> bool:
+    """判断路径是否位于 root 目录内"""
+    try:
+        path.resolve().relative_to(root.resolve())
+        return True
+    except ValueError:
+        return False
+
+
+def resolve_dataset_dir(dataset: str) -> Path:
+    """
+    自定义数据集目录
+
+    Raises:
+        PermissionError: 数据集名称指向 CUSTOM_DATASET_DIR 之外
+    """
+    root = Path(settings.CUSTOM_DATASET_DIR).resolve()
+    dataset_dir = (root / dataset).resolve()
+    if dataset_dir == root or not is_within(dataset_dir, root):
+        raise PermissionError(f"不允许访问的数据集: {dataset}")
+    return dataset_dir
+
+
+def safe_id(text: str) -> str:
+    """将名称转换为可用于 image_id 与文件名的片段（只保留字母、数字、下划线、点与连字符）"""
+    return re.sub(r"[^\w.-]", "_", text).lstrip(".") or "_"
+
+
+def source_id_prefix(label: str, source: Path) -> str:
+    """
+    批量检测生成的 image_id 前缀
+
+    由可读的来源名称与来源目录路径的短哈希组成，
+    名称相近（或清理后相同）的不同来源不会得到相同的 image_id。
+    """
+    digest = hashlib.blake2b(str(source.resolve()).encode("utf-8"), digest_size=4).hexdigest()
+    return f"{safe_id(label)}_{digest}"
+
+
+def list_images(directory: Path) -> List[str]:
+    """列出目录中的图像文件名（排序）"""
+    if not directory.is_dir():
+        return []
+    return sorted(
+        entry.name for entry in directory.iterdir()
+        if entry.is_file() and entry.suffix.lower() in IMAGE_SUFFIXES
+    )
+
+
+def resolve_source(params: Dict[str, Any]) -> Tuple[Path, Path, Path, str]:
+    """
+    解析任务的图像来源
+
+    Returns:
+        (图像目录, 标签目录, 检查点文件, image_id 前缀)
+    """
+    if params.get("dataset"):
+        split = params.get("split") or "train"
+        if split not in DATASET_SPLITS:
+            raise ValueError(f"无效的数据集划分: {split}")
+        dataset_dir = resolve_dataset_dir(params["dataset"])
+        if not dataset_dir.is_dir():
+            raise FileNotFoundError(f"数据集不存在: {params['dataset']}")
+        images_dir = dataset_dir / "images" / split
+        return (
+            images_dir,
+            dataset_dir / "labels" / split,
+            dataset_dir / f".detect_checkpoint_{split}.txt",
+            source_id_prefix(f"{dataset_dir.name}_{split}", images_dir),
+        )
+
+    source_dir = Path(params.get("source_dir") or "").resolve()
+    allowed_roots = [Path(settings.CUSTOM_DATASET_DIR), DATASET_DIR, Path(settings.UPLOAD_DIR)]
+    if not any(is_within(source_dir, root) for root in allowed_roots):
+        raise PermissionError(f"不允许访问的目录: {source_dir}")
+    if not source_dir.is_dir():
+        raise FileNotFoundError(f"目录不存在: {source_dir}")
+
+    # 遵循 YOLO 约定：.../images/xxx 对应 .../labels/xxx
+    parts = list(source_dir.parts)
+    if "images" in parts:
+        idx = len(parts) - 1 - parts[::-1].index("images")
+        labels_dir = Path(*parts[:idx], "labels", *parts[idx + 1:])
+    else:
+        labels_dir = source_dir / "labels"
+    return (
+        source_dir,
+        labels_dir,
+        source_dir / ".detect_checkpoint.txt",
+        source_id_prefix(source_dir.name, source_dir),
+    )
+
+
+def _safe_load(path: Path) -> Optional[np.ndarray]:
+    try:
+        return load_image(str(path))
+    except Exception:
+        return None
+
+
+def write_yolo_label(result: CompactDetectionResult, label_path: Path):
+    """将列式检测结果写为 YOLO 标签（归一化 xc yc w h）"""
+    label_path.write_text(format_yolo_lines(
+        result.class_ids, result.boxes, result.image_width, result.image_height
+    ))
+
+
+def save_result_annotations(result: CompactDetectionResult, image_id: str, image_path: Path):
+    """将列式检测结果保存为标注数据"""
+    annotations = [
+        Annotation(
+            id=idx + 1,
+            class_id=cls,
+            class_name=result.class_names.get(cls, str(cls)),
+            bbox=BoundingBox(x=x, y=y, width=w, height=h),
+            is_manual=False,
+            confidence=score
+        )
+        for idx, ((x, y, w, h), score, cls) in enumerate(
+            zip(result.boxes, result.scores, result.class_ids)
+        )
+    ]
+    annotation_service.save_annotations(AnnotationSaveRequest(
+        image_id=image_id,
+        image_path=to_static_url(image_path),
+        image_width=result.image_width,
+        image_height=result.image_height,
+        annotations=annotations
+    ))
+
+
+def run_detection_job(job: Dict[str, Any], stop_event: threading.Event) -> Dict[str, Any]:
+    """
+    执行批量检测任务
+
+    解码与结果写出在线程池中进行，下一批图像的解码与当前批次推理重叠；
+    整批推理失败时逐张重试，只有出错的图像计为失败。
+    每批写出完成后把成功处理的图像追加到检查点，中断后以 resume 重新提交即可从断点继续，
+    读取或推理失败的图像会在续跑时重试。
+    """
+    params = job["params"]
+    images_dir, labels_dir, checkpoint, id_prefix = resolve_source(params)
+    labels_dir.mkdir(parents=True, exist_ok=True)
+
+    names = list_images(images_dir)
+    done = set()
+    if params.get("resume", True) and checkpoint.exists():
+        done = set(checkpoint.read_text(encoding="utf-8").splitlines())
+    todo = [
+        name for name in names
+        if name not in done
+        and (params.get("overwrite") or not (labels_dir / f"{Path(name).stem}.txt").exists())
+    ]
+
+    job["total"] = len(names)
+    job_manager.advance(job, skipped=len(names) - len(todo))
+
+    batch_size = params.get("batch_size") or settings.DETECT_MAX_BATCH_SIZE
+    chunks = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    config = InferenceConfig.create(
+        params.get("conf_threshold", 0.25), params.get("iou_threshold", 0.45), params.get("classes")
+    )
+
+    def detect(valid: List[Tuple[str, np.ndarray]]) -> List[Tuple[str, CompactDetectionResult]]:
+        """批量推理；整批失败时逐张重试，返回推理成功的 (文件名, 结果)"""
+        try:
+            results = detector.detect_batch(
+                [str(images_dir / name) for name, _ in valid],
+                img_size=params.get("img_size", 640),
+                weights=params.get("weights"),
+                batch_size=len(valid),
+                compact=True,
+                configs=[config] * len(valid),
+                images=[img for _, img in valid]
+            )
+        except Exception:
+            if len(valid) == 1:
+                return []
+            return [item for pair in valid for item in detect([pair])]
+        return [(name, result) for (name, _), result in zip(valid, results)]
+
+    with ThreadPoolExecutor(max_workers=params.get("workers") or 4) as pool, \
+            open(checkpoint, "a" if done else "w", encoding="utf-8") as ckpt:
+
+        def prefetch(chunk: List[str]):
+            return [pool.submit(_safe_load, images_dir / name) for name in chunk]
+
+        next_images = prefetch(chunks[0]) if chunks else []
+        for i, chunk in enumerate(chunks):
+            if stop_event.is_set():
+                break
+
+            loaded = [f.result() for f in next_images]
+            next_images = prefetch(chunks[i + 1]) if i + 1 < len(chunks) else []
+
+            valid = [(name, img) for name, img in zip(chunk, loaded) if img is not None]
+            detected = detect(valid) if valid else []
+
+            writes = []
+            for name, result in detected:
+                stem = Path(name).stem
+                futures = [pool.submit(write_yolo_label, result, labels_dir / f"{stem}.txt")]
+                if params.get("save_annotations", True):
+                    futures.append(pool.submit(
+                        save_result_annotations, result, f"{id_prefix}_{safe_id(stem)}", images_dir / name
+                    ))
+                writes.append((name, futures))
+
+            processed = []
+            for name, futures in writes:
+                try:
+                    for f in futures:
+                        f.result()
+                except Exception:
+                    continue
+                processed.append(name)
+
+            # 只记录成功处理的图像，读取、推理或写出失败的图像续跑时重试
+            ckpt.write("".join(f"{name}\n" for name in processed))
+            ckpt.flush()
+            job_manager.advance(job, processed=len(processed), failed=len(chunk) - len(processed))
+
+    return {
+        "images_dir": str(images_dir),
+        "labels_dir": str(labels_dir),
+        "checkpoint": str(checkpoint),
+    }
+
+
+def submit_detection_job(params: Dict[str, Any]) -> Dict[str, Any]:
+    """创建并启动批量检测任务"""
+    # 提前校验来源，参数错误时直接返回给调用方
+    resolve_source(params)
+    job = job_manager.create("detection", params)
+    job_manager.start(job, run_detection_job)
+    return job_manager.get(job["job_id"])
@@ -5,10 +5,12 @@ import sys
 import time
 import uuid
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from dataclasses import dataclass
+from typing import List, Optional, Dict, Any, Tuple, Union
+import cv2
 import numpy as np
 import torch
-from PIL import Image
+import torchvision
 
 # 确保 yolov5 在路径中
 YOLOV5_PATH = Path(__file__).resolve().parent.parent.parent.parent / "yolov5"
@@ -16,18 +18,125 @@ if str(YOLOV5_PATH) not in sys.path:
     sys.path.insert(0, str(YOLOV5_PATH))
 
 from app.config import settings
-from app.models import Detection, BoundingBox, DetectionResult, COCO_CLASSES
+from app.models import (
+    Detection, BoundingBox, DetectionResult, CompactDetectionResult, COCO_CLASSES
+)
+from app.services.model_registry import ModelRegistry
+
+
+@dataclass(frozen=True)
+class InferenceConfig:
+    """
+    单次请求的推理参数
+
+    只在后处理（NMS）阶段使用，不写入共享的模型对象，
+    因此同一模型可以同时服务参数不同的并发请求。
+    """
+    conf_threshold: float = 0.25
+    iou_threshold: float = 0.45
+    classes: Optional[Tuple[int, ...]] = None
+    max_det: int = 1000
+
+    @classmethod
+    def create(
+        cls,
+        conf_threshold: float = 0.25,
+        iou_threshold: float = 0.45,
+        classes: Optional[List[int]] = None
+    ) -> "InferenceConfig":
+        return cls(conf_threshold, iou_threshold, tuple(classes) if classes else None)
+
+
+def decode_image(content: bytes) -> np.ndarray:
+    """将内存中的图像字节解码为 RGB 数组"""
+    img = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("无法解码图像数据")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def load_image(image_path: str) -> np.ndarray:
+    """读取图像为 RGB 数组，支持中文路径"""
+    img = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"无法读取图像: {image_path}")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def letterbox(
+    img: np.ndarray,
+    new_shape: Tuple[int, int],
+    color: Tuple[int, int, int] = (114, 114, 114)
+) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """
+    等比缩放并填充到指定尺寸 (h, w)
+
+    Returns:
+        填充后的图像、缩放比例、(左, 上) 填充量
+    """
+    shape = img.shape[:2]
+    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+    new_unpad = (int(round(shape[1] * r)), int(round(shape[0] * r)))
+    dw = (new_shape[1] - new_unpad[0]) / 2
+    dh = (new_shape[0] - new_unpad[1]) / 2
+
+    if (shape[1], shape[0]) != new_unpad:
+        img = cv2.resize(img, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return img, r, (dw, dh)
+
+
+def non_max_suppression(
+    prediction: torch.Tensor,
+    conf_threshold: float = 0.25,
+    iou_threshold: float = 0.45,
+    classes: Optional[List[int]] = None,
+    max_det: int = 1000
+) -> List[torch.Tensor]:
+    """
+    对模型原始输出执行 NMS
+
+    Args:
+        prediction: 形状为 (batch, anchors, 5 + nc) 的原始预测 (xywh, obj, cls...)
+
+    Returns:
+        每张图像一个 (n, 6) 张量: x1, y1, x2, y2, conf, cls
+    """
+    output = []
+    for x in prediction:
+        x = x[x[:, 4] > conf_threshold]
+        if not x.shape[0]:
+            output.append(torch.zeros((0, 6), device=prediction.device))
+            continue
+
+        # 置信度 = 目标置信度 * 类别置信度
+        cls_scores = x[:, 5:] * x[:, 4:5]
+        conf, cls = cls_scores.max(1)
+
+        xy, wh = x[:, :2], x[:, 2:4] / 2
+        boxes = torch.cat((xy - wh, xy + wh), 1)
+
+        mask = conf > conf_threshold
+        if classes:
+            mask &= (cls[:, None] == torch.tensor(classes, device=cls.device)).any(1)
+        boxes, conf, cls = boxes[mask], conf[mask], cls[mask]
+
+        keep = torchvision.ops.batched_nms(boxes, conf, cls, iou_threshold)[:max_det]
+        output.append(torch.cat((boxes[keep], conf[keep, None], cls[keep, None].float()), 1))
+    return output
 
 
 class YOLOv5Detector:
     """YOLOv5 检测器封装"""
     
     _instance = None
-    _models: Dict[str, Any] = {}
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            cls._instance.registry = ModelRegistry()
         return cls._instance
     
     def __init__(self):
@@ -40,14 +149,14 @@ class YOLOv5Detector:
         return "cpu"
     
     def load_model(self, weights: str = None) -> Any:
-        """加载模型"""
+        """加载模型（经由模型注册表缓存）"""
         if weights is None:
             weights = settings.DEFAULT_WEIGHTS
         
-        # 检查模型是否已加载
-        if weights in self._models:
-            return self._models[weights]
-        
+        return self.registry.get(weights, lambda: self._load_from_disk(weights))
+    
+    def _load_from_disk(self, weights: str) -> Any:
+        """从权重文件加载模型"""
         # 构建权重路径
         if not Path(weights).is_absolute():
             # 首先检查 yolov5 根目录
@@ -62,16 +171,13 @@ class YOLOv5Detector:
             raise FileNotFoundError(f"权重文件不存在: {weights_path}")
         
         # 使用 torch.hub 加载模型
-        model = torch.hub.load(
+        return torch.hub.load(
             str(YOLOV5_PATH),
             'custom',
             path=str(weights_path),
             source='local',
             device=self.device
         )
-        
-        self._models[weights] = model
-        return model
     
     def detect(
         self,
@@ -80,8 +186,10 @@ class YOLOv5Detector:
         iou_threshold: float = 0.45,
         img_size: int = 640,
         weights: str = None,
-        classes: Optional[List[int]] = None
-    ) -> DetectionResult:
+        classes: Optional[List[int]] = None,
+        compact: bool = False,
+        image: Optional[np.ndarray] = None
+    ) -> Union[DetectionResult, CompactDetectionResult]:
         """
         执行目标检测
         
@@ -92,62 +200,23 @@ class YOLOv5Detector:
             img_size: 推理图像尺寸
             weights: 模型权重
             classes: 要检测的类别列表
+            compact: 是否返回列式结果
+            image: 已解码的 RGB 图像，提供时不再读取 image_path
             
         Returns:
             DetectionResult: 检测结果
         """
-        start_time = time.time()
-        
-        # 加载模型
-        model = self.load_model(weights)
-        
-        # 设置模型参数
-        model.conf = conf_threshold
-        model.iou = iou_threshold
-        if classes:
-            model.classes = classes
-        
-        # 读取图像获取尺寸
-        img = Image.open(image_path)
-        img_width, img_height = img.size
-        
-        # 执行推理
-        results = model(image_path, size=img_size)
-        
-        # 解析结果
-        detections = []
-        pred = results.pandas().xyxy[0]  # 获取预测结果
-        
-        for idx, row in pred.iterrows():
-            x1, y1, x2, y2 = row['xmin'], row['ymin'], row['xmax'], row['ymax']
-            
-            detection = Detection(
-                id=idx,
-                class_id=int(row['class']),
-                class_name=row['name'],
-                confidence=float(row['confidence']),
-                bbox=BoundingBox(
-                    x=float(x1),
-                    y=float(y1),
-                    width=float(x2 - x1),
-                    height=float(y2 - y1)
-                )
-            )
-            detections.append(detection)
-        
-        inference_time = (time.time() - start_time) * 1000  # 转换为毫秒
-        
-        # 生成图像ID
-        image_id = str(uuid.uuid4())
-        
-        return DetectionResult(
-            image_id=image_id,
-            image_path=image_path,
-            image_width=img_width,
-            image_height=img_height,
-            detections=detections,
-            inference_time=round(inference_time, 2)
-        )
+        return self.detect_batch(
+            [image_path],
+            conf_threshold=conf_threshold,
+            iou_threshold=iou_threshold,
+            img_size=img_size,
+            weights=weights,
+            classes=classes,
+            batch_size=1,
+            compact=compact,
+            images=[image] if image is not None else None
+        )[0]
     
     def detect_batch(
         self,
@@ -156,17 +225,176 @@ class YOLOv5Detector:
         iou_threshold: float = 0.45,
         img_size: int = 640,
         weights: str = None,
-        classes: Optional[List[int]] = None
-    ) -> List[DetectionResult]:
-        """批量检测"""
+        classes: Optional[List[int]] = None,
+        batch_size: Optional[int] = None,
+        compact: Union[bool, List[bool]] = False,
+        configs: Optional[List[InferenceConfig]] = None,
+        images: Optional[List[np.ndarray]] = None
+    ) -> List[Union[DetectionResult, CompactDetectionResult]]:
+        """
+        批量检测
+
+        图像按 batch_size 分为若干微批次，每个微批次只解码一次、
+        letterbox 到同一张量后执行一次前向推理。
+
+        Args:
+            batch_size: 微批次大小，默认使用 settings.DETECT_MAX_BATCH_SIZE
+            compact: 是否返回列式结果，可为逐图列表（结果格式不影响前向推理）
+            configs: 逐图推理参数，提供时覆盖 conf/iou/classes，
+                使参数不同的请求也能共享同一次前向推理
+            images: 已解码的 RGB 图像，提供时不再从 image_paths 读取，
+                image_paths 仅用于填充结果中的路径
+        """
+        model = self.load_model(weights)
+        batch_size = max(1, batch_size or settings.DETECT_MAX_BATCH_SIZE)
+        if configs is None:
+            configs = [InferenceConfig.create(conf_threshold, iou_threshold, classes)] * len(image_paths)
+        compacts = list(compact) if isinstance(compact, (list, tuple)) else [compact] * len(image_paths)
+
         results = []
-        for path in image_paths:
-            result = self.detect(
-                path, conf_threshold, iou_threshold, 
-                img_size, weights, classes
-            )
-            results.append(result)
+        for i in range(0, len(image_paths), batch_size):
+            chunk = image_paths[i:i + batch_size]
+            start_time = time.time()
+
+            if images is not None:
+                chunk_images = images[i:i + batch_size]
+            else:
+                chunk_images = [load_image(path) for path in chunk]
+            preds = self._infer(model, chunk_images, img_size, configs[i:i + batch_size])
+
+            # 微批次耗时平摊到每张图像
+            inference_time = (time.time() - start_time) * 1000 / len(chunk)
+            for path, img, pred, image_compact in zip(chunk, chunk_images, preds, compacts[i:i + batch_size]):
+                results.append(self._build_result(
+                    model, pred, path, img.shape[1], img.shape[0], inference_time, image_compact
+                ))
         return results
+
+    def _infer(
+        self,
+        model: Any,
+        images: List[np.ndarray],
+        img_size: int,
+        configs: List[InferenceConfig]
+    ) -> List[torch.Tensor]:
+        """
+        对一组 RGB 图像执行一次批量前向推理，再按各自的推理参数执行 NMS
+
+        Returns:
+            每张图像一个 (n, 6) 张量，坐标已映射回原图
+        """
+        stride = model.stride
+        stride = int(stride.max()) if isinstance(stride, torch.Tensor) else int(stride)
+
+        # 与 AutoShape 一致：按最大边缩放后取批次内公共尺寸
+        shapes = []
+        for img in images:
+            g = img_size / max(img.shape[:2])
+            shapes.append([int(y * g) for y in img.shape[:2]])
+        shape1 = [int(np.ceil(x / stride) * stride) for x in np.array(shapes).max(0)]
+
+        batch = np.stack([letterbox(img, shape1)[0] for img in images])
+        batch = np.ascontiguousarray(batch.transpose((0, 3, 1, 2)))
+
+        p = next(model.model.parameters())
+        x = torch.from_numpy(batch).to(p.device).type_as(p) / 255
+
+        with torch.no_grad():
+            pred = model.model(x)
+            if isinstance(pred, (list, tuple)):
+                pred = pred[0]
+            preds = [
+                non_max_suppression(
+                    pred[j:j + 1], config.conf_threshold, config.iou_threshold,
+                    list(config.classes) if config.classes else None, config.max_det
+                )[0]
+                for j, config in enumerate(configs)
+            ]
+
+        for img, det in zip(images, preds):
+            self._scale_boxes(shape1, det, img.shape[:2])
+        return preds
+
+    @staticmethod
+    def _scale_boxes(shape1: List[int], det: torch.Tensor, shape0: Tuple[int, int]):
+        """将 letterbox 坐标还原为原图坐标（原地修改）"""
+        gain = min(shape1[0] / shape0[0], shape1[1] / shape0[1])
+        pad_x = (shape1[1] - shape0[1] * gain) / 2
+        pad_y = (shape1[0] - shape0[0] * gain) / 2
+        det[:, [0, 2]] -= pad_x
+        det[:, [1, 3]] -= pad_y
+        det[:, :4] /= gain
+        det[:, [0, 2]] = det[:, [0, 2]].clamp(0, shape0[1])
+        det[:, [1, 3]] = det[:, [1, 3]].clamp(0, shape0[0])
+
+    @staticmethod
+    def _class_names(model: Any) -> np.ndarray:
+        """模型类别名称表（按类别ID索引）"""
+        names = model.names
+        if isinstance(names, dict):
+            names = [names[i] for i in sorted(names)]
+        return np.array(names, dtype=object)
+
+    def _build_result(
+        self,
+        model: Any,
+        pred: torch.Tensor,
+        image_path: str,
+        img_width: int,
+        img_height: int,
+        inference_time: float,
+        compact: bool = False
+    ) -> Union[DetectionResult, CompactDetectionResult]:
+        """
+        将 (n, 6) 预测张量转换为检测结果
+
+        坐标转换与类别名称查找均为整列数组运算，
+        逐目标对象使用 model_construct 构造以跳过重复校验。
+        """
+        arr = pred.detach().cpu().numpy().astype(np.float64)
+        boxes = arr[:, :4].copy()
+        boxes[:, 2:] -= boxes[:, :2]  # xyxy -> xywh
+        scores = arr[:, 4]
+        class_ids = arr[:, 5].astype(np.int64)
+        class_names = self._class_names(model)[class_ids]
+
+        image_id = str(uuid.uuid4())
+        inference_time = round(inference_time, 2)
+
+        if compact:
+            return CompactDetectionResult(
+                image_id=image_id,
+                image_path=image_path,
+                image_width=img_width,
+                image_height=img_height,
+                boxes=boxes.tolist(),
+                scores=scores.tolist(),
+                class_ids=class_ids.tolist(),
+                class_names=dict(zip(class_ids.tolist(), class_names.tolist())),
+                inference_time=inference_time
+            )
+
+        detections = [
+            Detection.model_construct(
+                id=idx,
+                class_id=cls,
+                class_name=name,
+                confidence=conf,
+                bbox=BoundingBox.model_construct(x=x, y=y, width=w, height=h)
+            )
+            for idx, ((x, y, w, h), conf, cls, name) in enumerate(zip(
+                boxes.tolist(), scores.tolist(), class_ids.tolist(), class_names.tolist()
+            ))
+        ]
+
+        return DetectionResult.model_construct(
+            image_id=image_id,
+            image_path=image_path,
+            image_width=img_width,
+            image_height=img_height,
+            detections=detections,
+            inference_time=inference_time
+        )
     
     def get_available_weights(self) -> List[str]:
         """获取可用的权重文件列表"""
@@ -192,6 +420,7 @@ class YOLOv5Detector:
             "device": str(self.device),
             "num_classes": len(model.names),
             "class_names": model.names,
+            "registry": self.registry.stats(),
         }
 
 
@@ -0,0 +1,73 @@
+"""
+任务执行服务
+
+为 async 接口提供有界的线程池与进程池，
+阻塞的文件 I/O 与 CPU 密集计算在池中执行，不占用事件循环。
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+from app.config import settings
+
+
+class TaskExecutor:
+    """线程池 / 进程池执行器封装"""
+
+    def __init__(self):
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def thread_pool(self) -> ThreadPoolExecutor:
+        """I/O 与释放 GIL 的计算（推理、OpenCV）使用的线程池"""
+        if self._thread_pool is None:
+            with self._lock:
+                if self._thread_pool is None:
+                    self._thread_pool = ThreadPoolExecutor(
+                        max_workers=settings.THREAD_POOL_WORKERS,
+                        thread_name_prefix="worker"
+                    )
+        return self._thread_pool
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        """纯 Python / PIL 等受 GIL 限制的计算使用的进程池"""
+        if self._process_pool is None:
+            with self._lock:
+                if self._process_pool is None:
+                    self._process_pool = ProcessPoolExecutor(
+                        max_workers=settings.PROCESS_POOL_WORKERS
+                    )
+        return self._process_pool
+
+    async def run_in_thread(self, func: Callable, *args, **kwargs) -> Any:
+        """在线程池中执行阻塞函数"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.thread_pool, functools.partial(func, *args, **kwargs)
+        )
+
+    async def run_in_process(self, func: Callable, *args, **kwargs) -> Any:
+        """在进程池中执行 CPU 密集函数（函数与参数需可 pickle）"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.process_pool, functools.partial(func, *args, **kwargs)
+        )
+
+    def shutdown(self):
+        """关闭所有池"""
+        with self._lock:
+            if self._thread_pool is not None:
+                self._thread_pool.shutdown(wait=False)
+                self._thread_pool = None
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=False)
+                self._process_pool = None
+
+
+# 全局执行器实例
+task_executor = TaskExecutor()
@@ -0,0 +1,209 @@
+"""
+导出任务
+
+ZIP 条目生成（流式下载与后台任务共用）、后台导出任务，
+以及按保留时间清理 EXPORT_DIR 中的导出产物与对应的任务记录。
+"""
+import io
+import os
+import shutil
+import threading
+import time
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from app.config import settings
+from app.models import ExportRequest, ExportFormat
+from app.services.annotation import annotation_service
+from app.services.exporters import CocoWriter, COCO_INSTANCES_PATH
+from app.services.jobs import job_manager, TERMINAL_STATUSES
+from app.services.zip_stream import write_file_entry, text_entry_info
+
+
+def resolve_image_path(image_path: str) -> Path:
+    """将标注中的图像访问路径（/uploads/...）转换为服务器路径"""
+    return Path(settings.UPLOAD_DIR).parent / image_path.lstrip("/")
+
+
+def write_export_zip(
+    zf: zipfile.ZipFile,
+    request: ExportRequest,
+    progress: Optional[Callable[[int, int], None]] = None,
+    stop_event: Optional[threading.Event] = None
+):
+    """
+    直接从标注存储与原始图像生成 ZIP 条目
+
+    Args:
+        progress: progress(完成数, 跳过数)，每处理一张图像的标注或图像文件后回调
+        stop_event: 置位后尽快停止写入
+    """
+    image_paths = []
+
+    def report(done: int = 0, skipped: int = 0):
+        if progress is not None:
+            progress(done, skipped)
+
+    def documents():
+        for image_id in request.image_ids:
+            if stop_event is not None and stop_event.is_set():
+                return
+            data = annotation_service.get_annotations(image_id, cache=False)
+            if data is None:
+                # 缺失的标注同时计入其图像条目
+                report(skipped=2 if request.include_images else 1)
+                continue
+            if data.get("image_path"):
+                image_paths.append(data["image_path"])
+            yield data
+            report(done=1)
+
+    # 导出标注
+    if request.format == ExportFormat.COCO:
+        with zf.open(text_entry_info(COCO_INSTANCES_PATH), "w") as raw, \
+                io.TextIOWrapper(raw, encoding="utf-8") as entry, \
+                CocoWriter(entry) as writer:
+            for data in documents():
+                writer.add(data)
+    else:
+        for data in documents():
+            arcname, content = annotation_service.render_document(data, request.format)
+            zf.writestr(text_entry_info(arcname), content.encode("utf-8"))
+
+    # 如果需要包含图像
+    if request.include_images:
+        added = set()
+        for image_path in image_paths:
+            if stop_event is not None and stop_event.is_set():
+                return
+            src_path = resolve_image_path(image_path)
+            if src_path.name in added or not src_path.is_file():
+                report(skipped=1)
+                continue
+            added.add(src_path.name)
+            write_file_entry(zf, f"images/{src_path.name}", src_path)
+            report(done=1)
+
+
+def export_artifact_path(job_id: str) -> Path:
+    """导出任务产物路径"""
+    return Path(settings.EXPORT_DIR) / f"export_{job_id}.zip"
+
+
+def run_export_job(job: Dict[str, Any], stop_event: threading.Event) -> Dict[str, Any]:
+    """执行导出任务：写入临时文件，完成后改名为正式产物"""
+    request = ExportRequest(**job["params"])
+    artifact = export_artifact_path(job["job_id"])
+    part_path = artifact.with_name(artifact.name + ".part")
+    job["total"] = len(request.image_ids) * (2 if request.include_images else 1)
+    job["bytes_written"] = 0
+
+    try:
+        with open(part_path, "wb") as f:
+            def progress(done: int, skipped: int):
+                job["bytes_written"] = f.tell()
+                job_manager.advance(job, processed=done, skipped=skipped)
+
+            with zipfile.ZipFile(f, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+                write_export_zip(zf, request, progress, stop_event)
+            job["bytes_written"] = f.tell()
+
+        if stop_event.is_set():
+            part_path.unlink(missing_ok=True)
+            return None
+        os.replace(part_path, artifact)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+
+    return {
+        "file_name": artifact.name,
+        "size": artifact.stat().st_size,
+        "download_url": f"/api/export/jobs/{job['job_id']}/download",
+        "expires_at": time.strftime(
+            "%Y-%m-%dT%H:%M:%S", time.localtime(artifact.stat().st_mtime + settings.EXPORT_RETENTION_TTL)
+        ),
+    }
+
+
+def submit_export_job(request: ExportRequest) -> Dict[str, Any]:
+    """创建并启动导出任务（任务记录持久化，重启后产物仍可下载）"""
+    job = job_manager.create("export", request.model_dump(mode="json"), persist=True)
+    job["bytes_written"] = 0
+    job_manager.start(job, run_export_job)
+    return job_manager.get(job["job_id"])
+
+
+def cleanup_expired_exports(ttl: float = None) -> int:
+    """
+    删除 EXPORT_DIR 中超过保留时间的导出产物，返回删除的条目数
+
+    产物已不存在且结束时间超过保留时间的导出任务一并从任务管理器中移除。
+    """
+    ttl = settings.EXPORT_RETENTION_TTL if ttl is None else ttl
+    export_dir = Path(settings.EXPORT_DIR)
+    if ttl <= 0 or not export_dir.is_dir():
+        return 0
+
+    # 进行中的任务仍在写入，不清理
+    active = {
+        export_artifact_path(job["job_id"]).name + ".part"
+        for job in job_manager.list("export")
+        if job["status"] in ("pending", "running")
+    }
+    deadline = time.time() - ttl
+    count = 0
+    for item in export_dir.iterdir():
+        if item.name == ".gitkeep" or item.name in active:
+            continue
+        try:
+            if item.stat().st_mtime > deadline:
+                continue
+            if item.is_dir():
+                shutil.rmtree(item)
+            else:
+                item.unlink()
+            count += 1
+        except OSError:
+            continue
+
+    for job in job_manager.list("export"):
+        if job["status"] not in TERMINAL_STATUSES or not job["finished_at"]:
+            continue
+        if datetime.fromisoformat(job["finished_at"]).timestamp() > deadline:
+            continue
+        if not export_artifact_path(job["job_id"]).exists():
+            job_manager.evict(job["job_id"])
+    return count
+
+
+class ExportJanitor:
+    """定期清理过期导出产物与已结束任务的后台线程"""
+
+    def __init__(self, interval: float = None):
+        self.interval = interval if interval is not None else settings.EXPORT_CLEANUP_INTERVAL
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="export-janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            cleanup_expired_exports()
+            job_manager.prune()
+            self._stop.wait(self.interval)
+
+
+# 全局导出清理实例
+export_janitor = ExportJanitor()
@@ -0,0 +1,203 @@
+"""
+标注导出格式写出器
+
+单张图像的格式转换按列向量化并直接拼接字符串（不经过 DOM 树），
+数据集级别的导出格式逐张图像增量写出，内存占用与图像数量无关。
+"""
+import json
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Sequence, TextIO, Union
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+# 数据集级 COCO 标注文件在导出目录中的位置
+COCO_INSTANCES_PATH = "annotations/instances.json"
+
+
+def format_yolo_lines(
+    class_ids: Sequence[int],
+    boxes: np.ndarray,
+    image_width: float,
+    image_height: float
+) -> str:
+    """
+    将左上角坐标的 xywh 框转换为 YOLO 标签文本（归一化 xc yc w h）
+
+    Args:
+        class_ids: 每个框的类别ID
+        boxes: (n, 4) 像素坐标 x, y, w, h
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    size = np.array([image_width, image_height] * 2, dtype=np.float64)
+    xywh = np.column_stack((boxes[:, :2] + boxes[:, 2:] / 2, boxes[:, 2:])) / size
+    return "\n".join(
+        f"{cls} {xc:.6f} {yc:.6f} {w:.6f} {h:.6f}"
+        for cls, (xc, yc, w, h) in zip(class_ids, xywh.tolist())
+    )
+
+
+def yolo_text(data: Dict[str, Any]) -> str:
+    """标注文档转换为 YOLO 标签文本"""
+    annotations = data["annotations"]
+    boxes = [
+        (b["x"], b["y"], b["width"], b["height"])
+        for b in (ann["bbox"] for ann in annotations)
+    ]
+    return format_yolo_lines(
+        [ann["class_id"] for ann in annotations], boxes, data["image_width"], data["image_height"]
+    )
+
+
+_VOC_HEADER = """<?xml version="1.0" ?>
+<annotation>
+  <folder>{folder}</folder>
+  <filename>{filename}</filename>
+  <source>
+    <database>Custom</database>
+  </source>
+  <size>
+    <width>{width}</width>
+    <height>{height}</height>
+    <depth>3</depth>
+  </size>
+  <segmented>0</segmented>
+"""
+
+_VOC_OBJECT = """  <object>
+    <name>{name}</name>
+    <pose>Unspecified</pose>
+    <truncated>0</truncated>
+    <difficult>0</difficult>
+    <bndbox>
+      <xmin>{xmin}</xmin>
+      <ymin>{ymin}</ymin>
+      <xmax>{xmax}</xmax>
+      <ymax>{ymax}</ymax>
+    </bndbox>
+  </object>
+"""
+
+
+def voc_xml(data: Dict[str, Any]) -> str:
+    """标注文档转换为 Pascal VOC XML 文本（坐标向下取整）"""
+    image_path = Path(data["image_path"])
+    annotations = data["annotations"]
+    parts = [_VOC_HEADER.format(
+        folder=escape(image_path.parent.name),
+        filename=escape(image_path.name),
+        width=data["image_width"],
+        height=data["image_height"],
+    )]
+    if annotations:
+        boxes = np.array([
+            (b["x"], b["y"], b["width"], b["height"])
+            for b in (ann["bbox"] for ann in annotations)
+        ], dtype=np.float64)
+        corners = np.column_stack((boxes[:, :2], boxes[:, :2] + boxes[:, 2:]))
+        corners = np.trunc(corners).astype(np.int64).tolist()
+        parts.extend(
+            _VOC_OBJECT.format(name=escape(ann["class_name"]), xmin=x1, ymin=y1, xmax=x2, ymax=y2)
+            for ann, (x1, y1, x2, y2) in zip(annotations, corners)
+        )
+    parts.append("</annotation>\n")
+    return "".join(parts)
+
+
+class CocoWriter:
+    """
+    流式写出单个 COCO instances.json
+
+    images 直接写入目标文件，annotations 先写入临时文件，
+    关闭时依次拼接 annotations 与合并后的 categories；
+    图像与标注 ID 在整个数据集内全局递增。
+
+    target 为文件路径时由写出器创建并关闭文件；
+    为文本流（如 ZIP 条目）时只写入，不关闭。
+    """
+
+    def __init__(self, target: Union[Path, TextIO]):
+        if isinstance(target, (str, Path)):
+            self.path = Path(target)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "w", encoding="utf-8")
+            spool_dir = self.path.parent
+        else:
+            self.path = None
+            self._file = target
+            spool_dir = None
+        self._spool = tempfile.TemporaryFile("w+", encoding="utf-8", dir=spool_dir)
+        self._closed = False
+        self._categories: Dict[int, str] = {}
+        self.image_count = 0
+        self.annotation_count = 0
+
+        info = {"description": "Exported annotations", "date_created": datetime.now().isoformat()}
+        self._file.write(f'{{"info":{self._dumps(info)},"images":[')
+
+    @staticmethod
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def add(self, data: Dict[str, Any]) -> int:
+        """写入一张图像及其标注，返回分配的全局图像 ID"""
+        self.image_count += 1
+        image_id = self.image_count
+        image = {
+            "id": image_id,
+            "file_name": Path(data["image_path"]).name,
+            "width": data["image_width"],
+            "height": data["image_height"],
+        }
+        self._file.write(("," if image_id > 1 else "") + self._dumps(image))
+
+        parts = []
+        for ann in data["annotations"]:
+            self.annotation_count += 1
+            bbox = ann["bbox"]
+            parts.append(self._dumps({
+                "id": self.annotation_count,
+                "image_id": image_id,
+                "category_id": ann["class_id"],
+                "bbox": [bbox["x"], bbox["y"], bbox["width"], bbox["height"]],
+                "area": bbox["width"] * bbox["height"],
+                "iscrowd": 0,
+            }))
+            self._categories.setdefault(ann["class_id"], ann["class_name"])
+        if parts:
+            prefix = "," if self.annotation_count > len(parts) else ""
+            self._spool.write(prefix + ",".join(parts))
+        return image_id
+
+    def close(self):
+        """拼接标注与类别表，完成文件"""
+        if self._closed:
+            return
+        self._closed = True
+        self._file.write('],"annotations":[')
+        self._spool.seek(0)
+        shutil.copyfileobj(self._spool, self._file)
+        self._spool.close()
+        categories = [
+            {"id": cid, "name": name, "supercategory": "none"}
+            for cid, name in sorted(self._categories.items())
+        ]
+        self._file.write(f'],"categories":{self._dumps(categories)}}}')
+        if self.path is not None:
+            self._file.close()
+
+    def __enter__(self) -> "CocoWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        self._closed = True
+        self._spool.close()
+        if self.path is not None:
+            self._file.close()
+            self.path.unlink(missing_ok=True)
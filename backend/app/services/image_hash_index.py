@@ -0,0 +1,328 @@
+"""
+近重复图像索引
+
+为自定义数据集与上传目录中的图像维护 64 位 pHash / dHash，
+以 uint64 数组紧凑存储（cache/image_hashes.npz，不在静态文件目录中）。
+Hamming 距离查询对整个数组做异或后统计位数（NumPy 2 的 bitwise_count，
+旧版本按 16 位查表），全部向量化；
+按目录增量同步，只为新增或变化（大小 / 修改时间不同）的文件重新计算哈希。
+"""
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+from app.services.detection_jobs import list_images
+from app.services.executor import task_executor
+from app.services.quality import hash_file
+
+# 哈希类型在哈希数组中的列
+HASH_COLUMNS = {"phash": 0, "dhash": 1}
+
+# 16 位位数表（NumPy 无 bitwise_count 时使用）
+_bitwise_count = getattr(np, "bitwise_count", None)
+_POPCOUNT16 = np.unpackbits(np.arange(1 << 16, dtype=">u2").view(np.uint8)).reshape(-1, 16).sum(
+    axis=1, dtype=np.uint8
+)
+
+# 两两比较时单个分块的最大元素数（控制中间数组大小）
+_BLOCK_ELEMENTS = 1 << 22
+
+
+def hamming(hashes: np.ndarray, query) -> np.ndarray:
+    """uint64 哈希与查询值（标量或可广播数组）的 Hamming 距离（uint8）"""
+    xor = np.ascontiguousarray(np.bitwise_xor(hashes, np.asarray(query, dtype=np.uint64)))
+    if _bitwise_count is not None:
+        return _bitwise_count(xor)
+    return _POPCOUNT16[xor.view(np.uint16)].reshape(xor.shape + (4,)).sum(axis=-1, dtype=np.uint8)
+
+
+def _pixel_count(path: str) -> int:
+    """从文件头读取图像像素数，无法读取时为 0"""
+    try:
+        with Image.open(path) as img:
+            return img.width * img.height
+    except (OSError, ValueError):
+        return 0
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def cluster_hashes(
+    hashes: np.ndarray,
+    radius: int,
+    priority: Callable[[int], Any]
+) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    将 uint64 哈希按 Hamming 距离分簇
+
+    先用并查集找出距离不超过 radius 的连通分量，再在分量内按 priority（越小越优先）贪心分簇：
+    每簇的保留项与其余成员的距离都不超过 radius，
+    避免 A~B、B~C 的传递链把相距较远的 A、C 归入同一簇。
+
+    Returns:
+        成员数大于 1 的簇：(保留项下标, 其余成员下标, 各成员与保留项的距离)
+    """
+    n = len(hashes)
+    groups = _UnionFind(n)
+    block = max(1, _BLOCK_ELEMENTS // max(n, 1))
+    for start in range(0, n, block):
+        # 只与自身及之后的条目比较（上三角）
+        distances = hamming(hashes[start:start + block, None], hashes[None, start:])
+        rows, cols = np.nonzero(distances <= radius)
+        upper = rows < cols
+        for a, b in zip((rows[upper] + start).tolist(), (cols[upper] + start).tolist()):
+            groups.union(a, b)
+
+    components: Dict[int, List[int]] = {}
+    for i in range(n):
+        components.setdefault(groups.find(i), []).append(i)
+
+    result = []
+    for indices in components.values():
+        if len(indices) < 2:
+            continue
+        indices.sort(key=priority)
+        remaining = np.array(indices, dtype=np.int64)
+        while len(remaining) > 1:
+            keep, rest = int(remaining[0]), remaining[1:]
+            distances = hamming(hashes[rest], hashes[keep])
+            close = distances <= radius
+            if close.any():
+                result.append((keep, rest[close], distances[close]))
+            remaining = rest[~close]
+    return result
+
+
+class ImageHashIndex:
+    """图像感知哈希索引（线程安全）"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path or settings.IMAGE_HASH_INDEX_PATH)
+        self._lock = threading.RLock()
+        self._keys: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._hashes = np.zeros((0, 2), dtype=np.uint64)
+        self._stamps = np.zeros((0, 2), dtype=np.int64)  # 文件大小, 修改时间(ns)
+        self._load()
+
+    # ---------- 持久化 ----------
+
+    def _load(self):
+        if not self.path.is_file():
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                keys, hashes, stamps = data["keys"].tolist(), data["hashes"], data["stamps"]
+        except (OSError, ValueError, KeyError):
+            return
+        self._keys = keys
+        self._positions = {key: i for i, key in enumerate(keys)}
+        self._hashes = hashes.astype(np.uint64).reshape(-1, 2)
+        self._stamps = stamps.astype(np.int64).reshape(-1, 2)
+
+    def _save(self):
+        """原子写出索引文件（调用方持有锁）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path.with_name(f".{self.path.stem}.{uuid.uuid4().hex}.tmp.npz")
+        try:
+            np.savez(
+                tmp_file,
+                keys=np.array(self._keys, dtype=str),
+                hashes=self._hashes,
+                stamps=self._stamps,
+            )
+            os.replace(tmp_file, self.path)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+
+    # ---------- 更新 ----------
+
+    @staticmethod
+    def _stamp(path: Path) -> Tuple[int, int]:
+        stat = path.stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def _compute(paths: List[Path]) -> List[Optional[Tuple[int, int]]]:
+        """在进程池中计算哈希"""
+        if not paths:
+            return []
+        return list(task_executor.process_pool.map(hash_file, [str(p) for p in paths], chunksize=16))
+
+    def _apply(self, updates: Dict[str, Tuple[Tuple[int, int], Tuple[int, int]]], removed: Iterable[str]):
+        """批量写入 (哈希, 时间戳) 并删除条目（调用方持有锁）"""
+        removed = {key for key in removed if key in self._positions}
+        new_keys = [key for key in updates if key not in self._positions]
+        if new_keys:
+            self._keys.extend(new_keys)
+            self._hashes = np.vstack([self._hashes, np.zeros((len(new_keys), 2), dtype=np.uint64)])
+            self._stamps = np.vstack([self._stamps, np.zeros((len(new_keys), 2), dtype=np.int64)])
+            start = len(self._positions)
+            self._positions.update((key, start + i) for i, key in enumerate(new_keys))
+        for key, (hashes, stamp) in updates.items():
+            row = self._positions[key]
+            self._hashes[row] = hashes
+            self._stamps[row] = stamp
+        if removed:
+            keep = np.array([key not in removed for key in self._keys], dtype=bool)
+            self._keys = [key for key in self._keys if key not in removed]
+            self._hashes, self._stamps = self._hashes[keep], self._stamps[keep]
+            self._positions = {key: i for i, key in enumerate(self._keys)}
+        if updates or removed:
+            self._save()
+
+    def add_files(self, paths: Iterable[Path]) -> Dict[str, Tuple[int, int]]:
+        """
+        为指定文件计算并写入哈希
+
+        Returns:
+            成功解码的文件 -> (pHash, dHash)
+        """
+        paths = [Path(p).resolve() for p in paths]
+        stamps = [self._stamp(p) for p in paths]
+        computed = self._compute(paths)
+        updates = {
+            str(path): (hashes, stamp)
+            for path, stamp, hashes in zip(paths, stamps, computed)
+            if hashes is not None
+        }
+        with self._lock:
+            self._apply(updates, [str(p) for p, h in zip(paths, computed) if h is None])
+        return {key: hashes for key, (hashes, _) in updates.items()}
+
+    def remove_files(self, paths: Iterable[Path]):
+        """删除指定文件的条目"""
+        with self._lock:
+            self._apply({}, [str(Path(p).resolve()) for p in paths])
+
+    def sync(self, directory: Path) -> Dict[str, int]:
+        """
+        增量同步一个目录（不递归）：新增 / 变化的文件重新计算哈希，已删除的文件移除
+
+        Returns:
+            added / updated / removed / unchanged 计数
+        """
+        directory = Path(directory).resolve()
+        names = list_images(directory)
+        prefix = str(directory) + os.sep
+        with self._lock:
+            current = {
+                key: tuple(self._stamps[i])
+                for key, i in self._positions.items()
+                if key.startswith(prefix) and os.sep not in key[len(prefix):]
+            }
+
+        todo, stamps = [], []
+        for name in names:
+            path = directory / name
+            stamp = self._stamp(path)
+            if current.get(str(path)) != stamp:
+                todo.append(path)
+                stamps.append(stamp)
+        computed = self._compute(todo)
+
+        present = {str(directory / name) for name in names}
+        updates = {
+            str(path): (hashes, stamp)
+            for path, stamp, hashes in zip(todo, stamps, computed)
+            if hashes is not None
+        }
+        removed = [key for key in current if key not in present]
+        removed += [str(p) for p, h in zip(todo, computed) if h is None]
+        with self._lock:
+            self._apply(updates, removed)
+        added = sum(1 for key in updates if key not in current)
+        return {
+            "added": added,
+            "updated": len(updates) - added,
+            "removed": len(removed),
+            "unchanged": len(names) - len(todo),
+        }
+
+    # ---------- 查询 ----------
+
+    def _select(self, directory: Optional[Path], kind: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """目录内（为空时全部）条目的 (键, 哈希列, 文件大小)"""
+        column = HASH_COLUMNS[kind]
+        with self._lock:
+            if directory is None:
+                rows = np.arange(len(self._keys))
+            else:
+                prefix = str(Path(directory).resolve()) + os.sep
+                rows = np.array([
+                    i for i, key in enumerate(self._keys)
+                    if key.startswith(prefix) and os.sep not in key[len(prefix):]
+                ], dtype=np.int64)
+            return [self._keys[i] for i in rows], self._hashes[rows, column], self._stamps[rows, 0]
+
+    def query(
+        self,
+        value: int,
+        radius: int,
+        kind: str = "phash",
+        directory: Optional[Path] = None
+    ) -> List[Dict[str, Any]]:
+        """查找与哈希值 Hamming 距离不超过 radius 的图像（按距离排序）"""
+        keys, hashes, _ = self._select(directory, kind)
+        distances = hamming(hashes, np.uint64(value))
+        matches = np.flatnonzero(distances <= radius)
+        matches = matches[np.argsort(distances[matches], kind="stable")]
+        return [{"path": keys[i], "distance": int(distances[i])} for i in matches]
+
+    def clusters(self, directory: Optional[Path], radius: int, kind: str = "phash") -> List[Dict[str, Any]]:
+        """
+        将目录内的近重复图像分簇（见 cluster_hashes，成员与保留图像的距离都不超过 radius）
+
+        Returns:
+            成员数大于 1 的簇，每簇的 keep 为分辨率最高的成员，duplicates 为其余成员，
+            distances 为各成员与 keep 的距离
+        """
+        keys, hashes, sizes = self._select(directory, kind)
+        # 保留分辨率最高的图像，其次文件最大（压缩损失通常更小），再按路径排序
+        result = [
+            {
+                "keep": keys[keep],
+                "duplicates": [keys[i] for i in members.tolist()],
+                "distances": distances.tolist(),
+                "size": len(members) + 1,
+            }
+            for keep, members, distances in cluster_hashes(
+                hashes, radius, lambda i: (-_pixel_count(keys[i]), -int(sizes[i]), keys[i])
+            )
+        ]
+        result.sort(key=lambda c: c["keep"])
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """索引统计"""
+        with self._lock:
+            return {
+                "entries": len(self._keys),
+                "bytes": int(self._hashes.nbytes + self._stamps.nbytes),
+                "path": str(self.path),
+            }
+
+
+# 全局图像哈希索引实例
+image_hash_index = ImageHashIndex()
@@ -0,0 +1,223 @@
+"""
+后台任务管理
+
+统一管理长时间运行的后台任务（批量检测、导出等）：
+任务在独立线程中执行，提供进度、吞吐量统计与停止控制。
+已结束的任务按保留时间从内存中清理；创建时指定 persist 的任务（如导出任务）
+结束后把记录写入 JOB_STATE_DIR，重启后仍可查询，由产物清理时一并移除。
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config import settings
+
+# 已结束的任务状态
+TERMINAL_STATUSES = ("completed", "partial", "failed", "stopped")
+
+
+class JobManager:
+    """后台任务注册表（线程安全）"""
+
+    def __init__(self, state_dir: Optional[str] = None):
+        self.state_dir = Path(state_dir or settings.JOB_STATE_DIR)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._stop_events: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    # ---------- 持久化 ----------
+
+    def _state_path(self, job_id: str) -> Path:
+        return self.state_dir / f"{job_id}.json"
+
+    def _load(self):
+        """读取持久化的已结束任务（跳过无法解析的文件）"""
+        if not self.state_dir.is_dir():
+            return
+        for path in self.state_dir.glob("*.json"):
+            try:
+                job = json.loads(path.read_text(encoding="utf-8"))
+                job_id = job["job_id"]
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            job["_persist"] = True
+            self._jobs[job_id] = job
+            self._stop_events[job_id] = threading.Event()
+
+    def _save(self, job: Dict[str, Any]):
+        """原子写出任务记录（对外视图）"""
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        path = self._state_path(job["job_id"])
+        tmp_file = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        view = {k: v for k, v in job.items() if not k.startswith("_")}
+        try:
+            tmp_file.write_text(json.dumps(view, ensure_ascii=False, default=str), encoding="utf-8")
+            os.replace(tmp_file, path)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+
+    # ---------- 任务 ----------
+
+    def create(self, kind: str, params: Dict[str, Any], persist: bool = False) -> Dict[str, Any]:
+        """
+        创建任务记录
+
+        Args:
+            persist: 结束后持久化任务记录（产物在重启后仍需通过任务访问时使用）
+        """
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "kind": kind,
+            "status": "pending",
+            "params": params,
+            "total": 0,
+            "processed": 0,
+            "failed": 0,
+            "skipped": 0,
+            "progress": 0.0,
+            "throughput": 0.0,
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "message": "等待执行...",
+            "result": None,
+            "_persist": persist,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._stop_events[job_id] = threading.Event()
+        return job
+
+    def start(
+        self,
+        job: Dict[str, Any],
+        target: Callable[[Dict[str, Any], threading.Event], Any]
+    ) -> threading.Thread:
+        """
+        在后台线程中执行任务
+
+        target(job, stop_event) 负责更新进度，返回值写入 job["result"]。
+        """
+        stop_event = self._stop_events[job["job_id"]]
+
+        def run():
+            job["status"] = "running"
+            job["message"] = "任务进行中..."
+            job["started_at"] = datetime.now().isoformat()
+            job["_start_time"] = time.time()
+            try:
+                job["result"] = target(job, stop_event)
+                if stop_event.is_set():
+                    job["status"] = "stopped"
+                    job["message"] = "任务已手动停止"
+                elif job["failed"] and not (job["processed"] or job["skipped"]):
+                    job["status"] = "failed"
+                    job["message"] = f"全部 {job['failed']} 项处理失败"
+                elif job["failed"]:
+                    job["status"] = "partial"
+                    job["message"] = f"任务完成，{job['failed']} 项处理失败"
+                    job["progress"] = 100.0
+                else:
+                    job["status"] = "completed"
+                    job["message"] = "任务完成"
+                    job["progress"] = 100.0
+            except Exception as e:
+                job["status"] = "failed"
+                job["message"] = str(e)
+            finally:
+                job["finished_at"] = datetime.now().isoformat()
+                self._update_throughput(job)
+                if job.get("_persist"):
+                    try:
+                        self._save(job)
+                    except OSError:
+                        pass
+
+        thread = threading.Thread(target=run, name=f"job-{job['kind']}", daemon=True)
+        thread.start()
+        return thread
+
+    def advance(self, job: Dict[str, Any], processed: int = 0, failed: int = 0, skipped: int = 0):
+        """累加任务进度"""
+        with self._lock:
+            job["processed"] += processed
+            job["failed"] += failed
+            job["skipped"] += skipped
+            done = job["processed"] + job["failed"] + job["skipped"]
+            if job["total"]:
+                job["progress"] = round(min(done / job["total"] * 100, 100.0), 2)
+            self._update_throughput(job)
+
+    @staticmethod
+    def _update_throughput(job: Dict[str, Any]):
+        """按已处理数与耗时计算吞吐量（条/秒）"""
+        start_time = job.get("_start_time")
+        if start_time:
+            elapsed = time.time() - start_time
+            job["elapsed"] = round(elapsed, 2)
+            job["throughput"] = round(job["processed"] / elapsed, 2) if elapsed > 0 else 0.0
+
+    def stop(self, job_id: str) -> bool:
+        """请求停止任务"""
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] not in ("pending", "running"):
+            return False
+        self._stop_events[job_id].set()
+        return True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务（对外视图）"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job["status"] == "running":
+            self._update_throughput(job)
+        return {k: v for k, v in job.items() if not k.startswith("_")}
+
+    def list(self, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """列出任务"""
+        return [
+            self.get(job_id)
+            for job_id, job in list(self._jobs.items())
+            if kind is None or job["kind"] == kind
+        ]
+
+    def evict(self, job_id: str) -> bool:
+        """移除已结束的任务（连同持久化记录），进行中的任务不移除"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] not in TERMINAL_STATUSES:
+                return False
+            del self._jobs[job_id]
+            self._stop_events.pop(job_id, None)
+        self._state_path(job_id).unlink(missing_ok=True)
+        return True
+
+    def prune(self, ttl: float = None) -> int:
+        """
+        移除结束时间早于保留时间的任务，返回移除数
+
+        持久化的任务与其产物一起清理（见 evict），此处跳过。
+        """
+        ttl = settings.JOB_RETENTION_TTL if ttl is None else ttl
+        if ttl <= 0:
+            return 0
+        deadline = datetime.now().timestamp() - ttl
+        expired = [
+            job_id for job_id, job in list(self._jobs.items())
+            if not job.get("_persist") and job["status"] in TERMINAL_STATUSES
+            and job["finished_at"] and datetime.fromisoformat(job["finished_at"]).timestamp() <= deadline
+        ]
+        return sum(1 for job_id in expired if self.evict(job_id))
+
+
+# 全局任务管理器实例
+job_manager = JobManager()
@@ -0,0 +1,159 @@
+"""
+模型注册表
+
+按模型数量与显存/内存字节数限制已加载的模型，
+超出限制时淘汰最久未使用的模型，并在加载后执行预热推理。
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+import torch
+
+from app.config import settings
+
+
+@dataclass
+class _ModelEntry:
+    """已加载的模型"""
+    model: Any
+    nbytes: int
+    load_time: float
+    loaded_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+def model_nbytes(model: Any) -> int:
+    """统计模型参数与缓冲区占用的字节数"""
+    module = getattr(model, "model", model)
+    if not isinstance(module, torch.nn.Module):
+        return 0
+    total = sum(p.numel() * p.element_size() for p in module.parameters())
+    total += sum(b.numel() * b.element_size() for b in module.buffers())
+    return total
+
+
+class ModelRegistry:
+    """带 LRU 淘汰的模型注册表（线程安全）"""
+
+    def __init__(
+        self,
+        max_models: int = None,
+        max_bytes: int = None,
+        warmup_size: int = None
+    ):
+        self.max_models = max_models if max_models is not None else settings.MODEL_CACHE_MAX_MODELS
+        self.max_bytes = max_bytes if max_bytes is not None else settings.MODEL_CACHE_MAX_BYTES
+        self.warmup_size = warmup_size if warmup_size is not None else settings.MODEL_WARMUP_IMG_SIZE
+        self._entries: "OrderedDict[str, _ModelEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        """
+        获取模型，未加载时调用 loader 加载
+
+        同一 key 的并发加载只会执行一次，不同 key 可并行加载。
+        """
+        with self._lock:
+            entry = self._touch(key)
+            if entry is not None:
+                self._stats["hits"] += 1
+                return entry.model
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # 等待期间可能已被其他线程加载
+            with self._lock:
+                entry = self._touch(key)
+                if entry is not None:
+                    self._stats["hits"] += 1
+                    return entry.model
+                self._stats["misses"] += 1
+
+            start_time = time.time()
+            model = loader()
+            self._warmup(model)
+            entry = _ModelEntry(
+                model=model,
+                nbytes=model_nbytes(model),
+                load_time=time.time() - start_time
+            )
+
+            with self._lock:
+                self._entries[key] = entry
+                self._load_locks.pop(key, None)
+                self._evict(keep=key)
+            return model
+
+    def _touch(self, key: str) -> Optional[_ModelEntry]:
+        """标记模型为最近使用（需持有锁）"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            entry.last_used = time.time()
+            entry.hits += 1
+        return entry
+
+    def _evict(self, keep: str):
+        """淘汰最久未使用的模型直到满足数量与字节限制（需持有锁）"""
+        evicted = False
+        while len(self._entries) > 1:
+            over_count = self.max_models > 0 and len(self._entries) > self.max_models
+            over_bytes = self.max_bytes > 0 and self.total_bytes > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+            key = next(k for k in self._entries if k != keep)
+            del self._entries[key]
+            self._stats["evictions"] += 1
+            evicted = True
+
+        if evicted and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _warmup(self, model: Any):
+        """执行一次空输入前向推理，提前完成内存分配与算子初始化"""
+        if self.warmup_size <= 0 or not hasattr(model, "model"):
+            return
+        p = next(model.model.parameters())
+        x = torch.zeros(1, 3, self.warmup_size, self.warmup_size, device=p.device).type_as(p)
+        with torch.no_grad():
+            model.model(x)
+
+    def remove(self, key: str) -> bool:
+        """手动卸载模型"""
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(e.nbytes for e in self._entries.values())
+
+    def stats(self) -> Dict[str, Any]:
+        """获取命中/未命中/淘汰统计及已加载模型列表"""
+        with self._lock:
+            requests = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / requests, 4) if requests else 0,
+                "loaded_models": len(self._entries),
+                "total_bytes": self.total_bytes,
+                "max_models": self.max_models,
+                "max_bytes": self.max_bytes,
+                "models": [
+                    {
+                        "weights": key,
+                        "bytes": e.nbytes,
+                        "hits": e.hits,
+                        "load_time": round(e.load_time, 3),
+                        "loaded_at": e.loaded_at,
+                        "last_used": e.last_used,
+                    }
+                    # 按最近使用排序
+                    for key, e in reversed(self._entries.items())
+                ],
+            }
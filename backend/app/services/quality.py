@@ -0,0 +1,106 @@
+"""
+图像质量指标与感知哈希
+
+一次解码计算模糊度、曝光、分辨率与差值哈希 (dHash)；
+分辨率从文件头读取，可选用缩小解码（JPEG 在 DCT 阶段直接按比例解码）降低开销。
+感知哈希 (pHash/dHash) 均为 64 位整数，供近重复图像检测使用。
+"""
+import hashlib
+import io
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 曝光统计中视为欠曝 / 过曝的像素阈值
+DARK_PIXEL = 5
+BRIGHT_PIXEL = 250
+
+
+def dhash(gray: np.ndarray) -> int:
+    """64 位差值哈希：缩放到 9x8 后比较水平相邻像素"""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def phash(gray: np.ndarray) -> int:
+    """64 位感知哈希：32x32 DCT 的左上 8x8 低频系数与其中位数（不含直流分量）比较"""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def gray_metrics(gray: np.ndarray) -> Dict[str, Any]:
+    """
+    灰度图像的模糊度与曝光指标
+
+    模糊度为拉普拉斯方差；曝光为平均亮度与接近纯黑 / 纯白的像素比例。
+    """
+    laplacian = cv2.Laplacian(gray, cv2.CV_32F)
+    _, std = cv2.meanStdDev(laplacian)
+    hist = np.bincount(gray.ravel(), minlength=256)
+    total = max(int(hist.sum()), 1)
+    return {
+        "blur_score": round(float(std[0, 0]) ** 2, 4),
+        "brightness": round(float(hist @ np.arange(256)) / total, 2),
+        "dark_ratio": round(float(hist[:DARK_PIXEL + 1].sum()) / total, 4),
+        "bright_ratio": round(float(hist[BRIGHT_PIXEL:].sum()) / total, 4),
+        "dhash": f"{dhash(gray):016x}",
+    }
+
+
+def image_info(content: bytes) -> Dict[str, Any]:
+    """从文件头读取图像尺寸、格式与模式（不解码像素）"""
+    with Image.open(io.BytesIO(content)) as img:
+        return {"width": img.width, "height": img.height, "format": img.format, "mode": img.mode}
+
+
+def analyze_content(content: bytes, reduced: bool = False) -> Dict[str, Any]:
+    """
+    计算图像字节的全部质量指标
+
+    Args:
+        reduced: 以 1/2 尺寸解码（模糊度按解码尺寸计算，与全尺寸分数不直接可比）
+    """
+    info = image_info(content)
+    flags = cv2.IMREAD_REDUCED_GRAYSCALE_2 if reduced else cv2.IMREAD_GRAYSCALE
+    gray = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), flags)
+    if gray is None:
+        raise ValueError("无法解码图像")
+    return {**info, **gray_metrics(gray)}
+
+
+def scan_file(path: str, expected_sha1: Optional[str] = None, reduced: bool = False) -> Dict[str, Any]:
+    """
+    读取并分析单个图像文件（在进程池中运行）
+
+    Args:
+        expected_sha1: 缓存中记录的内容哈希；与文件内容一致时跳过解码，
+            只返回 {"sha1": ..., "unchanged": True}
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    sha1 = hashlib.sha1(content).hexdigest()
+    if sha1 == expected_sha1:
+        return {"sha1": sha1, "unchanged": True}
+    return {"sha1": sha1, "metrics": analyze_content(content, reduced)}
+
+
+def hash_content(content: bytes) -> Optional[Tuple[int, int]]:
+    """
+    计算图像字节的 (pHash, dHash)
+
+    以 1/2 尺寸解码即可满足 32x32 的哈希输入；无法解码时返回 None。
+    """
+    gray = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+    if gray is None:
+        return None
+    return phash(gray), dhash(gray)
+
+
+def hash_file(path: str) -> Optional[Tuple[int, int]]:
+    """计算图像文件的 (pHash, dHash)（在进程池中运行）"""
+    return hash_content(np.fromfile(path, dtype=np.uint8))
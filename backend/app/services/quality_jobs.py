@@ -0,0 +1,191 @@
+"""
+数据集质量扫描任务
+
+直接从磁盘扫描自定义数据集某个划分的图像，在进程池中逐张计算
+模糊度、曝光、分辨率与 dHash。结果按文件大小、修改时间与内容哈希缓存
+在数据集目录中，重新扫描时只处理新增或变化的图像。
+"""
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from app.config import settings
+from app.services.augment_jobs import resolve_split, MAX_REPORTED_ERRORS
+from app.services.detection_jobs import list_images
+from app.services.executor import task_executor
+from app.services.image_hash_index import cluster_hashes
+from app.services.jobs import job_manager
+from app.services.quality import scan_file
+
+
+def cache_path(dataset: str, split: str) -> Path:
+    """质量分数缓存文件"""
+    return Path(settings.CUSTOM_DATASET_DIR) / dataset / f".quality_cache_{split}.json"
+
+
+def load_cache(path: Path) -> Dict[str, Dict[str, Any]]:
+    """读取缓存（文件名 -> 条目），不存在或损坏时为空"""
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(path: Path, entries: Dict[str, Dict[str, Any]]):
+    """原子写出缓存"""
+    tmp_file = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        tmp_file.write_text(json.dumps(entries, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp_file, path)
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+
+
+def evaluate(metrics: Dict[str, Any], params: Dict[str, Any]) -> List[str]:
+    """按阈值判定质量问题（阈值不参与缓存，修改阈值无需重新扫描）"""
+    flags = []
+    if metrics["blur_score"] < params["blur_threshold"]:
+        flags.append("blurry")
+    if metrics["brightness"] < params["dark_threshold"]:
+        flags.append("underexposed")
+    if metrics["brightness"] > params["bright_threshold"]:
+        flags.append("overexposed")
+    if min(metrics["width"], metrics["height"]) < params["min_resolution"]:
+        flags.append("low_resolution")
+    return flags
+
+
+def duplicate_groups(entries: Dict[str, Dict[str, Any]], radius: int) -> List[List[str]]:
+    """
+    按 dHash 的 Hamming 距离分组近重复图像
+
+    每组第一项为分辨率最高的图像，其余图像与它的距离都不超过 radius。
+    """
+    names = sorted(entries)
+    metrics = [entries[name]["metrics"] for name in names]
+    hashes = np.array([int(m["dhash"], 16) for m in metrics], dtype=np.uint64)
+    groups = [
+        [names[keep]] + [names[i] for i in members.tolist()]
+        for keep, members, _ in cluster_hashes(
+            hashes, radius, lambda i: (-metrics[i]["width"] * metrics[i]["height"], names[i])
+        )
+    ]
+    return sorted(groups)
+
+
+def summarize(entries: Dict[str, Dict[str, Any]], params: Dict[str, Any]) -> Dict[str, Any]:
+    """汇总扫描结果：各类问题数量、问题图像列表与近重复图像组"""
+    counts = {"blurry": 0, "underexposed": 0, "overexposed": 0, "low_resolution": 0}
+    flagged = []
+    for name, entry in sorted(entries.items()):
+        metrics = entry["metrics"]
+        flags = evaluate(metrics, params)
+        for flag in flags:
+            counts[flag] += 1
+        if flags:
+            flagged.append({"file": name, "flags": flags, **metrics})
+    radius = params.get("duplicate_radius")
+    radius = settings.DUPLICATE_HAMMING_RADIUS if radius is None else radius
+    return {
+        "scanned": len(entries),
+        "counts": counts,
+        "flagged": flagged,
+        "duplicate_groups": duplicate_groups(entries, radius),
+        "duplicate_radius": radius,
+    }
+
+
+def run_quality_scan_job(job: Dict[str, Any], stop_event: threading.Event) -> Dict[str, Any]:
+    """
+    执行质量扫描任务
+
+    大小与修改时间均未变的图像直接使用缓存；修改时间变化但大小相同的图像
+    在工作进程中比对内容哈希，未变化时不解码。停止时保存已完成部分的缓存。
+    """
+    params = job["params"]
+    images_dir, _ = resolve_split(params["dataset"], params["split"])
+    path = cache_path(params["dataset"], params["split"])
+    reduced = bool(params.get("reduced_decode"))
+
+    names = list_images(images_dir)
+    previous = load_cache(path)
+    entries: Dict[str, Dict[str, Any]] = {}
+    job["total"] = len(names)
+
+    todo = []
+    for name in names:
+        stat = (images_dir / name).stat()
+        entry = previous.get(name)
+        reusable = entry is not None and entry.get("reduced") == reduced and entry["size"] == stat.st_size
+        if reusable and entry["mtime_ns"] == stat.st_mtime_ns:
+            entries[name] = entry
+            job["cached"] += 1
+            job_manager.advance(job, skipped=1)
+        else:
+            todo.append((name, stat, entry["sha1"] if reusable else None))
+
+    pool = task_executor.process_pool
+    max_pending = settings.PROCESS_POOL_WORKERS * 4
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            name, stat = pending.pop(future)
+            try:
+                scanned = future.result()
+            except Exception as e:
+                if len(job["errors"]) < MAX_REPORTED_ERRORS:
+                    job["errors"].append({"file": name, "error": str(e)})
+                job_manager.advance(job, failed=1)
+                continue
+            metrics = previous[name]["metrics"] if scanned.get("unchanged") else scanned["metrics"]
+            entries[name] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha1": scanned["sha1"],
+                "reduced": reduced,
+                "metrics": metrics,
+            }
+            if scanned.get("unchanged"):
+                job["cached"] += 1
+                job_manager.advance(job, skipped=1)
+            else:
+                job_manager.advance(job, processed=1)
+
+    try:
+        for name, stat, expected_sha1 in todo:
+            if stop_event.is_set():
+                break
+            future = pool.submit(scan_file, str(images_dir / name), expected_sha1, reduced)
+            pending[future] = (name, stat)
+            if len(pending) >= max_pending:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+        collect(wait(pending).done)
+    finally:
+        # 未扫描到的图像保留原缓存条目，已删除的图像从缓存中移除
+        save_cache(path, {
+            name: entries.get(name) or previous[name]
+            for name in names if name in entries or name in previous
+        })
+
+    result = summarize(entries, params)
+    result["cache_file"] = str(path)
+    return result
+
+
+def submit_quality_scan_job(params: Dict[str, Any]) -> Dict[str, Any]:
+    """创建并启动质量扫描任务"""
+    # 提前校验来源，参数错误时直接返回给调用方
+    resolve_split(params["dataset"], params["split"])
+    job = job_manager.create("quality_scan", params)
+    job["cached"] = 0
+    job["errors"] = []
+    job_manager.start(job, run_quality_scan_job)
+    return job_manager.get(job["job_id"])
@@ -0,0 +1,169 @@
+"""
+推理调度服务
+
+将并发到达的单图检测请求排队，在等待预算内聚合为微批次，
+执行一次前向推理后再把结果分发回各个请求。
+"""
+import asyncio
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import List, Optional, Dict, Any, Tuple, Union
+
+import numpy as np
+
+from app.config import settings
+from app.models import DetectionResult, CompactDetectionResult
+from app.services.detector import detector, InferenceConfig, load_image
+
+
+@dataclass
+class _PendingRequest:
+    """排队中的检测请求"""
+    image_path: str
+    key: Tuple
+    config: InferenceConfig
+    compact: bool = False
+    image: Optional[np.ndarray] = None
+    future: Future = field(default_factory=Future)
+
+
+class InferenceScheduler:
+    """动态微批次推理调度器"""
+
+    def __init__(self, max_batch_size: int = None, max_wait_ms: float = None):
+        self.max_batch_size = max(1, max_batch_size or settings.SCHEDULER_MAX_BATCH_SIZE)
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else settings.SCHEDULER_MAX_WAIT_MS) / 1000
+        self._queue: "queue.Queue[_PendingRequest]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # 调度线程更新、请求线程读取，均需持有 _stats_lock
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "forward_passes": 0}
+
+    def _ensure_started(self):
+        """首次提交时启动调度线程"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="inference-scheduler", daemon=True
+                )
+                self._thread.start()
+
+    def submit(
+        self,
+        image_path: str,
+        conf_threshold: float = 0.25,
+        iou_threshold: float = 0.45,
+        img_size: int = 640,
+        weights: str = None,
+        classes: Optional[List[int]] = None,
+        compact: bool = False,
+        image: Optional[np.ndarray] = None
+    ) -> Future:
+        """
+        提交单图检测请求，返回结果 Future
+
+        Args:
+            image: 已解码的 RGB 图像，提供时不再从 image_path 读取
+        """
+        self._ensure_started()
+        # 阈值与类别过滤只作用于各自的 NMS，结果格式只影响结果构建，均不影响合批
+        key = (weights or settings.DEFAULT_WEIGHTS, img_size)
+        config = InferenceConfig.create(conf_threshold, iou_threshold, classes)
+        request = _PendingRequest(
+            image_path=image_path, key=key, config=config, compact=compact, image=image
+        )
+        self._queue.put(request)
+        return request.future
+
+    async def detect(
+        self, image_path: str, **kwargs
+    ) -> Union[DetectionResult, CompactDetectionResult]:
+        """在事件循环中等待调度结果"""
+        return await asyncio.wrap_future(self.submit(image_path, **kwargs))
+
+    def stats(self) -> Dict[str, Any]:
+        """获取调度统计"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["avg_batch_size"] = (
+            round(stats["requests"] / stats["forward_passes"], 2) if stats["forward_passes"] else 0
+        )
+        stats["queue_size"] = self._queue.qsize()
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_wait_ms"] = self.max_wait * 1000
+        return stats
+
+    def _collect(self) -> List[_PendingRequest]:
+        """阻塞等待首个请求，然后在等待预算内尽量凑满一个批次"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """调度线程主循环"""
+        while True:
+            # 丢弃已被取消的请求（例如客户端已断开）
+            batch = [r for r in self._collect() if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            with self._stats_lock:
+                self._stats["batches"] += 1
+
+            # 权重与输入尺寸相同的请求共享一次前向推理
+            groups: Dict[Tuple, List[_PendingRequest]] = defaultdict(list)
+            for request in batch:
+                groups[request.key].append(request)
+
+            for key, requests in groups.items():
+                self._execute(key, requests)
+
+    def _execute(self, key: Tuple, requests: List[_PendingRequest]):
+        """执行一组请求并分发结果"""
+        weights, img_size = key
+        try:
+            images = [
+                r.image if r.image is not None else load_image(r.image_path)
+                for r in requests
+            ]
+            results = detector.detect_batch(
+                [r.image_path for r in requests],
+                img_size=img_size,
+                weights=weights,
+                batch_size=len(requests),
+                compact=[r.compact for r in requests],
+                configs=[r.config for r in requests],
+                images=images
+            )
+        except Exception as e:
+            if len(requests) == 1:
+                requests[0].future.set_exception(e)
+                return
+            # 单张坏图不应拖垮整批，逐个重试以隔离错误
+            for request in requests:
+                self._execute(key, [request])
+            return
+
+        with self._stats_lock:
+            self._stats["requests"] += len(requests)
+            self._stats["forward_passes"] += 1
+        for request, result in zip(requests, results):
+            request.future.set_result(result)
+
+
+# 全局推理调度器实例
+inference_scheduler = InferenceScheduler()